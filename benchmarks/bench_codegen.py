@@ -0,0 +1,101 @@
+"""
+Microbenchmark for the compiled per-model functions.
+
+Compares the compiled serializer, hydrator and hash function against the
+reflective implementation which walks the class attributes of the model.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_codegen
+"""
+
+import datetime
+import timeit
+
+from src.nofeardb.codegen import CompiledModel
+from src.nofeardb.datatypes import DateTime, Float, Integer, String
+from src.nofeardb.orm import Document, Field
+
+FIELD_COUNT = 24
+REPEAT = 5
+NUMBER = 2000
+
+
+def _create_wide_model():
+    attributes = {}
+    for index in range(FIELD_COUNT):
+        datatype = [String, Integer, Float, DateTime][index % 4]
+        attributes["field_" + str(index)] = Field(datatype)
+
+    return type("WideDoc", (Document,), attributes)
+
+
+def _create_document(model):
+    doc = model()
+    for name, attr in vars(model).items():
+        if isinstance(attr, Field):
+            if attr._datatype is String:
+                setattr(doc, name, "value of " + name)
+            elif attr._datatype is Integer:
+                setattr(doc, name, 38)
+            elif attr._datatype is Float:
+                setattr(doc, name, 3.8)
+            else:
+                setattr(doc, name, datetime.datetime.now())
+
+    return doc
+
+
+def reflective_to_json(doc):
+    """serializes the document by reflecting over the model attributes"""
+    doc_json = {}
+    for name, attr in vars(doc.__class__).items():
+        doc_json["id"] = str(doc.__id__)
+        if isinstance(attr, Field):
+            field_type = getattr(doc, name + "__datatype")
+            doc_json[name] = field_type.serialize(getattr(doc, name))
+
+    return doc_json
+
+
+def reflective_from_json(doc, data):
+    """hydrates the document by reflecting over the model attributes"""
+    for name, attr in vars(doc.__class__).items():
+        value = data.get(name)
+        if isinstance(attr, Field) and value is not None:
+            setattr(doc, name, value)
+
+
+def _best(statement):
+    return min(timeit.repeat(statement, repeat=REPEAT, number=NUMBER)) / NUMBER
+
+
+def main():
+    """runs the benchmark and prints the time per document"""
+    model = _create_wide_model()
+    compiled = CompiledModel(model)
+    doc = _create_document(model)
+    data = compiled.to_json(doc)
+
+    results = [
+        ("serialize", lambda: reflective_to_json(doc),
+         lambda: compiled.to_json(doc)),
+        ("hydrate", lambda: reflective_from_json(model(), data),
+         lambda: compiled.from_json(model(), data)),
+        ("hash", doc.get_hash, lambda: compiled.hash(doc)),
+    ]
+
+    print("model with " + str(FIELD_COUNT) + " fields, time per document:")
+    for name, reflective, generated in results:
+        reflective_time = _best(reflective)
+        generated_time = _best(generated)
+        print(
+            "  {:<10} reflective {:8.2f} us  compiled {:8.2f} us  speedup {:5.2f}x".format(
+                name,
+                reflective_time * 1e6,
+                generated_time * 1e6,
+                reflective_time / generated_time))
+
+
+if __name__ == "__main__":
+    main()
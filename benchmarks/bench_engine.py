@@ -0,0 +1,190 @@
+"""
+Benchmark suite for the storage engines.
+
+Measures create, update, delete, cold and warm reads, where filters and
+lazy loading of relationships on synthetic employee data (see
+:mod:`benchmarks.generators`) for several collection sizes. The results
+are written as JSON, so they can be compared between releases.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_engine
+    python -m benchmarks.bench_engine --sizes 1000 10000 --engine segment --output results.json
+
+Without sharding, every lookup of a single document lists the whole collection,
+so large sizes should be run with ``--shard-length 2``.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import src.nofeardb.expr as expr
+from src.nofeardb.engine import StorageEngine
+from src.nofeardb.segments import SegmentStorageEngine
+
+from .generators import (
+    MODELS, PAYCHECKS_PER_EMPLOYEE, BenchEmployee,
+    generate_departments, generate_employees, generate_projects
+)
+
+SIZES = [1000, 10000, 100000]
+SAMPLE_SIZE = 1000
+ENGINES = {
+    "file": StorageEngine,
+    "segment": SegmentStorageEngine,
+}
+
+
+def _create_engine(engine_name: str, root: str, shard_length: int = 0):
+    engine = ENGINES[engine_name](root, shard_length=shard_length)
+    engine.register_models(MODELS)
+    return engine
+
+
+def _close_engine(engine):
+    if hasattr(engine, "close"):
+        engine.close()
+
+
+class _Timer:
+
+    def __init__(self):
+        self.seconds = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = time.perf_counter() - self._start
+
+
+def _result(size: int, operation: str, count: int, seconds: float) -> dict:
+    return {
+        "size": size,
+        "operation": operation,
+        "count": count,
+        "seconds": seconds,
+        "ops_per_second": count / seconds if seconds > 0 else None,
+    }
+
+
+def run_size(engine_name: str, root: str, size: int, shard_length: int = 0) -> list:
+    """runs all measurements for one collection size and returns the results"""
+    results = []
+    engine = _create_engine(engine_name, root, shard_length)
+
+    departments = generate_departments(size)
+    projects = generate_projects(size)
+    for doc in departments + projects:
+        engine.create(doc)
+
+    with _Timer() as timer:
+        for employee in generate_employees(size, departments, projects):
+            engine.create(employee)
+    results.append(_result(size, "create", size, timer.seconds))
+    _close_engine(engine)
+
+    engine = _create_engine(engine_name, root, shard_length)
+    with _Timer() as timer:
+        employees = engine.read(BenchEmployee).all()
+    results.append(_result(size, "read_cold", len(employees), timer.seconds))
+
+    with _Timer() as timer:
+        employees = engine.read(BenchEmployee).all()
+    results.append(_result(size, "read_warm", len(employees), timer.seconds))
+
+    with _Timer() as timer:
+        result = engine.read(BenchEmployee).where(expr.and_(
+            expr.gte("number", size // 4),
+            expr.lt("number", size // 2)
+        )).all()
+    results.append(_result(size, "where_field", len(result), timer.seconds))
+
+    with _Timer() as timer:
+        result = engine.read(BenchEmployee).where(
+            expr.eq("department.name", "department_0")).all()
+    results.append(_result(size, "where_join", len(result), timer.seconds))
+
+    sample = employees[:SAMPLE_SIZE]
+    with _Timer() as timer:
+        for employee in sample:
+            for paycheck in employee.paychecks:
+                paycheck.amount  # pylint: disable=pointless-statement
+    results.append(_result(
+        size, "lazy_load", len(sample) * PAYCHECKS_PER_EMPLOYEE, timer.seconds))
+
+    with _Timer() as timer:
+        for employee in sample:
+            employee.number = employee.number + size
+            engine.update(employee)
+    results.append(_result(size, "update", len(sample), timer.seconds))
+
+    _close_engine(engine)
+
+    # delete documents whose relationships were not loaded yet
+    engine = _create_engine(engine_name, root, shard_length)
+    sample = engine.read(BenchEmployee).limit(SAMPLE_SIZE).all()
+    with _Timer() as timer:
+        for employee in sample:
+            engine.delete(employee)
+    results.append(_result(size, "delete", len(sample), timer.seconds))
+    _close_engine(engine)
+
+    return results
+
+
+def main(argv=None):
+    """runs the benchmark suite and writes the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES,
+                        help="numbers of employees to benchmark")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="file",
+                        help="storage engine to benchmark")
+    parser.add_argument("--shard-length", type=int, default=0,
+                        help="shard length of the collections")
+    parser.add_argument("--root", default=None,
+                        help="directory for the databases, defaults to a temporary directory")
+    parser.add_argument("--output", default=None,
+                        help="JSON output file, defaults to stdout")
+    args = parser.parse_args(argv)
+
+    report = {
+        "engine": args.engine,
+        "shard_length": args.shard_length,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now().isoformat(),
+        "results": [],
+    }
+    for size in args.sizes:
+        root = tempfile.mkdtemp(prefix="nofeardb_bench_", dir=args.root)
+        try:
+            report["results"].extend(run_size(
+                args.engine, root, size, args.shard_length))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+        for result in report["results"]:
+            if result["size"] == size:
+                sys.stderr.write("{:>8} {:<12} {:10.3f} s {:12.0f} ops/s\n".format(
+                    size, result["operation"], result["seconds"],
+                    result["ops_per_second"] or 0))
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write(os.linesep)
+    else:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
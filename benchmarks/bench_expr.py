@@ -0,0 +1,91 @@
+"""
+Microbenchmark for the evaluation of where expressions.
+
+Measures the per row cost of evaluating an expression on document instances,
+through evaluate_with on document data and through the compiled predicate.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_expr
+"""
+
+import time
+
+import src.nofeardb.expr as expr
+from src.nofeardb.datatypes import Integer, String
+from src.nofeardb.orm import Document, Field
+
+ROW_COUNT = 100000
+REPEAT = 3
+
+
+class BenchDoc(Document):
+    __documentname__ = "bench_doc"
+
+    number = Field(Integer)
+    category = Field(String)
+    name = Field(String)
+
+
+def _create_rows():
+    docs = []
+    datas = []
+    for index in range(ROW_COUNT):
+        doc = BenchDoc()
+        doc.number = index
+        doc.category = "category_" + str(index % 10)
+        doc.name = "name_" + str(index)
+        docs.append(doc)
+        datas.append({
+            "number": index,
+            "category": doc.category,
+            "name": doc.name
+        })
+
+    return docs, datas
+
+
+def _get_data_value(item, attr_name):
+    return item.get(attr_name)
+
+
+def _measure(function):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best / ROW_COUNT * 1e9
+
+
+def main():
+    docs, datas = _create_rows()
+    expression = expr.and_(
+        expr.is_in("category", ["category_1", "category_3", "category_7"]),
+        expr.or_(
+            expr.lt("number", ROW_COUNT // 4),
+            expr.gte("number", ROW_COUNT // 2)
+        )
+    )
+    predicate = expression.compile()
+
+    results = [
+        ("evaluate on documents",
+         _measure(lambda: [expression.evaluate(doc) for doc in docs])),
+        ("evaluate_with on data",
+         _measure(lambda: [expression.evaluate_with(_get_data_value, data) for data in datas])),
+        ("compiled on documents",
+         _measure(lambda: [predicate(getattr, doc) for doc in docs])),
+        ("compiled on data",
+         _measure(lambda: [predicate(_get_data_value, data) for data in datas])),
+    ]
+
+    print("rows: " + str(ROW_COUNT))
+    for name, nanoseconds in results:
+        print(name.ljust(24) + ("%.0f ns/row" % nanoseconds).rjust(14))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Benchmark for the document codecs.
+
+Measures encoded size and decode throughput of every available codec
+on synthetic employee documents.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_formats
+"""
+
+import datetime
+import timeit
+import uuid
+
+from src.nofeardb.formats import CODECS
+
+DOCUMENT_COUNT = 1000
+REPEAT = 5
+
+
+def _create_documents():
+    documents = []
+    for index in range(DOCUMENT_COUNT):
+        documents.append({
+            "id": str(uuid.uuid4()),
+            "name": "Employee " + str(index),
+            "number": index,
+            "salary": 3000.0 + index,
+            "active": str(index % 2 == 0),
+            "hired": datetime.datetime(2020, 1, 1, 8, 0, 0, 1).isoformat(),
+            "department": [str(uuid.uuid4())],
+            "paychecks": [str(uuid.uuid4()) for _ in range(12)],
+        })
+
+    return documents
+
+
+def main():
+    """runs the benchmark and prints size and decode throughput per codec"""
+    documents = _create_documents()
+
+    print(str(DOCUMENT_COUNT) + " documents:")
+    for name, codec_class in CODECS.items():
+        try:
+            codec = codec_class()
+        except RuntimeError:
+            print("  {:<10} not available".format(name))
+            continue
+
+        encoded = [codec.encode(doc) for doc in documents]
+        size = sum(len(raw) for raw in encoded)
+        decode_time = min(timeit.repeat(
+            lambda: [codec.decode(raw) for raw in encoded],
+            repeat=REPEAT, number=1))
+
+        print(
+            "  {:<10} {:9d} bytes  {:7.1f} bytes/doc  {:10.0f} docs/s decoded".format(
+                name, size, size / DOCUMENT_COUNT, DOCUMENT_COUNT / decode_time))
+
+
+if __name__ == "__main__":
+    main()
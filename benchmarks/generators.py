@@ -0,0 +1,96 @@
+"""
+Synthetic data for the engine benchmarks.
+
+Employees belong to a department (ManyToOne), have paychecks (OneToMany)
+and work on projects (ManyToMany). The generated data is deterministic
+for a given number of employees.
+"""
+
+import datetime
+import random
+
+from src.nofeardb.datatypes import DateTime, Float, Integer, String
+from src.nofeardb.orm import Document, Field, ManyToMany, ManyToOne, OneToMany
+
+EMPLOYEES_PER_DEPARTMENT = 100
+EMPLOYEES_PER_PROJECT = 50
+PAYCHECKS_PER_EMPLOYEE = 2
+PROJECTS_PER_EMPLOYEE = 2
+SEED = 38
+
+
+class BenchDepartment(Document):
+    __documentname__ = "bench_department"
+
+    name = Field(String)
+    employees = OneToMany("BenchEmployee", back_populates="department")
+
+
+class BenchEmployee(Document):
+    __documentname__ = "bench_employee"
+
+    name = Field(String)
+    number = Field(Integer)
+    hired = Field(DateTime)
+    department = ManyToOne("BenchDepartment", back_populates="employees")
+    paychecks = OneToMany(
+        "BenchPaycheck", back_populates="employee", cascade=["delete"])
+    projects = ManyToMany("BenchProject", back_populates="employees")
+
+
+class BenchPaycheck(Document):
+    __documentname__ = "bench_paycheck"
+
+    amount = Field(Float)
+    employee = ManyToOne("BenchEmployee", back_populates="paychecks")
+
+
+class BenchProject(Document):
+    __documentname__ = "bench_project"
+
+    name = Field(String)
+    employees = ManyToMany("BenchEmployee", back_populates="projects")
+
+
+MODELS = [BenchDepartment, BenchEmployee, BenchPaycheck, BenchProject]
+
+
+def generate_departments(employee_count: int) -> list:
+    """creates the (unsaved) departments for the number of employees"""
+    return [_create_named(BenchDepartment, "department_", index)
+            for index in range(max(1, employee_count // EMPLOYEES_PER_DEPARTMENT))]
+
+
+def generate_projects(employee_count: int) -> list:
+    """creates the (unsaved) projects for the number of employees"""
+    return [_create_named(BenchProject, "project_", index)
+            for index in range(max(1, employee_count // EMPLOYEES_PER_PROJECT))]
+
+
+def generate_employees(employee_count: int, departments: list, projects: list):
+    """
+    yields (unsaved) employees with their paychecks, related to the
+    given departments and projects.
+    """
+    rand = random.Random(SEED)
+    hired = datetime.datetime(2020, 1, 1, 8, 0, 0)
+    for index in range(employee_count):
+        employee = BenchEmployee()
+        employee.name = "employee_" + str(index)
+        employee.number = index
+        employee.hired = hired + datetime.timedelta(hours=index)
+        employee.department = departments[index % len(departments)]
+        for _ in range(PAYCHECKS_PER_EMPLOYEE):
+            paycheck = BenchPaycheck()
+            paycheck.amount = round(rand.uniform(2000.0, 6000.0), 2)
+            employee.paychecks.append(paycheck)
+        for project in rand.sample(projects, min(PROJECTS_PER_EMPLOYEE, len(projects))):
+            employee.projects.append(project)
+
+        yield employee
+
+
+def _create_named(doc_type: type, prefix: str, index: int) -> Document:
+    doc = doc_type()
+    doc.name = prefix + str(index)
+    return doc
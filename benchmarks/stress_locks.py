@@ -0,0 +1,346 @@
+"""
+Stress harness for concurrent writers.
+
+Spawns several processes which read and update documents in a shared
+database root at the same time. Every process owns some documents, which
+only it updates, and all processes update a few shared documents. The
+harness reports the throughput, the rate of failed lock attempts and the
+lock hold times, and checks the database for consistency afterwards:
+
+- every document file can be decoded and matches the hash in its name
+- no document is stored in more than one file
+- no temporary or lock files are left behind
+- every owned document has the value its process wrote last
+  (unless an update of the document failed with an error)
+- no document lock was held by two processes at the same time
+
+Run from the repository root:
+
+    python -m benchmarks.stress_locks
+    python -m benchmarks.stress_locks --processes 8 --duration 30 --roots /dev/shm /var/tmp
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import src.nofeardb.engine as engine_module
+import src.nofeardb.expr as expr
+from src.nofeardb.datatypes import Integer, String
+from src.nofeardb.exceptions import DocumentLockException, NoResultFoundException
+from src.nofeardb.orm import Document, Field
+
+OWNED_DOCUMENTS = 5
+SHARED_DOCUMENTS = 3
+OPERATIONS = ("read", "update_owned", "update_shared")
+OPERATION_WEIGHTS = (0.5, 0.3, 0.2)
+
+
+class StressDoc(Document):
+    __documentname__ = "stress_doc"
+
+    owner = Field(Integer)
+    value = Field(Integer)
+    name = Field(String)
+
+
+class _TimedLock(engine_module.DocumentLock):
+    """Document lock recording when it was held"""
+
+    holds = []
+
+    def __init__(self, storage_engine, document, expiration=60):
+        super().__init__(storage_engine, document, expiration)
+        self._doc_id = str(document.__id__)
+        self._acquired = None
+
+    def lock(self):
+        super().lock()
+        self._acquired = time.time()
+
+    def release(self):
+        # taken before the lock file is removed, the next holder can only start afterwards
+        released = time.time()
+        super().release()
+        if self._acquired is not None:
+            _TimedLock.holds.append((self._doc_id, self._acquired, released))
+            self._acquired = None
+
+
+def _create_engine(root: str):
+    engine = engine_module.StorageEngine(root)
+    engine.register_models([StressDoc])
+    return engine
+
+
+def _read_document(engine, doc_id: str):
+    """reads a document, returns None if it is not found (e.g. while it is replaced)"""
+    try:
+        return engine.read(StressDoc).where(expr.eq("id", doc_id)).first()
+    except NoResultFoundException:
+        return None
+
+
+def _worker(root: str, worker_index: int, owned_ids: list, shared_ids: list,
+            duration: float, seed: int, results):
+    # the engine creates its locks through the module global
+    engine_module.DocumentLock = _TimedLock
+    engine = _create_engine(root)
+    rand = random.Random(seed)
+    counts = {name: 0 for name in OPERATIONS}
+    lock_failures = {name: 0 for name in OPERATIONS}
+    errors = {}
+    read_misses = 0
+    last_values = {}
+    shared_increments = 0
+
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        operation = rand.choices(OPERATIONS, OPERATION_WEIGHTS)[0]
+        doc_id = rand.choice(
+            owned_ids if operation == "update_owned" else
+            shared_ids if operation == "update_shared" else owned_ids + shared_ids)
+        try:
+            doc = _read_document(engine, doc_id)
+            if doc is None:
+                read_misses += 1
+                continue
+
+            if operation != "read":
+                doc.value = doc.value + 1
+                engine.update(doc)
+        except DocumentLockException:
+            lock_failures[operation] += 1
+            continue
+        except Exception as e:  # pylint: disable=broad-except
+            error = operation + ": " + e.__class__.__name__
+            errors[error] = errors.get(error, 0) + 1
+            if operation == "update_owned":
+                # the value written last is unknown
+                last_values.pop(doc_id, None)
+            continue
+
+        counts[operation] += 1
+        if operation == "update_owned":
+            last_values[doc_id] = doc.value
+        elif operation == "update_shared":
+            shared_increments += 1
+
+    results.put({
+        "worker": worker_index,
+        "counts": counts,
+        "lock_failures": lock_failures,
+        "errors": errors,
+        "read_misses": read_misses,
+        "last_values": last_values,
+        "shared_increments": shared_increments,
+        "holds": _TimedLock.holds,
+    })
+
+
+def _percentile(values: list, percentile: float) -> float:
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile / 100.0 * (len(values) - 1))))]
+
+
+def _find_lock_overlaps(worker_results: list) -> list:
+    """finds document locks which were held by two processes at the same time"""
+    holds_by_doc = {}
+    for result in worker_results:
+        for doc_id, start, end in result["holds"]:
+            holds_by_doc.setdefault(doc_id, []).append((start, end, result["worker"]))
+
+    overlaps = []
+    for doc_id, holds in holds_by_doc.items():
+        holds.sort()
+        latest_end, latest_worker = None, None
+        for start, end, worker in holds:
+            if latest_end is not None and start < latest_end and worker != latest_worker:
+                overlaps.append("lock of " + doc_id + " held by workers "
+                                + str(latest_worker) + " and " + str(worker))
+            if latest_end is None or end > latest_end:
+                latest_end, latest_worker = end, worker
+
+    return overlaps
+
+
+def check_consistency(root: str, expected_values: dict) -> list:
+    """checks the database files and the owned documents, returns the violations"""
+    violations = []
+    engine = _create_engine(root)
+    compiled = engine._get_compiled_model(StressDoc)
+    base_path = engine.get_doc_basepath(StressDoc)
+    files_by_id = {}
+    for name in os.listdir(base_path):
+        path = os.path.join(base_path, name)
+        if name.endswith(".tmp") or name.endswith(".lock"):
+            violations.append("left over file " + name)
+            continue
+
+        doc_id, doc_hash = engine._extract_id_and_hash_from_filename(path)
+        files_by_id.setdefault(doc_id, []).append(name)
+        data = engine._read_document_from_disk(path)
+        if data is None:
+            violations.append("unreadable document file " + name)
+            continue
+
+        del data["__doc_hash__"]
+        doc = engine._create_document(StressDoc, data)
+        if compiled.hash(doc, engine._hash_function) != doc_hash:
+            violations.append("hash mismatch in " + name)
+
+    for doc_id, names in files_by_id.items():
+        if len(names) > 1:
+            violations.append(
+                "document " + str(doc_id) + " stored in " + str(len(names)) + " files")
+
+    for doc_id, value in expected_values.items():
+        doc = _read_document(engine, doc_id)
+        if doc is None:
+            violations.append("owned document " + doc_id + " is missing")
+        elif doc.value != value:
+            violations.append(
+                "owned document " + doc_id + " has value " + str(doc.value)
+                + " instead of " + str(value))
+
+    return violations
+
+
+def run(root: str, processes: int, duration: float) -> dict:
+    """runs the stress test on a database root and returns the report"""
+    engine = _create_engine(root)
+    owned_ids = []
+    for worker_index in range(processes):
+        ids = []
+        for _ in range(OWNED_DOCUMENTS):
+            doc = StressDoc()
+            doc.owner = worker_index
+            doc.value = 0
+            doc.name = "owned"
+            engine.create(doc)
+            ids.append(str(doc.__id__))
+        owned_ids.append(ids)
+
+    shared_ids = []
+    for _ in range(SHARED_DOCUMENTS):
+        doc = StressDoc()
+        doc.value = 0
+        doc.name = "shared"
+        engine.create(doc)
+        shared_ids.append(str(doc.__id__))
+
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=_worker, args=(
+            root, worker_index, owned_ids[worker_index], shared_ids, duration,
+            worker_index, results))
+        for worker_index in range(processes)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    worker_results = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    expected_values = {}
+    for result in worker_results:
+        expected_values.update(result["last_values"])
+
+    counts = {name: sum(result["counts"][name] for result in worker_results)
+              for name in OPERATIONS}
+    lock_failures = {name: sum(result["lock_failures"][name] for result in worker_results)
+                     for name in OPERATIONS}
+    hold_times = [end - start for result in worker_results
+                  for _, start, end in result["holds"]]
+    errors = {}
+    for result in worker_results:
+        for error, count in result["errors"].items():
+            errors[error] = errors.get(error, 0) + count
+    final_shared = sum(_read_document(_create_engine(root), doc_id).value
+                       for doc_id in shared_ids)
+
+    return {
+        "root": root,
+        "processes": processes,
+        "seconds": elapsed,
+        "ops_per_second": {name: counts[name] / elapsed for name in OPERATIONS},
+        "operations": counts,
+        "lock_failures": lock_failures,
+        "lock_failure_rate": {
+            name: (lock_failures[name] / float(lock_failures[name] + counts[name])
+                   if lock_failures[name] + counts[name] > 0 else 0.0)
+            for name in OPERATIONS if name != "read"
+        },
+        "lock_hold_seconds": {
+            "count": len(hold_times),
+            "p50": _percentile(hold_times, 50),
+            "p90": _percentile(hold_times, 90),
+            "p99": _percentile(hold_times, 99),
+            "max": max(hold_times) if len(hold_times) > 0 else None,
+        },
+        "errors": errors,
+        "read_misses": sum(result["read_misses"] for result in worker_results),
+        # updates of shared documents are not isolated, so concurrent
+        # read-modify-write cycles can overwrite each other
+        "lost_shared_updates": sum(
+            result["shared_increments"] for result in worker_results) - final_shared,
+        "violations": check_consistency(root, expected_values)
+        + _find_lock_overlaps(worker_results),
+    }
+
+
+def _default_roots() -> list:
+    roots = []
+    if os.path.isdir("/dev/shm"):
+        roots.append("/dev/shm")
+    roots.append(tempfile.gettempdir())
+    return roots
+
+
+def main(argv=None):
+    """runs the stress test on every root and writes the reports as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--processes", type=int, default=4,
+                        help="number of writing processes")
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="seconds every process runs")
+    parser.add_argument("--roots", nargs="+", default=None,
+                        help="directories to create the databases in (e.g. tmpfs and disk)")
+    parser.add_argument("--output", default=None,
+                        help="JSON output file, defaults to stdout")
+    args = parser.parse_args(argv)
+
+    reports = []
+    for parent in args.roots or _default_roots():
+        root = tempfile.mkdtemp(prefix="nofeardb_stress_", dir=parent)
+        try:
+            report = run(root, args.processes, args.duration)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+        reports.append(report)
+        sys.stderr.write("{}: {:.0f} ops/s, {} lock failures, {} errors, {} violations\n".format(
+            parent, sum(report["ops_per_second"].values()),
+            sum(report["lock_failures"].values()), sum(report["errors"].values()),
+            len(report["violations"])))
+
+    if args.output is None:
+        json.dump(reports, sys.stdout, indent=2)
+        sys.stdout.write(os.linesep)
+    else:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(reports, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+NofearDB aggregation functions
+"""
+
+from abc import ABC, abstractmethod
+
+
+class Aggregate(ABC):
+    """
+    Aggregation of the values of a document attribute.
+    The aggregation is computed on a state, states of partial
+    aggregations can be merged.
+    """
+
+    def __init__(self, attr_name: str = None):
+        self.attr_name = attr_name
+
+    @abstractmethod
+    def create(self):
+        """create the initial state"""
+
+    @abstractmethod
+    def add(self, state, value):
+        """add a value to the state and return the new state"""
+
+    @abstractmethod
+    def merge(self, state, other):
+        """merge two states and return the merged state"""
+
+    def result(self, state):
+        """get the result of the state"""
+        return state
+
+
+class Count(Aggregate):
+    """Counts the documents or the values of an attribute, see :func:`count`"""
+
+    def create(self):
+        return 0
+
+    def add(self, state, value):
+        if value is None:
+            return state
+        return state + 1
+
+    def merge(self, state, other):
+        return state + other
+
+
+class Sum(Aggregate):
+    """Sums the values of an attribute, see :func:`sum_`"""
+
+    def create(self):
+        return None
+
+    def add(self, state, value):
+        if value is None:
+            return state
+        if state is None:
+            return value
+        return state + value
+
+    def merge(self, state, other):
+        return self.add(state, other)
+
+
+class Avg(Aggregate):
+    """Averages the values of an attribute, see :func:`avg`"""
+
+    def create(self):
+        return (None, 0)
+
+    def add(self, state, value):
+        if value is None:
+            return state
+        total, n = state
+        return (value if total is None else total + value, n + 1)
+
+    def merge(self, state, other):
+        if other[0] is None:
+            return state
+        if state[0] is None:
+            return other
+        return (state[0] + other[0], state[1] + other[1])
+
+    def result(self, state):
+        total, n = state
+        if total is None:
+            return None
+        return total / n
+
+
+class Min(Aggregate):
+    """Finds the minimum of the values of an attribute, see :func:`min_`"""
+
+    def create(self):
+        return None
+
+    def add(self, state, value):
+        if value is None:
+            return state
+        if state is None or value < state:
+            return value
+        return state
+
+    def merge(self, state, other):
+        return self.add(state, other)
+
+
+class Max(Aggregate):
+    """Finds the maximum of the values of an attribute, see :func:`max_`"""
+
+    def create(self):
+        return None
+
+    def add(self, state, value):
+        if value is None:
+            return state
+        if state is None or value > state:
+            return value
+        return state
+
+    def merge(self, state, other):
+        return self.add(state, other)
+
+
+def count(attr_name: str = None) -> Count:
+    """
+    Number of documents, or number of documents with a value
+    for the attribute if an attribute name is given.
+
+    :param attr_name: Name of the document attribute to count.
+    :type attr_name: str
+
+    :return: Aggregation.
+    :rtype: :class:`nofeardb.aggregate.Aggregate`
+    """
+    return Count(attr_name)
+
+
+def sum_(attr_name: str) -> Sum:
+    """
+    Sum of the attribute values. None if no document has a value.
+
+    :param attr_name: Name of the document attribute to sum.
+    :type attr_name: str
+
+    :return: Aggregation.
+    :rtype: :class:`nofeardb.aggregate.Aggregate`
+    """
+    return Sum(attr_name)
+
+
+def avg(attr_name: str) -> Avg:
+    """
+    Average of the attribute values. None if no document has a value.
+
+    :param attr_name: Name of the document attribute to average.
+    :type attr_name: str
+
+    :return: Aggregation.
+    :rtype: :class:`nofeardb.aggregate.Aggregate`
+    """
+    return Avg(attr_name)
+
+
+def min_(attr_name: str) -> Min:
+    """
+    Minimum of the attribute values. None if no document has a value.
+
+    :param attr_name: Name of the document attribute.
+    :type attr_name: str
+
+    :return: Aggregation.
+    :rtype: :class:`nofeardb.aggregate.Aggregate`
+    """
+    return Min(attr_name)
+
+
+def max_(attr_name: str) -> Max:
+    """
+    Maximum of the attribute values. None if no document has a value.
+
+    :param attr_name: Name of the document attribute.
+    :type attr_name: str
+
+    :return: Aggregation.
+    :rtype: :class:`nofeardb.aggregate.Aggregate`
+    """
+    return Max(attr_name)
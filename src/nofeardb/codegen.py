@@ -0,0 +1,155 @@
+"""
+Code generation for specialized per-model functions
+"""
+
+import uuid
+
+from .orm import (
+    HASH_FUNCTIONS, Document, Field, ManyToMany, ManyToOne, OneToMany, Relationship
+)
+
+
+class CompiledModel:
+    """
+    Holds the attribute metadata of a document class together with
+    specialized functions for serializing, hydrating and hashing documents.
+
+    The functions are generated as python source code and compiled once per
+    model. All datatype lookups are resolved during compilation, so the
+    generated code works directly on the instance dictionary without going
+    through the field descriptors.
+
+    :param model: Document class to compile.
+    :type model: type
+    """
+
+    def __init__(self, model: type):
+        if not issubclass(model, Document):
+            raise ValueError(str(model) + " is not of type \'Document\'")
+
+        self.model = model
+        self.attributes = []
+        self.fields = []
+        self.relationships = []
+
+        for name, attr in vars(model).items():
+            if isinstance(attr, Field):
+                self.fields.append((name, attr))
+                self.attributes.append((name, attr))
+            elif isinstance(attr, Relationship):
+                self.relationships.append((name, attr))
+                self.attributes.append((name, attr))
+
+        self.primary_key = model.__primary_key_attribute__
+
+        self._namespace = {
+            "_hash_functions": HASH_FUNCTIONS,
+            "_UUID": uuid.UUID,
+        }
+        for index, (_, attr) in enumerate(self.attributes):
+            if isinstance(attr, Field):
+                self._namespace["_cast_" + str(index)] = attr._datatype.cast
+                self._namespace["_ser_" + str(index)] = attr._datatype.serialize
+            else:
+                self._namespace["_rel_" + str(index)] = attr.get_relation
+
+        self.source = "\n".join([
+            self._generate_to_json(),
+            self._generate_from_json(),
+            self._generate_hash(),
+        ])
+        code = compile(
+            self.source, "<nofeardb compiled " + model.__name__ + ">", "exec")
+        exec(code, self._namespace)  # pylint: disable=exec-used
+
+        self.to_json = self._namespace["to_json"]
+        self.from_json = self._namespace["from_json"]
+        self.hash = self._namespace["hash_document"]
+
+    def _generate_to_json(self) -> str:
+        lines = [
+            "def to_json(doc):",
+            "    d = doc.__dict__",
+            "    data = {'id': str(doc.__id__)}",
+        ]
+        for index, (name, attr) in enumerate(self.attributes):
+            if isinstance(attr, Field):
+                if name != self.primary_key:
+                    lines.append(
+                        "    data[%r] = _ser_%d(d.get(%r))" % (name, index, name))
+            elif isinstance(attr, (ManyToMany, OneToMany)):
+                lines.append(
+                    "    data[%r] = [str(r.__id__) for r in _rel_%d(doc)]"
+                    % (name, index))
+            elif isinstance(attr, ManyToOne):
+                lines.append("    r = _rel_%d(doc)" % index)
+                lines.append(
+                    "    data[%r] = [str(r.__id__)] if r is not None else [None]"
+                    % name)
+
+        lines.append("    return data")
+        return "\n".join(lines) + "\n"
+
+    def _generate_from_json(self) -> str:
+        lines = [
+            "def from_json(doc, data):",
+            "    d = doc.__dict__",
+            "    digests = doc.__field_digests__",
+        ]
+        for index, (name, attr) in enumerate(self.attributes):
+            if not isinstance(attr, Field):
+                continue
+            lines.append("    v = data.get(%r)" % name)
+            lines.append("    if v is not None:")
+            lines.append("        digests.pop(%r, None)" % name)
+            lines.append("        v = _cast_%d(v)" % index)
+            if name == self.primary_key:
+                lines.append("        if not isinstance(v, _UUID):")
+                lines.append(
+                    "            raise ValueError('primary key must be of type UUID')")
+                lines.append("        doc.__id__ = v")
+            lines.append("        d[%r] = v" % name)
+
+        return "\n".join(lines) + "\n"
+
+    def _generate_hash(self) -> str:
+        lines = [
+            "def hash_document(doc, hash_function='md5'):",
+            "    new = _hash_functions[hash_function]",
+            "    d = doc.__dict__",
+            "    digests = doc.get_field_digests(hash_function)",
+            "    m = new()",
+        ]
+        for index, (name, attr) in enumerate(self.attributes):
+            if not isinstance(attr, (Field, ManyToMany, OneToMany, ManyToOne)):
+                continue
+
+            lines.append("    dg = digests.get(%r)" % name)
+            lines.append("    if dg is None:")
+            lines.append("        h = new()")
+            lines.append("        h.update(%r)" % name.encode())
+            if isinstance(attr, Field):
+                if name == self.primary_key:
+                    lines.append("        v = doc.__id__")
+                else:
+                    lines.append("        v = d.get(%r)" % name)
+                lines.append("        if v is not None:")
+                lines.append(
+                    "            h.update(str(_ser_%d(v)).encode())" % index)
+                lines.append("        else:")
+                lines.append("            h.update(b'None')")
+            elif isinstance(attr, (ManyToMany, OneToMany)):
+                lines.append(
+                    "        h.update(str([str(r.__id__) for r in _rel_%d(doc)]).encode())"
+                    % index)
+            else:
+                lines.append("        r = _rel_%d(doc)" % index)
+                lines.append("        if r is not None:")
+                lines.append("            h.update(str(r.__id__).encode())")
+            lines.append("        dg = h.digest()")
+            if name != self.primary_key:
+                lines.append("        digests[%r] = dg" % name)
+            lines.append("    m.update(dg)")
+
+        lines.append("    return str(m.hexdigest())")
+        return "\n".join(lines) + "\n"
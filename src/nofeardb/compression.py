@@ -0,0 +1,74 @@
+"""
+Compression of persisted documents
+"""
+
+import lzma
+import zlib
+
+XZ_MAGIC = b"\xfd7zXZ\x00"
+
+COMPRESSIONS = {
+    "zlib": zlib.compress,
+    "lzma": lzma.compress,
+}
+
+
+def compress(raw: bytes, compression: str) -> bytes:
+    """
+    Compresses the encoded document data.
+
+    :param raw: Encoded document data.
+    :type raw: bytes
+    :param compression: Name of the compression, see :data:`COMPRESSIONS`.
+    :type compression: str
+    :return: Compressed data.
+    :rtype: bytes
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError("Unknown compression \'" + str(compression) + "\'")
+
+    return COMPRESSIONS[compression](raw)
+
+
+def get_compression(raw: bytes) -> str:
+    """
+    Detects the compression of the data by its header.
+
+    :param raw: Data as read from disk.
+    :type raw: bytes
+    :return: Name of the compression or None if the data is not compressed.
+    :rtype: str
+    """
+    if raw[:len(XZ_MAGIC)] == XZ_MAGIC:
+        return "lzma"
+
+    # zlib header: deflate method, window size up to 32K
+    # and a header checksum divisible by 31
+    if (
+        len(raw) > 1
+        and raw[0] & 0x0F == 8
+        and raw[0] >> 4 <= 7
+        and (raw[0] << 8 | raw[1]) % 31 == 0
+    ):
+        return "zlib"
+
+    return None
+
+
+def decompress(raw: bytes) -> bytes:
+    """
+    Decompresses the data if it is compressed, otherwise it is returned unchanged.
+
+    :param raw: Data as read from disk.
+    :type raw: bytes
+    :return: Uncompressed data.
+    :rtype: bytes
+    """
+    compression = get_compression(raw)
+    if compression == "lzma":
+        return lzma.decompress(raw)
+
+    if compression == "zlib":
+        return zlib.decompress(raw)
+
+    return raw
@@ -185,7 +185,7 @@ class DateTime(OrmDataType):
         if isinstance(value, str):
             dt, _, us = value.partition(".")
             dt = datetime.strptime(dt, "%Y-%m-%dT%H:%M:%S")
-            us = int(us.rstrip("Z"), 10)
+            us = int(us.rstrip("Z"), 10) if us.rstrip("Z") else 0
             return dt + timedelta(microseconds=us)
 
         raise AttributeError("Argument must be of type datetime or str")
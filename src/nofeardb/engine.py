@@ -5,27 +5,316 @@ Engine Classes
 # pylint: disable=dangerous-default-value
 
 import os
-import json
+import time
 import uuid
+import threading
+from collections import OrderedDict
 from typing import List
+from contextlib import contextmanager
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from .exceptions import DocumentLockException, NotCreateableException
 
+from .codegen import CompiledModel
+from .compression import COMPRESSIONS, compress, decompress
 from .datatypes import OrmDataType, UUID
 from .enums import DocumentStatus
-from .orm import Document, Field, ManyToMany, ManyToOne, OneToMany, Relationship
-from .query import Query
+from .expr import AbstractExpr
+from .instrumentation import DisabledInstrumentation, EngineHook, Instrumentation, SlowOperationLog
+from .formats import DocumentCodec, get_codec, get_codec_for_extension
+from .orm import HASH_FUNCTIONS, Document, Field, ManyToMany, ManyToOne, OneToMany
+from .planner import PlannerStatistics, cache_key, get_attr_names
+from .references import ReverseIndex, get_reference_ids
+from .query import DocumentSource, Query
+from .watcher import create_watcher
+
+# directory in the database root with one generation file per collection
+GENERATION_DIRECTORY = ".generations"
 
 
 class StorageEngine:
-    """Storage Engine Class"""
+    """
+    Storage Engine Class
+
+    :param root: Path of the database root directory.
+    :type root: str
+    :param hash_function: Name of the hash function used for the document hashes
+        in the file names (see :data:`nofeardb.orm.HASH_FUNCTIONS`).
+    :type hash_function: str
+    :param codec: Name of the codec used to encode and decode documents
+        (see :data:`nofeardb.formats.CODECS`) or a codec instance.
+        Document classes can override it with the class attribute ``__documentformat__``.
+    :type codec: str, :class:`nofeardb.formats.DocumentCodec`
+    :param compression: Name of the compression for written documents
+        (see :data:`nofeardb.compression.COMPRESSIONS`) or None to write plain documents.
+        Compressed documents are detected on read regardless of this setting.
+    :type compression: str
+    :param compression_threshold: Minimum size in bytes of an encoded document to be compressed.
+    :type compression_threshold: int
+    :param shard_length: Number of leading ID characters used as shard directory name
+        (``<collection>/<id[:shard_length]>/<id>__<hash>.json``). 0 stores all documents
+        directly in the collection directory. Document classes can override it with
+        the class attribute ``__documentshardlength__``.
+    :type shard_length: int
+    :param reverse_index: Maintain a persistent index of the documents referencing
+        a document per relationship (see :meth:`build_reverse_index`).
+    :type reverse_index: bool
+    :param instrumentation: Collect additional counters and timing histograms
+        of the engine operations (see :meth:`stats`).
+    :type instrumentation: bool
+    :param cache_listings: Reuse the listing of a collection for further reads as long as
+        its generation did not change (see :meth:`get_generation`). All processes writing
+        to the database must maintain the generations.
+    :type cache_listings: bool
+    :param query_cache_size: Number of where results kept in the query result cache,
+        0 disables the cache. The results are cached per document type and expression
+        and are only used as long as the generation of the collection did not change,
+        so all processes writing to the database must maintain the generations.
+    :type query_cache_size: int
+    :param slow_log: Path of a file the operations exceeding ``slow_log_threshold``
+        are logged to as JSON lines (see :class:`nofeardb.instrumentation.SlowOperationLog`).
+    :type slow_log: str
+    :param slow_log_threshold: Minimum duration in seconds of the logged operations.
+    :type slow_log_threshold: float
+    :param watch: Keep the listings of the collection directories in memory and update
+        them as other processes write, instead of listing the directories on every read:
+        "inotify" (Linux only), "poll" to check the directories in an interval,
+        "auto" for inotify if available and polling otherwise, or None.
+        Engines watching the database should be closed (see :meth:`close`).
+    :type watch: str
+    :param watch_interval: Seconds between two checks of the polling watcher.
+    :type watch_interval: float
+    """
+
+    def __init__(
+        self,
+        root: str,
+        hash_function: str = "md5",
+        codec="json",
+        compression: str = None,
+        compression_threshold: int = 1024,
+        shard_length: int = 0,
+        reverse_index: bool = False,
+        instrumentation: bool = False,
+        cache_listings: bool = False,
+        query_cache_size: int = 0,
+        slow_log: str = None,
+        slow_log_threshold: float = 1.0,
+        watch: str = None,
+        watch_interval: float = 0.1
+    ):
+        if hash_function not in HASH_FUNCTIONS:
+            raise ValueError("Unknown hash function \'" + str(hash_function) + "\'")
+
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError("Unknown compression \'" + str(compression) + "\'")
 
-    def __init__(self, root: str):
         self._root = os.path.normpath(root)
+        self._hash_function = hash_function
+        self._codec: DocumentCodec = get_codec(codec)
+        self._codecs_by_extension = {self._codec.extension: self._codec}
+        self._document_codecs = {}
+        self._compression = compression
+        self._compression_threshold = compression_threshold
+        self._shard_length = shard_length
+        self._reverse_index = ReverseIndex(self._root) if reverse_index else None
         self._models = []
+        self._models_by_name = {}
+        self._compiled_models = {}
         self._data_cache = {}
+        self._planner_statistics = {}
+        self._cache_listings = cache_listings
+        self._listings = {}
+        self._query_cache_size = query_cache_size
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        self._foreground_operations = 0
+        self._foreground_idle = threading.Event()
+        self._foreground_idle.set()
+        self._instrumentation: Instrumentation = (
+            Instrumentation() if instrumentation else DisabledInstrumentation())
+        if slow_log is not None:
+            self.add_hook(SlowOperationLog(slow_log, slow_log_threshold))
+        self._watcher = None
+        if watch is not None:
+            self._watcher = create_watcher(
+                watch, self._list_directory, self._forget_document, watch_interval)
+        self.reset_stats()
+
+    def close(self):
+        """stops watching the database"""
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+
+    def stats(self) -> dict:
+        """
+        Get the counters collected by the engine since creation or the last reset.
+        Besides the counters the compression ratios of read and written documents
+        (uncompressed size / stored size) are returned.
+
+        If the engine was created with ``instrumentation=True`` the counters of the
+        instrumentation (files listed, cache hits and misses, lock attempts, ...)
+        are added and the duration histograms of the operations and their phases
+        are returned under the key ``timings``.
+
+        :return: Counter values by name.
+        :rtype: dict
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        if self._instrumentation.enabled:
+            snapshot = self._instrumentation.snapshot()
+            stats.update(snapshot["counters"])
+            stats["timings"] = snapshot["timings"]
+
+        stats["compression_ratio_read"] = (
+            stats["bytes_decompressed"] / stats["bytes_read"]
+            if stats["bytes_read"] > 0 else 1.0)
+        stats["compression_ratio_written"] = (
+            stats["bytes_encoded"] / stats["bytes_written"]
+            if stats["bytes_written"] > 0 else 1.0)
+
+        return stats
+
+    def reset_stats(self):
+        """Resets all counters collected by the engine."""
+        self._instrumentation.reset()
+        with self._stats_lock:
+            self._stats = {
+                "documents_read": 0,
+                "documents_written": 0,
+                "documents_compressed": 0,
+                "writes_skipped": 0,
+                "bytes_read": 0,
+                "bytes_decompressed": 0,
+                "bytes_encoded": 0,
+                "bytes_written": 0,
+                "decompress_time": 0.0,
+                "decode_time": 0.0,
+            }
+
+    def add_hook(self, hook: EngineHook):
+        """
+        Adds a hook which is called before and after the operations of the engine,
+        e.g. to feed a tracer or a profiler (see :class:`nofeardb.instrumentation.EngineHook`).
+        Hooks are called with and without ``instrumentation``.
+
+        :param hook: Hook to add.
+        :type hook: :class:`nofeardb.instrumentation.EngineHook`
+        """
+        self._instrumentation.add_hook(hook)
+
+    def remove_hook(self, hook: EngineHook):
+        """
+        Removes a hook added by :meth:`add_hook`.
+
+        :param hook: Hook to remove.
+        :type hook: :class:`nofeardb.instrumentation.EngineHook`
+        """
+        self._instrumentation.remove_hook(hook)
+
+    @contextmanager
+    def _foreground(self):
+        """marks an operation of the user, which pauses the cache warm-up"""
+        with self._stats_lock:
+            self._foreground_operations += 1
+            self._foreground_idle.clear()
+        try:
+            yield
+        finally:
+            with self._stats_lock:
+                self._foreground_operations -= 1
+                if self._foreground_operations == 0:
+                    self._foreground_idle.set()
+
+    def warmup(
+        self,
+        models: List[type] = None,
+        background: bool = True,
+        batch_size: int = 100,
+        pause: float = 0.0,
+        progress=None
+    ) -> 'Warmup':
+        """
+        Reads the documents of the given models into the cache, so later queries
+        do not have to read them from disk.
+        The documents are read in batches. Before every batch the warm-up waits
+        until no read or write operation of the engine is running, so queries
+        are not slowed down by it.
+
+        :param models: Document classes to read. Defaults to all registered models.
+        :type models: list
+        :param background: Read the documents in a background thread.
+        :type background: bool
+        :param batch_size: Number of documents read between two checks for other operations.
+        :type batch_size: int
+        :param pause: Seconds to pause after every batch to throttle the warm-up.
+        :type pause: float
+        :param progress: Function called with the number of read and total documents
+            after every batch.
+        :type progress: callable
+        :return: Future of the warm-up, its result is the number of read documents.
+        :rtype: :class:`nofeardb.engine.Warmup`
+        """
+        if models is None:
+            models = list(self._models)
+
+        warmup = Warmup()
+        if background:
+            threading.Thread(
+                target=self._run_warmup,
+                args=(warmup, models, batch_size, pause, progress),
+                daemon=True
+            ).start()
+        else:
+            self._run_warmup(warmup, models, batch_size, pause, progress)
+
+        return warmup
+
+    def _run_warmup(self, warmup: 'Warmup', models: List[type], batch_size: int,
+                    pause: float, progress):
+        if not warmup.set_running_or_notify_cancel():
+            return
+
+        try:
+            refs = []
+            for model in models:
+                if os.path.exists(self.get_doc_basepath(model)):
+                    refs.extend((model, ref) for ref in self._list_documents(model))
+            warmup.documents_total = len(refs)
+
+            for start in range(0, len(refs), batch_size):
+                while not self._foreground_idle.wait(0.1):
+                    if warmup.stopped:
+                        break
+                if warmup.stopped:
+                    break
+
+                for model, ref in refs[start:start + batch_size]:
+                    if self._get_document_data(ref) is None:
+                        self._reload_document_data(model, ref)
+                    warmup.documents_read += 1
+
+                if progress is not None:
+                    progress(warmup.documents_read, warmup.documents_total)
+                if pause > 0:
+                    time.sleep(pause)
+
+            warmup.set_result(warmup.documents_read)
+        except Exception as e:  # pylint: disable=broad-except
+            warmup.set_exception(e)
+
+    def _count(self, **values):
+        """adds the values to the engine counters"""
+        with self._stats_lock:
+            for name, value in values.items():
+                self._stats[name] += value
 
     def register_models(self, models: List[type]):
         """
@@ -39,30 +328,69 @@ class StorageEngine:
         for model in models:
             if model not in self._models:
                 self._models.append(model)
+                self._models_by_name[model.__name__] = model
+                self._compiled_models[model] = CompiledModel(model)
+                self.get_document_codec(model)
 
-    def create_json(self, doc: Document) -> dict:
-        """creates the json that should be stored for a new object"""
+    def _get_compiled_model(self, doc_type: type) -> CompiledModel:
+        """get the compiled functions for a document type (compiled on first use)"""
+        try:
+            return self._compiled_models[doc_type]
+        except KeyError:
+            compiled = CompiledModel(doc_type)
+            self._compiled_models[doc_type] = compiled
+            return compiled
 
-        doc_json = {}
+    def get_document_codec(self, doc_type: type) -> DocumentCodec:
+        """
+        get the codec used to write documents of the given type.
+        This is the codec set by ``__documentformat__`` or the engine codec.
+        """
+        if doc_type in self._document_codecs:
+            return self._document_codecs[doc_type]
 
-        for name, attr in vars(doc.__class__).items():
-            doc_json["id"] = str(doc.__id__)
-            if isinstance(attr, Field):
-                if name != doc.__primary_key_attribute__:
-                    field_type: OrmDataType = getattr(doc, name + "__datatype")
-                    doc_json[name] = field_type.serialize(getattr(doc, name))
+        codec = self._codec
+        if doc_type.__documentformat__ is not None:
+            codec = get_codec(doc_type.__documentformat__)
+            if codec.extension not in self._codecs_by_extension:
+                self._codecs_by_extension[codec.extension] = codec
 
-            if isinstance(attr, ManyToMany) or isinstance(attr, OneToMany):
-                doc_json[name] = [str(rel.__id__)
-                                  for rel in getattr(doc, name)]
+        self._document_codecs[doc_type] = codec
+        return codec
 
-            if isinstance(attr, ManyToOne):
-                if getattr(doc, name) is not None:
-                    doc_json[name] = [str(getattr(doc, name).__id__)]
-                else:
-                    doc_json[name] = [None]
+    def get_document_shard_length(self, doc_type: type) -> int:
+        """
+        get the shard length of the given document type.
+        This is the length set by ``__documentshardlength__`` or the engine shard length.
+        """
+        if doc_type.__documentshardlength__ is not None:
+            return doc_type.__documentshardlength__
+
+        return self._shard_length
+
+    def _get_codec_for_path(self, doc_path: str) -> DocumentCodec:
+        """get the codec to decode a file based on its extension"""
+        extension = os.path.splitext(doc_path)[1]
+        if extension in self._codecs_by_extension:
+            return self._codecs_by_extension[extension]
+
+        codec = get_codec_for_extension(extension)
+        if codec is None:
+            return self._codec
+
+        self._codecs_by_extension[extension] = codec
+        return codec
 
-        return doc_json
+    def create_json(self, doc: Document) -> dict:
+        """creates the json that should be stored for a new object"""
+        return self._get_compiled_model(doc.__class__).to_json(doc)
+
+    def _copy_document_data(self, data: dict) -> dict:
+        """copies document data, so updating relationship lists does not change the original"""
+        return {
+            key: list(value) if isinstance(value, list) else value
+            for key, value in data.items()
+        }
 
     def update_json(self, json_to_update: dict, doc: Document) -> dict:
         """updates the json by modified fields of an object"""
@@ -110,32 +438,41 @@ class StorageEngine:
     def resolve_dependencies(
         self, doc: Document, scope: str = None
     ) -> List[Document]:
-        """creates a stack with depending documents"""
+        """
+        creates a stack with depending documents.
+        Without scope, only the related documents of the document itself are
+        loaded. Documents further away are only followed if they are loaded
+        already, because documents which are not loaded cannot have pending changes.
+        """
 
         dependencies = []
 
         children = [doc]
+        reached = {id(doc)}
 
         while len(children) > 0:
             child = children.pop()
-            if child not in dependencies:
-                dependencies.append(child)
+            dependencies.append(child)
 
-            for name, attr in vars(child.__class__).items():
-                if isinstance(attr, ManyToMany) or isinstance(attr, OneToMany):
-                    if scope is None or scope in attr.cascade:
-                        for rel in getattr(child, name):
-                            if rel not in children and rel not in dependencies:
-                                children.append(rel)
+            for name, attr in self._get_compiled_model(child.__class__).relationships:
+                if scope is not None and scope not in attr.cascade:
+                    continue
+
+                if scope is None and child is not doc:
+                    related = attr.get_relation(child)
+                else:
+                    related = getattr(child, name)
 
                 if isinstance(attr, ManyToOne):
-                    if scope is None or scope in attr.cascade:
-                        if getattr(child, name) is not None:
-                            if (
-                                getattr(child, name) not in children
-                                and getattr(child, name) not in dependencies
-                            ):
-                                children.append(getattr(child, name))
+                    related = [related]
+
+                for rel in related:
+                    if rel is None or rel.__status__ == DocumentStatus.LAZY:
+                        continue
+
+                    if id(rel) not in reached:
+                        reached.add(id(rel))
+                        children.append(rel)
 
         return dependencies
 
@@ -155,12 +492,23 @@ class StorageEngine:
         """get the base file path for the document type"""
         return os.path.join(self._root, doc.get_document_name())
 
+    def get_doc_dirpath(self, doc: Document):
+        """get the directory the document file is stored in (the shard directory if sharded)"""
+        shard_length = self.get_document_shard_length(doc.__class__)
+        if shard_length > 0:
+            return os.path.join(self.get_doc_basepath(doc), str(doc.__id__)[:shard_length])
+
+        return self.get_doc_basepath(doc)
+
     def _get_document_with_id_existing(self, doc: Document):
         """Checks wether a document with the same ID already exists."""
-        doc_base_path = self.get_doc_basepath(doc)
-        if os.path.exists(doc_base_path):
-            existing_ids = [doc_name.split("__")[0]
-                            for doc_name in os.listdir(doc_base_path)]
+        doc_dir_path = self.get_doc_dirpath(doc)
+        if os.path.exists(doc_dir_path):
+            try:
+                existing_ids = [doc_name.split("__")[0]
+                                for doc_name in self._listdir(doc_dir_path)]
+            except FileNotFoundError:
+                return False
             return str(doc.__id__) in existing_ids
 
         return False
@@ -194,9 +542,13 @@ class StorageEngine:
             for doc in docs:
                 if doc.__status__ != DocumentStatus.SYNC:
                     lock = DocumentLock(self, doc, expiration=10)
-                    lock.lock()
+                    self._instrumentation.count("lock_attempts")
+                    with self._instrumentation.timer(
+                            "lock.acquire", document_id=str(doc.__id__)):
+                        lock.lock()
                     locks.append(lock)
         except DocumentLockException as e:
+            self._instrumentation.count("lock_failures")
             self._unlock_docs(locks)
             raise DocumentLockException from e
 
@@ -205,20 +557,83 @@ class StorageEngine:
     def _unlock_docs(self, locks: List['DocumentLock']):
         for lock in locks:
             try:
-                lock.release()
+                with self._instrumentation.timer(
+                        "lock.release", document_id=str(lock.document.__id__)):
+                    lock.release()
             except DocumentLockException:
                 pass
 
     def _get_existing_document_file_name(self, doc: Document):
         """get the filename of the document if it is already persisted to disk"""
-        doc_base_path = self.get_doc_basepath(doc)
-        for file in os.listdir(doc_base_path):
+        doc_dir_path = self.get_doc_dirpath(doc)
+        try:
+            files = self._listdir(doc_dir_path)
+        except FileNotFoundError:
+            return None
+
+        for file in files:
             if "__" in file:
                 if file.split("__")[0] == str(doc.__id__) and os.path.splitext(file)[1] != '.tmp':
-                    return os.path.join(doc_base_path, file)
+                    return os.path.join(doc_dir_path, file)
 
         return None
 
+    def get_generation(self, doc_type: type) -> str:
+        """
+        Get the generation of the collection of a document type. Every engine
+        writing documents of the type replaces the generation afterwards, so an
+        unchanged generation means that the collection did not change since it was
+        read. Checking it only reads a single small file.
+
+        :param doc_type: Document class.
+        :type doc_type: type
+        :return: Generation or None if the collection was not written yet.
+        :rtype: str
+        """
+        generation_path = self._get_generation_path(doc_type)
+        try:
+            with open(generation_path, "r", encoding="utf-8") as generation_file:
+                return generation_file.read() or None
+        except FileNotFoundError:
+            return None
+
+    def _get_generation_path(self, doc_type: type) -> str:
+        return os.path.join(self._root, GENERATION_DIRECTORY, doc_type.get_document_name())
+
+    def _mark_changed(self, doc_type: type):
+        """marks a collection as changed by the running operation of this thread"""
+        changed = getattr(self._local, "changed_types", None)
+        if changed is None:
+            changed = self._local.changed_types = set()
+        changed.add(doc_type)
+
+    def _bump_changed_generations(self):
+        """bumps the generations of the collections changed by this thread"""
+        changed = getattr(self._local, "changed_types", None)
+        if changed:
+            self._local.changed_types = set()
+            for doc_type in changed:
+                self._bump_generation(doc_type)
+
+    def _bump_generation(self, doc_type: type):
+        """
+        atomically replaces the generation of a collection by a new one, which
+        consists of a counter and a random part, so concurrent writers never
+        write the same generation.
+        """
+        generation = self.get_generation(doc_type)
+        try:
+            counter = int(generation.split("-")[0]) + 1
+        except (AttributeError, ValueError):
+            counter = 1
+
+        path = self._get_generation_path(doc_type)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + "." + uuid.uuid4().hex + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as generation_file:
+            generation_file.write(str(counter) + "-" + uuid.uuid4().hex)
+        os.replace(temp_path, path)
+
     def _extract_id_and_hash_from_filename(self, doc_path):
         try:
             filename, _ = os.path.splitext(os.path.basename(doc_path))
@@ -228,20 +643,46 @@ class StorageEngine:
             return (None, None)
 
     def _read_document_bytes(self, doc_path: str, size=-1) -> bytes:
-        fd = os.open(doc_path, os.O_RDONLY)
-        try:
-            if size == -1:
-                size = os.fstat(fd).st_size
-            return os.read(fd, size)
-        finally:
-            os.close(fd)
+        """reads the document file and decompresses its content if it is compressed"""
+        with self._instrumentation.timer("file.read", path=doc_path):
+            fd = os.open(doc_path, os.O_RDONLY)
+            try:
+                if size == -1:
+                    size = os.fstat(fd).st_size
+                raw = os.read(fd, size)
+            finally:
+                os.close(fd)
+
+        start = time.perf_counter()
+        data = decompress(raw)
+        self._count(
+            bytes_read=len(raw),
+            bytes_decompressed=len(data),
+            decompress_time=time.perf_counter() - start)
+
+        return data
+
+    def _compress_document_bytes(self, raw: bytes) -> bytes:
+        """compresses encoded document data if compression is enabled and worthwhile"""
+        if self._compression is not None and len(raw) >= self._compression_threshold:
+            compressed = compress(raw, self._compression)
+            if len(compressed) < len(raw):
+                self._count(documents_compressed=1)
+                return compressed
+
+        return raw
 
     def _read_document_from_disk(self, doc_path) -> dict:
         if doc_path is not None:
             doc_id, doc_hash = self._extract_id_and_hash_from_filename(
                 doc_path)
             try:
-                data = json.loads(self._read_document_bytes(doc_path))
+                raw = self._read_document_bytes(doc_path)
+                start = time.perf_counter()
+                data = self._get_codec_for_path(doc_path).decode(raw)
+                self._count(
+                    documents_read=1,
+                    decode_time=time.perf_counter() - start)
                 if doc_id is not None and doc_hash is not None:
                     # update data cache
                     data["__doc_hash__"] = doc_hash
@@ -270,32 +711,186 @@ class StorageEngine:
     def _get_document_data(self, doc_path):
         data = self._read_document_from_cache(doc_path)
         if data is None:
+            self._instrumentation.count("cache_misses")
             data = self._read_document_from_disk(doc_path)
+        else:
+            self._instrumentation.count("cache_hits")
 
         return data
 
     def write_json(self, doc: Document):
-        """writes the document data to disk"""
+        """
+        writes the document data to disk.
+        The write is skipped if the persisted document already has the same hash.
+        """
         if doc.__status__ != DocumentStatus.SYNC and doc.__status__ != DocumentStatus.DEL:
             previous_file = self._get_existing_document_file_name(doc)
-            previous_data = self._get_document_data(previous_file)
+            codec = self.get_document_codec(doc.__class__)
+            doc_hash = self._get_compiled_model(
+                doc.__class__).hash(doc, self._hash_function)
+
+            if previous_file is not None:
+                _, previous_hash = self._extract_id_and_hash_from_filename(
+                    previous_file)
+                if (
+                    previous_hash == doc_hash
+                    and os.path.splitext(previous_file)[1] == codec.extension
+                ):
+                    self._count(writes_skipped=1)
+                    return
+
+            timer = self._instrumentation.timer
+            with timer("write_json.read_previous"):
+                previous_data = self._get_document_data(previous_file)
             data_to_write = None
             if previous_data is not None:
-                data_to_write = self.update_json(previous_data, doc)
+                data_to_write = self.update_json(
+                    self._copy_document_data(previous_data), doc)
             else:
                 data_to_write = self.create_json(doc)
 
-            doc_path = os.path.join(self.get_doc_basepath(
-                doc), str(doc.__id__) + "__" + doc.get_hash() + ".json")
+            doc_dir_path = self.get_doc_dirpath(doc)
+            if doc_dir_path != self.get_doc_basepath(doc):
+                os.makedirs(doc_dir_path, exist_ok=True)
+
+            doc_path = os.path.join(
+                doc_dir_path, str(doc.__id__) + "__" + doc_hash + codec.extension)
             doc_temp_path = doc_path + ".tmp"
 
-            with open(doc_temp_path, 'w', encoding="utf-8") as f:
-                json.dump(data_to_write, f)
+            with timer("write_json.serialize"):
+                raw = codec.encode(data_to_write)
+                stored = self._compress_document_bytes(raw)
+            with timer("file.write", path=doc_temp_path):
+                with open(doc_temp_path, 'wb') as f:
+                    f.write(stored)
+
+            with timer("write_json.rename"):
+                if previous_file is not None:
+                    os.remove(previous_file)
+
+                os.rename(doc_temp_path, doc_path)
+            # the cached data belongs to the replaced file
+            self._data_cache.pop(str(doc.__id__), None)
+            if doc_dir_path != self.get_doc_basepath(doc):
+                self._update_listing(added_path=doc_dir_path)
+            self._update_listing(removed_path=previous_file, added_path=doc_path)
+            self._mark_changed(doc.__class__)
+            self._update_reverse_index(doc, previous_data, data_to_write)
+            self._count(
+                documents_written=1,
+                bytes_encoded=len(raw),
+                bytes_written=len(stored))
+
+    def migrate(self, doc_type: type, codec=None) -> int:
+        """
+        Rewrites all persisted documents of a type in the format of the given codec.
+        Documents already stored in the target format are left untouched.
+
+        :param doc_type: Document class to migrate.
+        :type doc_type: type
+        :param codec: Target codec name or instance. Defaults to the codec of the document type.
+        :type codec: str, :class:`nofeardb.formats.DocumentCodec`
+        :return: Number of migrated documents.
+        :rtype: int
+        :raise nofeardb.exceptions.DocumentLockException: If a document is locked by someone else.
+        """
+        if codec is None:
+            target_codec = self.get_document_codec(doc_type)
+        else:
+            target_codec = get_codec(codec)
 
-            if previous_file is not None:
-                os.remove(previous_file)
+        base_path = self.get_doc_basepath(doc_type)
+        if not os.path.exists(base_path):
+            return 0
 
-            os.rename(doc_temp_path, doc_path)
+        migrated = 0
+        for doc_path in self._list_documents(doc_type):
+            doc_id, doc_hash = self._extract_id_and_hash_from_filename(
+                doc_path)
+            extension = os.path.splitext(doc_path)[1]
+            if doc_id is None or extension == target_codec.extension:
+                continue
+
+            doc = doc_type()
+            doc.__id__ = UUID.cast(doc_id)
+            lock = DocumentLock(self, doc, expiration=10)
+            lock.lock()
+            try:
+                if not os.path.exists(doc_path):
+                    continue
+
+                data = self._get_codec_for_path(doc_path).decode(
+                    self._read_document_bytes(doc_path))
+                new_path = os.path.join(
+                    os.path.dirname(doc_path),
+                    doc_id + "__" + doc_hash + target_codec.extension)
+                new_temp_path = new_path + ".tmp"
+
+                with open(new_temp_path, 'wb') as f:
+                    f.write(self._compress_document_bytes(
+                        target_codec.encode(data)))
+
+                os.remove(doc_path)
+                os.rename(new_temp_path, new_path)
+                self._mark_changed(doc_type)
+                migrated += 1
+            finally:
+                lock.release()
+
+        self._invalidate_listing()
+        self._bump_changed_generations()
+        return migrated
+
+    def relayout(self, doc_type: type) -> int:
+        """
+        Moves all persisted documents of a type into the directory layout
+        given by the shard length of the type. Empty shard directories are removed.
+        The relayout should be run while no other process writes documents of the type.
+
+        :param doc_type: Document class to relayout.
+        :type doc_type: type
+        :return: Number of moved documents.
+        :rtype: int
+        :raise nofeardb.exceptions.DocumentLockException: If a document is locked by someone else.
+        """
+        base_path = self.get_doc_basepath(doc_type)
+        if not os.path.exists(base_path):
+            return 0
+
+        directories = [base_path] + [
+            entry.path for entry in os.scandir(base_path) if entry.is_dir()]
+
+        moved = 0
+        for directory in directories:
+            for file in os.listdir(directory):
+                doc_id, _ = self._extract_id_and_hash_from_filename(file)
+                if doc_id is None or os.path.splitext(file)[1] == '.tmp':
+                    continue
+
+                doc = doc_type()
+                doc.__id__ = UUID.cast(doc_id)
+                target_directory = self.get_doc_dirpath(doc)
+                if target_directory == directory:
+                    continue
+
+                lock = DocumentLock(self, doc, expiration=10)
+                lock.lock()
+                try:
+                    os.makedirs(target_directory, exist_ok=True)
+                    os.rename(os.path.join(directory, file),
+                              os.path.join(target_directory, file))
+                    moved += 1
+                finally:
+                    lock.release()
+
+            if directory != base_path and len(os.listdir(directory)) == 0:
+                os.rmdir(directory)
+
+        if moved > 0:
+            self._mark_changed(doc_type)
+        self._invalidate_listing()
+        self._bump_changed_generations()
+        return moved
 
     def delete_json(self, doc: Document):
         """
@@ -306,7 +901,13 @@ class StorageEngine:
             base_path = self.get_doc_basepath(doc)
             doc_name = self._get_existing_document_file_name(doc)
             doc_path = os.path.join(base_path, doc_name)
-            os.remove(doc_path)
+            if self._reverse_index is not None:
+                self._update_reverse_index(
+                    doc, self._get_document_data(doc_path), None)
+            with self._instrumentation.timer("file.remove", path=doc_path):
+                os.remove(doc_path)
+            self._update_listing(removed_path=doc_path)
+            self._mark_changed(doc.__class__)
 
     def _create_base_pathes(self):
         for doc in self._models:
@@ -330,20 +931,7 @@ class StorageEngine:
         if len(errors) > 0:
             raise NotCreateableException(errors[0])
 
-        self._create_base_pathes()
-
-        dependencies = self.resolve_dependencies(doc)
-        if self._check_all_documents_can_be_written(dependencies):
-            locks = self._lock_docs(dependencies)
-            for dep in dependencies:
-                if (
-                    dep.__status__ == DocumentStatus.NEW
-                    or dep.__status__ == DocumentStatus.MOD
-                ):
-                    self.write_json(dep)
-                    dep.__status__ = DocumentStatus.SYNC
-
-            self._unlock_docs(locks)
+        self._write_dependencies(doc, "create")
 
     def update(self, doc: Document):
         """update the document"""
@@ -354,20 +942,37 @@ class StorageEngine:
         if doc.__status__ is DocumentStatus.DEL:
             raise RuntimeError("Deleted documents cannot be updated")
 
-        self._create_base_pathes()
-
-        dependencies = self.resolve_dependencies(doc)
-        if self._check_all_documents_can_be_written(dependencies):
-            locks = self._lock_docs(dependencies)
-            for dep in dependencies:
-                if (
-                    dep.__status__ == DocumentStatus.NEW
-                    or dep.__status__ == DocumentStatus.MOD
-                ):
-                    self.write_json(dep)
-                    dep.__status__ = DocumentStatus.SYNC
-
-            self._unlock_docs(locks)
+        self._write_dependencies(doc, "update")
+
+    def _write_dependencies(self, doc: Document, operation: str):
+        """writes the new and modified documents the document depends on"""
+        timer = self._instrumentation.timer
+        with self._foreground(), timer(
+                operation, document_type=doc.get_document_name(),
+                document_id=str(doc.__id__)):
+            self._create_base_pathes()
+
+            with timer(operation + ".resolve_dependencies"):
+                dependencies = self.resolve_dependencies(doc)
+            with timer(operation + ".check"):
+                writable = self._check_all_documents_can_be_written(dependencies)
+            if writable:
+                with timer(operation + ".lock"):
+                    locks = self._lock_docs(dependencies)
+                try:
+                    with timer(operation + ".write"):
+                        for dep in dependencies:
+                            if (
+                                dep.__status__ == DocumentStatus.NEW
+                                or dep.__status__ == DocumentStatus.MOD
+                            ):
+                                self.write_json(dep)
+                                dep.__status__ = DocumentStatus.SYNC
+                finally:
+                    # documents written before an error changed their collections as well
+                    self._bump_changed_generations()
+                    with timer(operation + ".unlock"):
+                        self._unlock_docs(locks)
 
     def delete(self, doc: Document):
         """delete the document"""
@@ -379,78 +984,91 @@ class StorageEngine:
         if doc.__status__ is DocumentStatus.DEL:
             raise RuntimeError("Deleted documents cannot be deleted again")
 
-        to_delete = self.resolve_dependencies(doc, scope="delete")
-        all_dependencies = self.resolve_dependencies(doc)
-        if self._check_all_documents_can_be_written(all_dependencies):
-            locks = self._lock_docs(all_dependencies)
-
-            for dep in to_delete:
-                if (
-                    dep.__status__ != DocumentStatus.NEW
-                ):
-                    self.delete_json(dep)
-
-                self._remove_dependencies(dep)
-                dep.__status__ = DocumentStatus.DEL
+        timer = self._instrumentation.timer
+        with self._foreground(), timer(
+                "delete", document_type=doc.get_document_name(),
+                document_id=str(doc.__id__)):
+            with timer("delete.resolve_dependencies"):
+                to_delete = self.resolve_dependencies(doc, scope="delete")
+                all_dependencies = []
+                for dep in to_delete:
+                    for dependency in self.resolve_dependencies(dep):
+                        if dependency not in all_dependencies:
+                            all_dependencies.append(dependency)
+            with timer("delete.check"):
+                writable = self._check_all_documents_can_be_written(all_dependencies)
+            if writable:
+                with timer("delete.lock"):
+                    locks = self._lock_docs(all_dependencies)
+                try:
+                    with timer("delete.delete"):
+                        for dep in to_delete:
+                            if (
+                                dep.__status__ != DocumentStatus.NEW
+                            ):
+                                self.delete_json(dep)
 
-            for dep in all_dependencies:
-                if (
-                    dep not in to_delete
-                ):
-                    self.write_json(dep)
+                            self._remove_dependencies(dep)
+                            dep.__status__ = DocumentStatus.DEL
 
-            self._unlock_docs(locks)
+                    with timer("delete.write"):
+                        for dep in all_dependencies:
+                            if (
+                                dep not in to_delete
+                            ):
+                                self.write_json(dep)
+                finally:
+                    self._bump_changed_generations()
+                    with timer("delete.unlock"):
+                        self._unlock_docs(locks)
 
     def _get_doc_class_by_name(self, name) -> type:
-        for model in self._models:
-            if model.__name__ == name:
-                return model
+        if name in self._models_by_name:
+            return self._models_by_name[name]
 
         raise RuntimeError("Document class " + str(name) +
                            "not registered in engine.")
 
     def _fill_document_with_data(self, doc: Document, data: dict):
-        for name, attr in vars(doc.__class__).items():
-            value = None
-            try:
-                value = data[name]
-            except KeyError:
-                pass
-            if isinstance(attr, Field):
-                if value is not None:
-                    setattr(doc, name, value)
-
-            elif isinstance(attr, Relationship):
-                rel_class = self._get_doc_class_by_name(attr._rel_class_name)
-                rel_docs = []
-                if value is not None:
-                    for rel_id in value:
-                        rel_doc = rel_class()
-                        rel_doc.__id__ = UUID.cast(rel_id)
-                        rel_docs.append(rel_doc)
-
-                    if len(rel_docs) > 0:
-                        loaded_relationship = getattr(doc, name)
-                        if isinstance(attr, ManyToMany) or isinstance(attr, OneToMany):
-                            if loaded_relationship is not None:
-                                for rel_doc in rel_docs:
-                                    if (
-                                        rel_doc.__id__ not in [
-                                            doc.__id__ for doc in loaded_relationship]
-                                    ):
-                                        loaded_relationship.append(rel_doc)
-                        elif isinstance(attr, ManyToOne):
-                            if (
-                                loaded_relationship is None
-                                or rel_docs[0].__id__ != loaded_relationship.__id__
-                            ):
-                                setattr(doc, name, rel_docs[0])
-
-                for rel_doc in rel_docs:
-                    rel_doc.__status__ = DocumentStatus.LAZY
-                    rel_doc.__added_relationships__ = {}
-                    rel_doc.__removed_relationships__ = {}
-                    rel_doc.__engine__ = self
+        compiled = self._get_compiled_model(doc.__class__)
+        compiled.from_json(doc, data)
+
+        for name, attr in compiled.relationships:
+            value = data.get(name)
+            rel_class = self._get_doc_class_by_name(attr._rel_class_name)
+            rel_docs = []
+            if value is not None:
+                if isinstance(value, str):
+                    value = [value]
+                for rel_id in value:
+                    if rel_id is None:
+                        continue
+                    rel_doc = rel_class()
+                    rel_doc.__id__ = UUID.cast(rel_id)
+                    rel_docs.append(rel_doc)
+
+                if len(rel_docs) > 0:
+                    loaded_relationship = getattr(doc, name)
+                    if isinstance(attr, ManyToMany) or isinstance(attr, OneToMany):
+                        if loaded_relationship is not None:
+                            loaded_ids = set(
+                                loaded.__id__ for loaded in loaded_relationship)
+                            for rel_doc in rel_docs:
+                                if rel_doc.__id__ not in loaded_ids:
+                                    loaded_relationship.append(rel_doc)
+                                    loaded_ids.add(rel_doc.__id__)
+                    elif isinstance(attr, ManyToOne):
+                        if (
+                            loaded_relationship is None
+                            or rel_docs[0].__id__ != loaded_relationship.__id__
+                        ):
+                            setattr(doc, name, rel_docs[0])
+
+            for rel_doc in rel_docs:
+                rel_doc.__status__ = DocumentStatus.LAZY
+                rel_doc.__added_relationships__ = {}
+                rel_doc.__removed_relationships__ = {}
+                rel_doc.__engine__ = self
 
         doc.__added_relationships__ = {}
         doc.__removed_relationships__ = {}
@@ -459,12 +1077,136 @@ class StorageEngine:
     def lazy_load(self, doc: Document):
         """executes lazy loading for docs that are marked as LAZY"""
         if doc.__status__ == DocumentStatus.LAZY:
-            doc_path = self._get_existing_document_file_name(doc)
-            data = self._get_document_data(doc_path)
-            self._fill_document_with_data(doc, data)
+            with self._foreground(), self._instrumentation.timer(
+                    "lazy_load", document_type=doc.get_document_name(),
+                    document_id=str(doc.__id__)):
+                doc_path = self._get_existing_document_file_name(doc)
+                data = self._get_document_data(doc_path)
+                self._fill_document_with_data(doc, data)
+
+    def _update_reverse_index(self, doc: Document, previous_data: dict, data: dict):
+        """updates the reverse index from the previous to the new document data"""
+        if self._reverse_index is not None:
+            self._reverse_index.update(
+                doc.get_document_name(),
+                [name for name, _ in self._get_compiled_model(
+                    doc.__class__).relationships],
+                str(doc.__id__),
+                previous_data,
+                data)
+
+    def build_reverse_index(self, doc_type: type) -> int:
+        """
+        Builds the reverse index of all relationships of a document type from the
+        persisted documents. Afterwards the index is maintained on every write of the
+        engine, as long as all engines writing to the database maintain it.
+
+        :param doc_type: Document class to index.
+        :type doc_type: type
+        :return: Number of indexed references.
+        :rtype: int
+        """
+        if self._reverse_index is None:
+            raise RuntimeError(
+                "The reverse index is not enabled for this engine.")
+
+        collection = doc_type.get_document_name()
+        attr_names = [
+            name for name, _ in self._get_compiled_model(doc_type).relationships]
+        for attr_name in attr_names:
+            self._reverse_index.clear(collection, attr_name)
+
+        references = 0
+        for doc_ref in self._list_documents(doc_type):
+            data = self._get_document_data(doc_ref)
+            if data is None:
+                continue
+
+            for attr_name in attr_names:
+                for target_id in get_reference_ids(data.get(attr_name)):
+                    self._reverse_index.add(
+                        collection, attr_name, target_id, str(data["id"]))
+                    references += 1
+
+        for attr_name in attr_names:
+            self._reverse_index.mark_complete(collection, attr_name)
+
+        return references
+
+    def _lookup_references(self, doc_type: type, attr_name: str, target_ids) -> set:
+        """
+        get the IDs of the documents referencing one of the targets by the relationship
+        from the reverse index, or None if there is no complete index for the relationship.
+        """
+        collection = doc_type.get_document_name()
+        if (
+            self._reverse_index is None
+            or not self._reverse_index.is_complete(collection, attr_name)
+        ):
+            return None
+
+        return set(self._reverse_index.get(collection, attr_name, target_ids))
+
+    def get_referencing_ids(self, doc_type: type, attr_name: str, target) -> List[uuid.UUID]:
+        """
+        get the IDs of all documents of a type whose relationship references the target.
+        Uses the reverse index if it is complete, otherwise the documents are scanned.
+
+        :param doc_type: Document class of the referencing documents.
+        :type doc_type: type
+        :param attr_name: Name of the relationship of the referencing documents.
+        :type attr_name: str
+        :param target: Referenced document or its ID.
+        :type target: :class:`nofeardb.orm.Document`, uuid.UUID, str
+        :return: IDs of the referencing documents.
+        :rtype: list
+        """
+        if attr_name not in dict(self._get_compiled_model(doc_type).relationships):
+            raise ValueError(
+                str(attr_name) + " is no relationship of " + str(doc_type.__name__))
+
+        target_id = str(target.__id__) if isinstance(
+            target, Document) else str(target)
+        source_ids = self._lookup_references(doc_type, attr_name, [target_id])
+        if source_ids is None:
+            source_ids = set()
+            for doc_ref in self._list_documents(doc_type):
+                data = self._get_document_data(doc_ref)
+                if data is not None and target_id in get_reference_ids(data.get(attr_name)):
+                    source_ids.add(data["id"])
+
+        return [UUID.cast(source_id) for source_id in source_ids]
+
+    def _get_planner_statistics(self, doc_type: type) -> PlannerStatistics:
+        """get the statistics the queries on a document type are planned with"""
+        statistics = self._planner_statistics.get(doc_type)
+        if statistics is None:
+            statistics = self._planner_statistics.setdefault(
+                doc_type, PlannerStatistics())
+
+        return statistics
+
+    def _get_id_from_ref(self, doc_ref: str) -> str:
+        """get the document ID from a document reference without reading the document"""
+        doc_id, _ = self._extract_id_and_hash_from_filename(doc_ref)
+        return doc_id
+
+    def _reload_document_data(self, doc_type: type, doc_ref: str) -> dict:
+        """reads the data of a listed document, whose file was replaced in the meantime"""
+        doc_id = self._get_id_from_ref(doc_ref)
+        if doc_id is None:
+            return None
 
-    def _concurrent_read_helper(self, doc_type: type, document_path: str):
-        data = self._get_document_data(document_path)
+        doc = doc_type()
+        doc.__id__ = UUID.cast(doc_id)
+        doc_path = self._get_existing_document_file_name(doc)
+        if doc_path is None:
+            return None
+
+        return self._get_document_data(doc_path)
+
+    def _create_document(self, doc_type: type, data: dict) -> Document:
+        """creates a synchronized document instance from the document data"""
         doc = doc_type()
 
         try:
@@ -479,24 +1221,464 @@ class StorageEngine:
 
         return doc
 
-    def read(self, doc_type: type) -> Query:
-        """read the documents of the specified type"""
+    def _list_documents(self, doc_type: type) -> List[str]:
+        """
+        lists the references of all persisted documents of the specified type.
+        For this engine the references are the document file paths.
+        Shard directories are listed in parallel.
+        """
         base_path = self.get_doc_basepath(doc_type)
-        document_jsons = os.listdir(base_path)
+        shard_length = self.get_document_shard_length(doc_type)
+        documents = []
+        shards = []
+        for name in self._listdir(base_path):
+            if shard_length > 0 and len(name) == shard_length and "." not in name:
+                shards.append(os.path.join(base_path, name))
+            elif os.path.splitext(name)[1] not in ['.tmp', '.lock']:
+                documents.append(os.path.join(base_path, name))
+
+        if len(shards) > 0:
+            with ThreadPoolExecutor(max_workers=min(32, len(shards))) as executor:
+                for shard, names in zip(shards, executor.map(self._listdir, shards)):
+                    documents.extend(
+                        os.path.join(shard, name) for name in names
+                        if os.path.splitext(name)[1] not in ['.tmp', '.lock'])
+
+        return documents
+
+    def _get_existing_refs(self, doc_type: type, doc_refs: List[str]) -> List[str]:
+        """
+        get the document references whose documents still exist, by the current listing
+        of their directories instead of reading the documents.
+        A document whose file was replaced in the meantime still exists.
+        """
+        listed_ids = {}
+        existing = []
+        for doc_ref in doc_refs:
+            directory = os.path.dirname(doc_ref)
+            ids = listed_ids.get(directory)
+            if ids is None:
+                try:
+                    names = self._listdir(directory)
+                except FileNotFoundError:
+                    names = []
+                ids = {self._get_id_from_ref(name) for name in names
+                       if os.path.splitext(name)[1] not in ['.tmp', '.lock']}
+                listed_ids[directory] = ids
+
+            if self._get_id_from_ref(doc_ref) in ids:
+                existing.append(doc_ref)
+
+        return existing
+
+    def _listdir(self, directory: str) -> List[str]:
+        """lists a collection or shard directory, from memory if the database is watched"""
+        if self._watcher is not None:
+            return self._watcher.listdir(directory)
+
+        return self._list_directory(directory)
+
+    def _list_directory(self, directory: str) -> List[str]:
+        names = os.listdir(directory)
+        self._instrumentation.count("directories_listed")
+        self._instrumentation.count("files_listed", len(names))
+        return names
+
+    def _update_listing(self, removed_path: str = None, added_path: str = None):
+        """
+        applies the files removed and added by this engine to the watched listings,
+        so they are visible to the next read immediately
+        """
+        if self._watcher is not None:
+            if removed_path is not None:
+                self._watcher.file_removed(removed_path)
+            if added_path is not None:
+                self._watcher.file_added(added_path)
+
+    def _invalidate_listing(self):
+        """invalidates all watched listings after the directory layout was changed"""
+        if self._watcher is not None:
+            self._watcher.invalidate()
+
+    def _forget_document(self, doc_path: str):
+        """removes the cached data of a document file removed by another process"""
+        doc_id, doc_hash = self._extract_id_and_hash_from_filename(doc_path)
+        cache_data = self._data_cache.get(doc_id)
+        if cache_data is not None and cache_data.get("__doc_hash__") == doc_hash:
+            self._data_cache.pop(doc_id, None)
+
+    def read(self, doc_type: type) -> Query:
+        """
+        read the documents of the specified type.
+        The documents are listed immediately, their data is read on the first
+        query operation that needs it. Document instances are only created
+        for the results of the query.
+        """
+        for _, attr in self._get_compiled_model(doc_type).relationships:
+            self._get_doc_class_by_name(attr._rel_class_name)
+
+        with self._foreground(), self._instrumentation.timer(
+                "read", document_type=doc_type.get_document_name()):
+            generation, document_refs = self._list_collection(doc_type)
+        return Query(document_refs, source=CollectionSource(self, doc_type, generation))
+
+    def _list_collection(self, doc_type: type) -> tuple:
+        """
+        lists the references of all persisted documents of the specified type,
+        the cached listing is returned if the generation of the collection did not change.
+        The generation is read before the documents are listed, it is None if
+        no cache depends on it.
+        """
+        if not self._cache_listings and self._query_cache_size == 0:
+            return None, self._list_documents(doc_type)
+
+        generation = self.get_generation(doc_type)
+        listing = self._listings.get(doc_type)
+        if generation is not None and listing is not None and listing[0] == generation:
+            self._instrumentation.count("listings_reused")
+            return generation, list(listing[1])
+
+        document_refs = self._list_documents(doc_type)
+        if generation is not None and self._cache_listings:
+            self._listings[doc_type] = (generation, document_refs)
+        return generation, list(document_refs)
+
+    def _get_query_result(self, key: tuple) -> list:
+        """get the cached result of a where expression, the least recently used is evicted first"""
+        with self._query_cache_lock:
+            items = self._query_cache.get(key)
+            if items is not None:
+                self._query_cache.move_to_end(key)
+
+        if items is None:
+            self._instrumentation.count("query_cache_misses")
+            return None
+
+        self._instrumentation.count("query_cache_hits")
+        return list(items)
+
+    def _put_query_result(self, key: tuple, items: list):
+        with self._query_cache_lock:
+            self._query_cache[key] = tuple(items)
+            self._query_cache.move_to_end(key)
+            while len(self._query_cache) > self._query_cache_size:
+                self._query_cache.popitem(last=False)
+
+
+class CollectionSource(DocumentSource):
+    """
+    Query source working on the document data read by the storage engine.
+    The query items are the document references, document instances are
+    created once per reference when they are needed.
+    """
+
+    def __init__(self, engine: StorageEngine, doc_type: type, generation: str = None):
+        self._engine = engine
+        self._doc_type = doc_type
+        self._data = {}
+        self._documents = {}
+
+        compiled = engine._get_compiled_model(doc_type)
+        self._fields = dict(compiled.fields)
+        self._relationships = dict(compiled.relationships)
+        self._primary_key = compiled.primary_key
+        self._joins = {}
+        self._instrumentation = engine._instrumentation
+        self._generation = generation
+        self._result_keys = {}
+
+    def _get_result_key(self, expr: AbstractExpr) -> tuple:
+        """
+        get the key of the cached result of a where expression or None if it cannot be cached.
+        Expressions on related documents also depend on the generations of all collections.
+        """
+        if self._engine._query_cache_size == 0 or self._generation is None:
+            return None
+
+        key = cache_key(expr)
+        if key is None:
+            return None
+
+        related_generations = None
+        if any("." in attr_name for attr_name in get_attr_names(expr)):
+            related_generations = tuple(
+                self._engine.get_generation(model) for model in self._engine._models)
+
+        return (self._doc_type, key, self._generation, related_generations)
+
+    def get_cached_result(self, expr: AbstractExpr) -> list:
+        key = self._get_result_key(expr)
+        if key is None:
+            return None
+
+        # the result is cached with the generations read before the evaluation
+        self._result_keys[expr] = key
+        return self._engine._get_query_result(key)
+
+    def cache_result(self, expr: AbstractExpr, items: list):
+        key = self._result_keys.pop(expr, None)
+        if key is not None:
+            self._engine._put_query_result(key, items)
+
+    def span(self, name: str, info: dict):
+        info["document_type"] = self._doc_type.get_document_name()
+        return self._instrumentation.span(name, info)
+
+    def _read_data(self, item) -> dict:
+        data = self._engine._get_document_data(item)
+        if data is None:
+            data = self._engine._reload_document_data(self._doc_type, item)
+
+        return data
+
+    def load(self, items: list) -> list:
+        """
+        reads the data of all items which are not read yet (concurrently) and
+        returns the items whose documents were not deleted in the meantime.
+        """
+        missing = [item for item in items if item not in self._data]
+        if len(missing) == 1:
+            with self._engine._foreground(), self._instrumentation.timer("read.load"):
+                self._data[missing[0]] = self._read_data(missing[0])
+        elif len(missing) > 1:
+            with self._engine._foreground(), self._instrumentation.timer("read.load"):
+                read_data = self._instrumentation.bind(self._read_data)
+                with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                    for item, data in zip(missing, executor.map(read_data, missing)):
+                        self._data[item] = data
+
+        return [item for item in items if self._data[item] is not None]
+
+    def existing(self, items: list) -> list:
+        """
+        get the items whose documents still exist. Items which are not read yet
+        are looked up in the current listing of their directories.
+        """
+        unread = [item for item in items if item not in self._data]
+        listed = set()
+        if len(unread) > 0:
+            listed = set(self._engine._get_existing_refs(self._doc_type, unread))
+
+        return [
+            item for item in items
+            if (item in listed if item not in self._data else self._data[item] is not None)
+        ]
+
+    def hydrate(self, items: list) -> List[Document]:
+        documents = []
+        for item in self.load(items):
+            doc = self._documents.get(item)
+            if doc is None:
+                doc = self._engine._create_document(
+                    self._doc_type, self._data[item])
+                self._documents[item] = doc
+            documents.append(doc)
+
+        return documents
+
+    def _get_join(self, attr_name: str) -> tuple:
+        """
+        builds the hash join of a ManyToOne relationship: the source of the related
+        documents and the references of the related documents by their IDs.
+        The related documents referenced by the already read documents are read at once.
+        """
+        join = self._joins.get(attr_name)
+        if join is not None:
+            return join
+
+        attr = self._relationships.get(attr_name)
+        if not isinstance(attr, ManyToOne):
+            raise ValueError(
+                str(attr_name) + " is no ManyToOne relationship of "
+                + str(self._doc_type.__name__))
+
+        rel_type = self._engine._get_doc_class_by_name(attr._rel_class_name)
+        source = CollectionSource(self._engine, rel_type)
+        refs_by_id = {}
+        unresolved = []
+        for ref in self._engine._list_collection(rel_type)[1]:
+            doc_id = self._engine._get_id_from_ref(ref)
+            if doc_id is None:
+                unresolved.append(ref)
+            else:
+                refs_by_id[doc_id] = ref
+
+        for ref in source.load(unresolved):
+            refs_by_id[str(source._data[ref]["id"])] = ref
+
+        referenced = set()
+        for data in list(self._data.values()):
+            if data is not None:
+                for target_id in get_reference_ids(data.get(attr_name)):
+                    if target_id in refs_by_id:
+                        referenced.add(refs_by_id[target_id])
+        source.load(list(referenced))
+
+        join = (source, refs_by_id)
+        self._joins[attr_name] = join
+        return join
+
+    def _get_joined_value(self, item, attr_name: str):
+        """get the value of a dotted attribute name from the joined document data"""
+        rel_name, rel_attr_name = attr_name.split(".", 1)
+        source, refs_by_id = self._get_join(rel_name)
+
+        data = self._data.get(item)
+        if data is None:
+            self.load([item])
+            data = self._data[item]
+            if data is None:
+                return None
+
+        for target_id in get_reference_ids(data.get(rel_name)):
+            ref = refs_by_id.get(target_id)
+            if ref is not None:
+                return source.get_value(ref, rel_attr_name)
+
+        return None
+
+    def get_value(self, item, attr_name: str):
+        """
+        get the value of a field directly from the document data.
+        Dotted attribute names (e.g. ``department.name``) are resolved
+        by a hash join with the documents of the ManyToOne relationship.
+        """
+        if "." in attr_name:
+            return self._get_joined_value(item, attr_name)
+
+        field = self._fields.get(attr_name)
+        if field is None and attr_name == "id":
+            return self.get_id(item)
+
+        if field is None or item in self._documents:
+            documents = self.hydrate([item])
+            if len(documents) == 0:
+                return None
+            return super().get_value(documents[0], attr_name)
+
+        data = self._data.get(item)
+        if data is None:
+            self.load([item])
+            data = self._data[item]
+            if data is None:
+                return None
 
-        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-            # Submit tasks for each JSON file
-            futures = [
-                executor.submit(
-                    self._concurrent_read_helper, doc_type, os.path.join(
-                        base_path, document)
-                )
-                for document in document_jsons]
+        if attr_name == self._primary_key:
+            value = data.get("id")
+        else:
+            value = data.get(attr_name)
 
-            # Wait for all tasks to complete
-            documents = [future.result() for future in futures]
+        if value is None:
+            return None
 
-        return Query(documents)
+        return field._datatype.cast(value)
+
+    def get_id(self, item) -> uuid.UUID:
+        """get the document ID from the reference or the document data"""
+        doc_id = self._engine._get_id_from_ref(item)
+        if doc_id is None:
+            self.load([item])
+            doc_id = self._data[item]["id"]
+
+        return UUID.cast(doc_id)
+
+    def get_id_attributes(self) -> tuple:
+        if self._primary_key is not None:
+            return ("id", self._primary_key)
+
+        return ("id",)
+
+    def get_statistics(self) -> PlannerStatistics:
+        return self._engine._get_planner_statistics(self._doc_type)
+
+    def get_reference_lookup(self):
+        """get a function looking up the IDs of documents referencing given IDs"""
+        many_to_one = [
+            name for name, attr in self._engine._get_compiled_model(
+                self._doc_type).relationships
+            if isinstance(attr, ManyToOne)]
+
+        def lookup(attr_name: str, target_ids) -> set:
+            if attr_name not in many_to_one:
+                return None
+            return self._engine._lookup_references(
+                self._doc_type, attr_name, target_ids)
+
+        return lookup
+
+
+class Warmup(Future):
+    """
+    Future of a cache warm-up started by :meth:`StorageEngine.warmup`.
+    Its result is the number of read documents.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.documents_total = 0
+        self.documents_read = 0
+        self._stopped = threading.Event()
+
+    @property
+    def progress(self) -> float:
+        """ratio of the read documents, 1.0 when the warm-up is done"""
+        if self.done():
+            return 1.0
+        if self.documents_total == 0:
+            return 0.0
+        return self.documents_read / self.documents_total
+
+    @property
+    def stopped(self) -> bool:
+        """wether the warm-up was stopped"""
+        return self._stopped.is_set()
+
+    def stop(self):
+        """stops the warm-up after the current batch, the future is done afterwards"""
+        self._stopped.set()
+
+
+def remove_expired_lock(lock_path: str, is_expired) -> bool:
+    """
+    Removes an expired lock file without racing other processes doing the same.
+    The lock file is renamed to a unique name first, so only one process can take
+    it over. If it turns out to be a lock acquired again in the meantime, it is
+    given back instead of being removed.
+
+    :param lock_path: Path of the lock file.
+    :type lock_path: str
+    :param is_expired: Function returning wether the lock at the path is expired.
+    :type is_expired: callable
+    :return: Wether the lock file is gone and the lock can be acquired again.
+    :rtype: bool
+    """
+    try:
+        stat = os.stat(lock_path)
+    except FileNotFoundError:
+        return True
+
+    if not is_expired():
+        return False
+
+    stale_path = lock_path + "." + uuid.uuid4().hex + ".lock"
+    try:
+        os.rename(lock_path, stale_path)
+    except FileNotFoundError:
+        # another process took it over first
+        return True
+
+    try:
+        moved = os.stat(stale_path)
+        if (moved.st_ino, moved.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+            try:
+                # linking never replaces a lock created after the rename
+                os.link(stale_path, lock_path)
+            except FileExistsError:
+                pass
+    finally:
+        os.remove(stale_path)
+
+    return True
 
 
 class DocumentLock:
@@ -513,6 +1695,11 @@ class DocumentLock:
         self.__dateformat = '%Y-%m-%d %H:%M:%S'
         self.__expiration = expiration
 
+    @property
+    def document(self) -> Document:
+        """the locked document"""
+        return self.__document
+
     def _is_lock_expired(self):
         try:
             with open(self.__lock_path, "r", encoding="utf-8") as lock_file:
@@ -520,8 +1707,18 @@ class DocumentLock:
                 creation_date = datetime.strptime(lines[1], self.__dateformat)
                 return (datetime.now()-creation_date).total_seconds() > self.__expiration
         except IndexError:
-            return True
+            return self._is_lock_file_expired()
         except ValueError:
+            return self._is_lock_file_expired()
+
+    def _is_lock_file_expired(self):
+        """
+        wether a lock file without a valid date is expired. The file may still be
+        written by the process creating it, so it expires by its modification time.
+        """
+        try:
+            return time.time() - os.path.getmtime(self.__lock_path) > self.__expiration
+        except OSError:
             return True
 
     def _is_owner(self):
@@ -533,20 +1730,24 @@ class DocumentLock:
         except IndexError:
             return False
 
-    def _cleanup_old_lock(self):
-        if os.path.exists(self.__lock_path):
-            os.remove(self.__lock_path)
+    def _cleanup_old_lock(self) -> bool:
+        """removes an expired lock, returns wether the lock can be acquired again"""
+        return remove_expired_lock(self.__lock_path, self._is_lock_expired)
 
     def lock(self):
         """locks a document"""
-        if self.is_locked():
-            raise DocumentLockException("Document is already locked.")
-
-        self._cleanup_old_lock()
-
-        with open(self.__lock_path, "a", encoding="utf-8") as lock_file:
+        while True:
+            try:
+                # created exclusively, so only one process can acquire the lock
+                fd = os.open(self.__lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                if not self._cleanup_old_lock():
+                    raise DocumentLockException("Document is already locked.")
+
+        with os.fdopen(fd, "w", encoding="utf-8") as lock_file:
             lock_file.writelines(
-                [str(self._lock_id),
+                [str(self._lock_id) + "\n",
                  datetime.now().strftime(self.__dateformat)]
             )
 
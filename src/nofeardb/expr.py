@@ -8,14 +8,106 @@ from abc import ABC, abstractmethod
 
 from .orm import Document
 
+OPERATOR_SOURCES = {
+    operator.eq: "==",
+    operator.ne: "!=",
+    operator.lt: "<",
+    operator.le: "<=",
+    operator.gt: ">",
+    operator.ge: ">=",
+    operator.is_: "is",
+    operator.is_not: "is not",
+}
+
+
+def get_path_value(instance: Document, attr_name: str):
+    """
+    get the value of an attribute of a document instance. A dotted attribute name
+    (e.g. ``department.name``) is resolved through the related documents,
+    None is returned if a related document is not set.
+    """
+    value = instance
+    for name in attr_name.split("."):
+        if value is None:
+            return None
+        value = getattr(value, name)
+
+    return value
+
+
+def _get_reference(value):
+    """get the ID of a document, eq, neq and is_in compare documents by their IDs"""
+    if isinstance(value, Document):
+        return value.__id__
+
+    return value
+
+
+def _get_references(container):
+    """
+    get the IDs of the documents of an is_in list, tuple or set,
+    or None if the container holds no documents.
+    """
+    if not isinstance(container, (list, tuple, set, frozenset)):
+        return None
+
+    if not any(isinstance(value, Document) for value in container):
+        return None
+
+    return [_get_reference(value) for value in container]
+
+
+def _contains_hashed(values: frozenset, container, value) -> bool:
+    """
+    membership test of a value in the frozen set of a container, unhashable
+    values (e.g. lists) are searched in the container itself.
+    """
+    try:
+        return value in values
+    except TypeError:
+        return value in container
+
 
 class AbstractExpr(ABC):
 
-    @abstractmethod
+    _compiled = None
+
+    def compile(self):
+        """
+        compiles the expression into a single python function
+        predicate(get_value, item) -> bool, which evaluates the expression like
+        :meth:`evaluate_with`. Constants are bound once, "is_in" lists, tuples
+        and sets are converted to frozen sets if possible. The function is compiled
+        only once per expression.
+        """
+        if self._compiled is None:
+            namespace = {}
+            source = "def predicate(_get, item):\n    return " + \
+                self._generate(namespace) + "\n"
+            code = compile(source, "<nofeardb expression>", "exec")
+            exec(code, namespace)  # pylint: disable=exec-used
+            self._compiled = namespace["predicate"]
+
+        return self._compiled
+
+    def _generate(self, namespace: dict) -> str:
+        """generates the python source of the expression, binding values in the namespace"""
+        name = "_e" + str(len(namespace))
+        namespace[name] = self.evaluate_with
+        return name + "(_get, item)"
+
     def evaluate(self, instance: Document) -> bool:
         """
         evaluate the expression for the given document instance
         """
+        return self.evaluate_with(get_path_value, instance)
+
+    @abstractmethod
+    def evaluate_with(self, get_value, item) -> bool:
+        """
+        evaluate the expression for an item whose attribute values
+        are provided by the function get_value(item, attr_name)
+        """
 
 
 class Expr(AbstractExpr):
@@ -25,12 +117,79 @@ class Expr(AbstractExpr):
         self.__value = value
         self.__operator = op
 
-    def evaluate(self, instance: Document) -> bool:
-        attr_value = getattr(instance, self.__attr_name)
+    @property
+    def attr_name(self) -> str:
+        """name of the evaluated attribute"""
+        return self.__attr_name
+
+    @property
+    def value(self):
+        """value the attribute is evaluated against"""
+        return self.__value
+
+    @property
+    def operator(self):
+        """operator function of the expression"""
+        return self.__operator
+
+    def _generate(self, namespace: dict) -> str:
+        attr_source = "_get(item, " + repr(self.__attr_name) + ")"
+        value_name = "_c" + str(len(namespace))
+        value = self.__value
+
+        references = None
+        if self.__operator == operator.contains:
+            references = _get_references(value)
+        elif isinstance(value, Document) and self.__operator in (operator.eq, operator.ne):
+            references = value.__id__
+
+        if references is not None:
+            value = references
+            reference_name = "_r" + str(len(namespace))
+            namespace[reference_name] = _get_reference
+            attr_source = reference_name + "(" + attr_source + ")"
+
+        if self.__operator == operator.contains:
+            namespace[value_name] = value
+            if isinstance(value, (list, tuple, set, frozenset)):
+                try:
+                    values = frozenset(value)
+                except TypeError:
+                    values = None
+                if values is not None:
+                    set_name = "_s" + str(len(namespace))
+                    namespace[set_name] = values
+                    contains_name = "_o" + str(len(namespace))
+                    namespace[contains_name] = _contains_hashed
+                    return (
+                        contains_name + "(" + set_name + ", "
+                        + value_name + ", " + attr_source + ")"
+                    )
+            return "(" + attr_source + " in " + value_name + ")"
+
+        namespace[value_name] = value
+        if self.__operator in OPERATOR_SOURCES:
+            return (
+                "(" + attr_source + " " + OPERATOR_SOURCES[self.__operator]
+                + " " + value_name + ")"
+            )
+
+        operator_name = "_o" + str(len(namespace))
+        namespace[operator_name] = self.__operator
+        return operator_name + "(" + attr_source + ", " + value_name + ")"
+
+    def evaluate_with(self, get_value, item) -> bool:
+        attr_value = get_value(item, self.__attr_name)
 
         if self.__operator == operator.contains:
+            references = _get_references(self.__value)
+            if references is not None:
+                return self.__operator(references, _get_reference(attr_value))
             return self.__operator(self.__value, attr_value)
 
+        if isinstance(self.__value, Document) and self.__operator in (operator.eq, operator.ne):
+            return self.__operator(_get_reference(attr_value), self.__value.__id__)
+
         return self.__operator(attr_value, self.__value)
 
 
@@ -40,10 +199,21 @@ class AndExpr(AbstractExpr):
         self.__expr1 = expr1
         self.__expr2 = expr2
 
-    def evaluate(self, instance: Document) -> bool:
+    @property
+    def expressions(self) -> tuple:
+        """the linked expressions"""
+        return (self.__expr1, self.__expr2)
+
+    def _generate(self, namespace: dict) -> str:
+        return (
+            "(" + self.__expr1._generate(namespace)
+            + " and " + self.__expr2._generate(namespace) + ")"
+        )
+
+    def evaluate_with(self, get_value, item) -> bool:
         return (
-            self.__expr1.evaluate(instance)
-            and self.__expr2.evaluate(instance)
+            self.__expr1.evaluate_with(get_value, item)
+            and self.__expr2.evaluate_with(get_value, item)
         )
 
 
@@ -53,10 +223,21 @@ class OrExpr(AbstractExpr):
         self.__expr1 = expr1
         self.__expr2 = expr2
 
-    def evaluate(self, instance: Document) -> bool:
+    @property
+    def expressions(self) -> tuple:
+        """the linked expressions"""
+        return (self.__expr1, self.__expr2)
+
+    def _generate(self, namespace: dict) -> str:
         return (
-            self.__expr1.evaluate(instance)
-            or self.__expr2.evaluate(instance)
+            "(" + self.__expr1._generate(namespace)
+            + " or " + self.__expr2._generate(namespace) + ")"
+        )
+
+    def evaluate_with(self, get_value, item) -> bool:
+        return (
+            self.__expr1.evaluate_with(get_value, item)
+            or self.__expr2.evaluate_with(get_value, item)
         )
 
 
@@ -64,6 +245,8 @@ def eq(attr_name, value) -> Expr:
     """
     Equals operator (==)
 
+    Documents are compared by their IDs.
+
     :param attr_name: Name of the document attribute to evaluate.
     :type attr_name: str
     :param value: Value to evaluate attribute against.
@@ -78,6 +261,8 @@ def neq(attr_name, value) -> Expr:
     """
     Not equals operator (!=)
 
+    Documents are compared by their IDs.
+
     :param attr_name: Name of the document attribute to evaluate.
     :type attr_name: str
     :param value: Value to evaluate attribute against.
@@ -148,6 +333,8 @@ def is_in(attr_name, value) -> Expr:
     """
     Is in operator (in)
 
+    Documents are compared by their IDs.
+
     :param attr_name: Name of the document attribute to evaluate.
     :type attr_name: str
     :param value: Value to evaluate attribute against.
@@ -0,0 +1,164 @@
+"""
+Document formats used to encode and decode the persisted document data
+"""
+
+import json
+import marshal
+from abc import ABC, abstractmethod
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+class DocumentCodec(ABC):
+    """Abstract codec which converts document data to bytes and back"""
+
+    name = None
+    extension = None
+
+    @abstractmethod
+    def encode(self, data: dict) -> bytes:
+        """encodes the document data"""
+
+    @abstractmethod
+    def decode(self, raw: bytes) -> dict:
+        """decodes the document data"""
+
+
+class JsonCodec(DocumentCodec):
+    """JSON codec based on the standard library using compact separators"""
+
+    name = "json"
+    extension = ".json"
+
+    def encode(self, data: dict) -> bytes:
+        return json.dumps(
+            data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def decode(self, raw: bytes) -> dict:
+        return json.loads(raw)
+
+
+class FastJsonCodec(JsonCodec):
+    """
+    JSON codec using orjson or ujson if one of them is installed.
+    Falls back to the standard library otherwise.
+    """
+
+    name = "fastjson"
+
+    def __init__(self):
+        if orjson is not None:
+            self.library = "orjson"
+        elif ujson is not None:
+            self.library = "ujson"
+        else:
+            self.library = "json"
+
+    def encode(self, data: dict) -> bytes:
+        if self.library == "orjson":
+            return orjson.dumps(data)
+
+        if self.library == "ujson":
+            return ujson.dumps(data, ensure_ascii=False).encode("utf-8")
+
+        return super().encode(data)
+
+    def decode(self, raw: bytes) -> dict:
+        if self.library == "orjson":
+            return orjson.loads(raw)
+
+        if self.library == "ujson":
+            return ujson.loads(raw)
+
+        return super().decode(raw)
+
+
+class MarshalCodec(DocumentCodec):
+    """
+    Binary codec based on the marshal module of the standard library.
+    Documents are written with marshal version 4, but python does not guarantee
+    that marshal data can be read by other python versions. The format is only
+    safe if all processes using the database run the same python version.
+    """
+
+    name = "marshal"
+    extension = ".marshal"
+
+    def encode(self, data: dict) -> bytes:
+        return marshal.dumps(data, 4)
+
+    def decode(self, raw: bytes) -> dict:
+        return marshal.loads(raw)
+
+
+class MsgpackCodec(DocumentCodec):
+    """Binary codec based on the optional msgpack package"""
+
+    name = "msgpack"
+    extension = ".msgpack"
+
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError(
+                "The msgpack codec requires the package \'msgpack\' to be installed.")
+
+    def encode(self, data: dict) -> bytes:
+        return msgpack.packb(data, use_bin_type=True)
+
+    def decode(self, raw: bytes) -> dict:
+        return msgpack.unpackb(raw, raw=False)
+
+
+CODECS = {
+    JsonCodec.name: JsonCodec,
+    FastJsonCodec.name: FastJsonCodec,
+    MarshalCodec.name: MarshalCodec,
+    MsgpackCodec.name: MsgpackCodec,
+}
+
+
+def get_codec(codec) -> DocumentCodec:
+    """
+    Get a codec instance.
+
+    :param codec: Name of a registered codec or a codec instance.
+    :type codec: str, :class:`DocumentCodec`
+    :return: Codec instance.
+    :rtype: :class:`DocumentCodec`
+    """
+    if isinstance(codec, DocumentCodec):
+        return codec
+
+    if codec in CODECS:
+        return CODECS[codec]()
+
+    raise ValueError("Unknown codec \'" + str(codec) + "\'")
+
+
+def get_codec_for_extension(extension: str) -> DocumentCodec:
+    """
+    Get an instance of the first registered codec writing files with the given extension.
+
+    :param extension: File extension including the leading dot.
+    :type extension: str
+    :return: Codec instance or None if no codec uses the extension.
+    :rtype: :class:`DocumentCodec`
+    """
+    for codec in CODECS.values():
+        if codec.extension == extension:
+            return codec()
+
+    return None
@@ -0,0 +1,332 @@
+"""
+Instrumentation of the storage engine
+"""
+
+import bisect
+import datetime
+import json
+import threading
+import time
+
+# upper bounds of the histogram buckets in seconds
+BUCKET_BOUNDS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0, 10.0)
+
+
+class Histogram:
+    """Distribution of measured durations in exponential buckets"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def add(self, value: float):
+        """adds a measured duration"""
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, value)] += 1
+
+    def to_dict(self) -> dict:
+        """get the histogram as dict"""
+        buckets = {}
+        for bound, count in zip(BUCKET_BOUNDS, self.buckets):
+            buckets["<=" + str(bound)] = count
+        buckets[">" + str(BUCKET_BOUNDS[-1])] = self.buckets[-1]
+
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count > 0 else None,
+            "min": self.min,
+            "max": self.max,
+            "buckets": buckets,
+        }
+
+
+class EngineHook:
+    """
+    Base class of hooks which are called around the operations of a storage engine
+    (see :meth:`nofeardb.engine.StorageEngine.add_hook`).
+
+    The operations are identified by name:
+
+    - ``read``, ``create``, ``update``, ``delete`` and ``lazy_load``
+    - the phases of the operations, e.g. ``update.lock`` or ``read.load``
+    - ``lock.acquire`` and ``lock.release`` of a single document lock
+    - ``file.read``, ``file.write``, ``file.append`` and ``file.remove``
+
+    - ``where`` for the evaluation of a where expression of a query
+      (with the ``fingerprint`` of the expression and the numbers of documents
+      ``scanned`` and ``returned``)
+
+    The info dict describes the operation (e.g. ``document_type``, ``document_id``
+    or ``path``). The same dict is passed to :meth:`before` and :meth:`after`,
+    so a hook can store its own values in it, e.g. the span of a tracer.
+    For operations which are not part of another operation, :meth:`after` finds
+    the summed durations of the nested operations by name under ``phases`` and the
+    counters incremented during the operation under ``counters`` in the info dict.
+    Hooks are called by the thread running the operation.
+    """
+
+    def before(self, name: str, info: dict):
+        """
+        called before an operation starts
+
+        :param name: Name of the operation.
+        :type name: str
+        :param info: Description of the operation.
+        :type info: dict
+        """
+
+    def after(self, name: str, info: dict, seconds: float, error: Exception):
+        """
+        called after an operation finished
+
+        :param name: Name of the operation.
+        :type name: str
+        :param info: Description of the operation.
+        :type info: dict
+        :param seconds: Duration of the operation.
+        :type seconds: float
+        :param error: Exception raised by the operation or None.
+        :type error: Exception
+        """
+
+
+class _Span:
+    """Operation which is not part of another operation, sums up its nested operations"""
+
+    __slots__ = ("lock", "phases", "counters")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.counters = {}
+
+    def add(self, values: dict, name: str, value):
+        with self.lock:
+            values[name] = values.get(name, 0) + value
+
+
+class _Timer:
+    """
+    Context manager adding the duration of its block to a histogram
+    and calling the hooks around it
+    """
+
+    __slots__ = ("_instrumentation", "_name", "_info", "_hooks", "_start", "_span")
+
+    def __init__(self, instrumentation: 'Instrumentation', name: str, info: dict):
+        self._instrumentation = instrumentation
+        self._name = name
+        self._info = info
+        self._hooks = instrumentation.hooks
+        self._start = None
+        self._span = None
+
+    def __enter__(self):
+        for hook in self._hooks:
+            hook.before(self._name, self._info)
+
+        local = self._instrumentation._local
+        if getattr(local, "span", None) is None:
+            self._span = local.span = _Span()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self._start
+        self._instrumentation.observe(self._name, seconds)
+        if self._span is None:
+            span = self._instrumentation._local.span
+            span.add(span.phases, self._name, seconds)
+        else:
+            self._instrumentation._local.span = None
+            self._info["phases"] = self._span.phases
+            self._info["counters"] = self._span.counters
+
+        for hook in reversed(self._hooks):
+            hook.after(self._name, self._info, seconds, exc)
+
+
+class _Bound:
+    """Function called as part of the operation running when it was bound"""
+
+    __slots__ = ("_instrumentation", "_function", "_span")
+
+    def __init__(self, instrumentation: 'Instrumentation', function, span: _Span):
+        self._instrumentation = instrumentation
+        self._function = function
+        self._span = span
+
+    def __call__(self, *args, **kwargs):
+        local = self._instrumentation._local
+        previous = getattr(local, "span", None)
+        local.span = self._span
+        try:
+            return self._function(*args, **kwargs)
+        finally:
+            local.span = previous
+
+
+class _NullTimer:
+    """Context manager doing nothing"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Instrumentation:
+    """
+    Counters and duration histograms collected by a storage engine.
+    Durations are collected by name, e.g. ``update`` for the whole operation
+    and ``update.lock`` for one of its phases.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {}
+        self._histograms = {}
+        self.hooks = ()
+
+    def add_hook(self, hook: EngineHook):
+        """adds a hook which is called around every measured operation"""
+        with self._lock:
+            self.hooks = self.hooks + (hook,)
+
+    def remove_hook(self, hook: EngineHook):
+        """removes a hook"""
+        with self._lock:
+            self.hooks = tuple(h for h in self.hooks if h is not hook)
+
+    def reset(self):
+        """resets all counters and histograms"""
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def count(self, name: str, value: int = 1):
+        """adds the value to a counter"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+        self._count_in_span(name, value)
+
+    def _count_in_span(self, name: str, value: int):
+        span = getattr(self._local, "span", None)
+        if span is not None:
+            span.add(span.counters, name, value)
+
+    def observe(self, name: str, seconds: float):
+        """adds a measured duration to a histogram"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.add(seconds)
+
+    def timer(self, name: str, **info):
+        """get a context manager measuring the duration of its block"""
+        return self.span(name, info)
+
+    def span(self, name: str, info: dict):
+        """
+        get a context manager measuring the duration of its block.
+        The info dict can be extended in the block, the hooks get it after the block.
+        """
+        return _Timer(self, name, info)
+
+    def bind(self, function):
+        """
+        get the function bound to the operation running in the current thread,
+        to run it as part of the operation in another thread
+        """
+        span = getattr(self._local, "span", None)
+        if span is None:
+            return function
+        return _Bound(self, function, span)
+
+    def snapshot(self) -> dict:
+        """get the current counters and histograms"""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "timings": {
+                    name: histogram.to_dict()
+                    for name, histogram in self._histograms.items()
+                },
+            }
+
+
+class DisabledInstrumentation(Instrumentation):
+    """Instrumentation which collects nothing, only the hooks are called"""
+
+    enabled = False
+
+    def count(self, name: str, value: int = 1):
+        if len(self.hooks) > 0:
+            self._count_in_span(name, value)
+
+    def observe(self, name: str, seconds: float):
+        pass
+
+    def span(self, name: str, info: dict):
+        if len(self.hooks) == 0:
+            return _NULL_TIMER
+        return _Timer(self, name, info)
+
+
+class SlowOperationLog(EngineHook):
+    """
+    Hook writing the operations which took longer than a threshold as JSON lines
+    to a file. Only operations which are not part of another operation are logged,
+    with their info (e.g. the fingerprint of a where expression and the numbers
+    of documents scanned and returned), the cache hit ratio and the phase durations.
+
+    :param path: Path of the log file, lines are appended.
+    :type path: str
+    :param threshold: Minimum duration in seconds of the logged operations.
+    :type threshold: float
+    """
+
+    def __init__(self, path: str, threshold: float = 1.0):
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+
+    def after(self, name: str, info: dict, seconds: float, error: Exception):
+        if seconds < self.threshold or "phases" not in info:
+            return
+
+        counters = info["counters"]
+        hits = counters.get("cache_hits", 0)
+        misses = counters.get("cache_misses", 0)
+        entry = {
+            "time": datetime.datetime.now().isoformat(),
+            "operation": name,
+            "seconds": seconds,
+            "error": None if error is None else repr(error),
+        }
+        entry.update(info)
+        entry["cache_hit_ratio"] = hits / (hits + misses) if hits + misses > 0 else None
+
+        line = json.dumps(entry, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as log_file:
+                log_file.write(line)
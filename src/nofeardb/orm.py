@@ -10,6 +10,14 @@ import hashlib
 from .datatypes import OrmDataType
 from .enums import DocumentStatus
 
+HASH_FUNCTIONS = {
+    "md5": hashlib.md5,
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "blake2b": lambda: hashlib.blake2b(digest_size=8),
+    "blake2s": lambda: hashlib.blake2s(digest_size=8),
+}
+
 
 class Document:
     """
@@ -17,6 +25,8 @@ class Document:
     """
 
     __documentname__ = None
+    __documentformat__ = None
+    __documentshardlength__ = None
     __primary_key_attribute__ = None
 
     def __init__(self):
@@ -27,6 +37,8 @@ class Document:
         self.__added_relationships__ = {}
         self.__removed_relationships__ = {}
         self.__data_snapshot__ = {}
+        self.__field_digests__ = {}
+        self.__digest_algorithm__ = None
 
     @classmethod
     def get_document_name(cls):
@@ -51,6 +63,8 @@ class Document:
         :param document: Document which should be related
         :type document: :class:`Document`
         """
+        self.__field_digests__.pop(rel_name, None)
+
         if rel_name in self.__removed_relationships__:
             if isinstance(self.__removed_relationships__[rel_name], list):
                 if document in self.__removed_relationships__[rel_name]:
@@ -72,6 +86,8 @@ class Document:
         :param document: Document which is related
         :type document: :class:`Document`
         """
+        self.__field_digests__.pop(rel_name, None)
+
         if rel_name in self.__added_relationships__:
             if isinstance(self.__added_relationships__[rel_name], list):
                 if document in self.__added_relationships__[rel_name]:
@@ -122,34 +138,70 @@ class Document:
 
         self.__changed_fields__ = []
 
-    def get_hash(self):
+    def get_field_digests(self, hash_function: str = "md5") -> dict:
+        """
+        Get the cache of per attribute digests for the given hash function.
+        The cache is cleared if the hash function differs from the cached one.
+
+        :param hash_function: Name of the hash function.
+        :type hash_function: str
+        :return: Digests by attribute name
+        :rtype: dict
+        """
+        if self.__digest_algorithm__ != hash_function:
+            self.__field_digests__.clear()
+            self.__digest_algorithm__ = hash_function
+
+        return self.__field_digests__
+
+    def get_hash(self, hash_function: str = "md5"):
         """
-        Calculates the hash value for the document
+        Calculates the hash value for the document.
+
+        A digest is calculated for every attribute and the document hash
+        is the hash of all attribute digests. Attribute digests are cached
+        until the attribute changes, so only modified attributes are
+        serialized again.
 
+        :param hash_function: Name of the hash function, see :data:`HASH_FUNCTIONS`.
+        :type hash_function: str
         :return: Hash value for all attributes
         :rtype: str
         """
-        m = hashlib.md5()
+        new_hash = HASH_FUNCTIONS[hash_function]
+        digests = self.get_field_digests(hash_function)
+        m = new_hash()
 
         for name, attr in vars(self.__class__).items():
-            if isinstance(attr, Field):
-                m.update(name.encode())
-                field_type: OrmDataType = getattr(
-                    self, name + "__datatype")
-                attr_value = getattr(self, name)
-                if attr_value is not None:
-                    m.update(str(field_type.serialize(
-                        attr_value)).encode())
-                else:
-                    m.update(str(None).encode())
-            if isinstance(attr, ManyToMany) or isinstance(attr, OneToMany):
-                m.update(name.encode())
-                m.update(str([str(doc.__id__)
-                              for doc in getattr(self, name)]).encode())
-            if isinstance(attr, ManyToOne):
-                m.update(name.encode())
-                if getattr(self, name) is not None:
-                    m.update(str(getattr(self, name).__id__).encode())
+            if not isinstance(attr, (Field, ManyToMany, OneToMany, ManyToOne)):
+                continue
+
+            digest = digests.get(name)
+            if digest is None:
+                field_hash = new_hash()
+                field_hash.update(name.encode())
+                if isinstance(attr, Field):
+                    field_type: OrmDataType = getattr(
+                        self, name + "__datatype")
+                    attr_value = getattr(self, name)
+                    if attr_value is not None:
+                        field_hash.update(str(field_type.serialize(
+                            attr_value)).encode())
+                    else:
+                        field_hash.update(str(None).encode())
+                if isinstance(attr, ManyToMany) or isinstance(attr, OneToMany):
+                    field_hash.update(str([str(doc.__id__)
+                                           for doc in attr.get_relation(self)]).encode())
+                if isinstance(attr, ManyToOne):
+                    rel_doc = attr.get_relation(self)
+                    if rel_doc is not None:
+                        field_hash.update(str(rel_doc.__id__).encode())
+
+                digest = field_hash.digest()
+                if name != self.__primary_key_attribute__:
+                    digests[name] = digest
+
+            m.update(digest)
 
         return str(m.hexdigest())
 
@@ -246,6 +298,29 @@ class OneToManyList(list):
     def extend(self, value):
         raise RuntimeError("extending of relationships not allowed")
 
+    def insert(self, index, value):
+        raise RuntimeError(
+            "insert for relationship items not allowed. Use \'append\' instead")
+
+    def pop(self, index=-1):
+        raise RuntimeError(
+            "pop for relationship items not allowed. Use \'remove\' instead")
+
+    def clear(self):
+        raise RuntimeError(
+            "clear for relationships not allowed. Use \'remove\' instead")
+
+    def __imul__(self, value):
+        raise RuntimeError("repetition of relationships not allowed")
+
+    def sort(self, *args, **kwargs):
+        super(OneToManyList, self).sort(*args, **kwargs)
+        self._relationship_owner.__field_digests__.pop(self._relationship_name, None)
+
+    def reverse(self):
+        super(OneToManyList, self).reverse()
+        self._relationship_owner.__field_digests__.pop(self._relationship_name, None)
+
     def remove(self, related_doc: Document):
         if related_doc in self:
             if self._back_populates is not None:
@@ -334,6 +409,29 @@ class ManyToManyList(list):
     def extend(self, value):
         raise RuntimeError("extending of relationships not allowed")
 
+    def insert(self, index, value):
+        raise RuntimeError(
+            "insert for relationship items not allowed. Use \'append\' instead")
+
+    def pop(self, index=-1):
+        raise RuntimeError(
+            "pop for relationship items not allowed. Use \'remove\' instead")
+
+    def clear(self):
+        raise RuntimeError(
+            "clear for relationships not allowed. Use \'remove\' instead")
+
+    def __imul__(self, value):
+        raise RuntimeError("repetition of relationships not allowed")
+
+    def sort(self, *args, **kwargs):
+        super(ManyToManyList, self).sort(*args, **kwargs)
+        self._relationship_owner.__field_digests__.pop(self._relationship_name, None)
+
+    def reverse(self):
+        super(ManyToManyList, self).reverse()
+        self._relationship_owner.__field_digests__.pop(self._relationship_name, None)
+
     def __backpopulate_remove(self, related_doc):
         inverse_relationship = getattr(
             related_doc, self._back_populates)
@@ -646,6 +744,8 @@ class Field:
         if instance.__status__ == DocumentStatus.SYNC:
             instance.__status__ = DocumentStatus.MOD
 
+        instance.__field_digests__.pop(self._name, None)
+
         if self._primary_key:
             key = self._datatype.cast(value)
             if not isinstance(key, uuid.UUID):
@@ -0,0 +1,445 @@
+"""
+Query planner for where expressions
+"""
+
+import operator
+import threading
+from typing import List
+
+from .datatypes import UUID
+from .expr import AbstractExpr, AndExpr, Expr, OrExpr, and_, or_
+from .orm import Document
+
+OPERATOR_NAMES = {
+    operator.eq: "eq",
+    operator.ne: "neq",
+    operator.lt: "lt",
+    operator.le: "lte",
+    operator.gt: "gt",
+    operator.ge: "gte",
+    operator.contains: "is_in",
+    operator.is_: "is_",
+    operator.is_not: "is_not",
+}
+
+# selectivity estimates used as long as no statistics were collected
+DEFAULT_SELECTIVITIES = {
+    operator.eq: 0.1,
+    operator.ne: 0.9,
+    operator.lt: 0.3,
+    operator.le: 0.3,
+    operator.gt: 0.3,
+    operator.ge: 0.3,
+    operator.contains: 0.2,
+    operator.is_: 0.1,
+    operator.is_not: 0.9,
+}
+DEFAULT_SELECTIVITY = 0.5
+
+ID_LOOKUP = "id lookup"
+REFERENCE_LOOKUP = "reference index lookup"
+FULL_SCAN = "full scan"
+RESULT_CACHE = "result cache"
+
+
+def fingerprint(expr: AbstractExpr) -> str:
+    """
+    Normalized representation of an expression without its values,
+    e.g. ``and_(eq(name, ?), gt(number, ?))``. The operands of and_/or_
+    are sorted, so equivalent expressions have the same fingerprint.
+
+    :param expr: Expression.
+    :type expr: :class:`nofeardb.expr.AbstractExpr`
+    :return: Fingerprint.
+    :rtype: str
+    """
+    if isinstance(expr, Expr):
+        return (
+            OPERATOR_NAMES.get(expr.operator, getattr(expr.operator, "__name__", "op"))
+            + "(" + expr.attr_name + ", ?)"
+        )
+
+    if isinstance(expr, AndExpr):
+        return "and_(" + ", ".join(
+            sorted(fingerprint(sub) for sub in flatten(expr, AndExpr))) + ")"
+
+    if isinstance(expr, OrExpr):
+        return "or_(" + ", ".join(
+            sorted(fingerprint(sub) for sub in flatten(expr, OrExpr))) + ")"
+
+    return expr.__class__.__name__ + "()"
+
+
+def cache_key(expr: AbstractExpr) -> str:
+    """
+    Normalized representation of an expression with its values,
+    e.g. ``and_(eq(name, 'Jane'), gt(number, 5))``. Like :func:`fingerprint`
+    the operands of and_/or_ are sorted, the values of is_in are sorted as well.
+
+    :param expr: Expression.
+    :type expr: :class:`nofeardb.expr.AbstractExpr`
+    :return: Key or None if the expression contains custom expressions,
+        whose values are unknown.
+    :rtype: str
+    """
+    if isinstance(expr, Expr):
+        if expr.operator == operator.contains:
+            try:
+                value = "[" + ", ".join(sorted(repr(item) for item in expr.value)) + "]"
+            except TypeError:
+                value = repr(expr.value)
+        else:
+            value = repr(expr.value)
+
+        return (
+            OPERATOR_NAMES.get(expr.operator, getattr(expr.operator, "__name__", "op"))
+            + "(" + expr.attr_name + ", " + value + ")"
+        )
+
+    if isinstance(expr, (AndExpr, OrExpr)):
+        keys = [cache_key(sub) for sub in flatten(expr, expr.__class__)]
+        if None in keys:
+            return None
+        return ("and_(" if isinstance(expr, AndExpr) else "or_(") + ", ".join(sorted(keys)) + ")"
+
+    return None
+
+
+def get_attr_names(expr: AbstractExpr) -> set:
+    """get the names of the attributes an expression evaluates"""
+    if isinstance(expr, Expr):
+        return {expr.attr_name}
+
+    if isinstance(expr, (AndExpr, OrExpr)):
+        return set().union(*(get_attr_names(sub) for sub in expr.expressions))
+
+    return set()
+
+
+def flatten(expr: AbstractExpr, expr_type: type) -> List[AbstractExpr]:
+    """get the operands of nested expressions of the same type (and_ or or_) as flat list"""
+    if isinstance(expr, expr_type):
+        operands = []
+        for sub in expr.expressions:
+            operands.extend(flatten(sub, expr_type))
+        return operands
+
+    return [expr]
+
+
+class PlannerStatistics:
+    """Observed selectivities of conditions by their fingerprint"""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, evaluated: int, matched: int):
+        """records how many of the evaluated documents matched a condition"""
+        with self._lock:
+            total_evaluated, total_matched = self._counts.get(key, (0, 0))
+            self._counts[key] = (total_evaluated + evaluated, total_matched + matched)
+
+    def get_selectivity(self, key: str) -> float:
+        """get the observed selectivity of a condition or None if it was never evaluated"""
+        evaluated, matched = self._counts.get(key, (0, 0))
+        if evaluated == 0:
+            return None
+
+        return matched / evaluated
+
+    def estimate(self, expr: AbstractExpr) -> float:
+        """estimates the ratio of documents matching the expression"""
+        observed = self.get_selectivity(fingerprint(expr))
+        if observed is not None:
+            return observed
+
+        if isinstance(expr, Expr):
+            return DEFAULT_SELECTIVITIES.get(expr.operator, DEFAULT_SELECTIVITY)
+
+        if isinstance(expr, AndExpr):
+            selectivity = 1.0
+            for sub in flatten(expr, AndExpr):
+                selectivity *= self.estimate(sub)
+            return selectivity
+
+        if isinstance(expr, OrExpr):
+            not_selected = 1.0
+            for sub in flatten(expr, OrExpr):
+                not_selected *= 1.0 - self.estimate(sub)
+            return 1.0 - not_selected
+
+        return DEFAULT_SELECTIVITY
+
+
+class Condition:
+    """Part of a plan, evaluated after the previous conditions matched"""
+
+    def __init__(self, expr: AbstractExpr, selectivity: float):
+        self.expr = expr
+        self.fingerprint = fingerprint(expr)
+        self.selectivity = selectivity
+        self.evaluated = None
+        self.matched = None
+
+
+class QueryPlan:
+    """
+    Plan to evaluate a where expression.
+
+    :ivar access_path: :data:`ID_LOOKUP` or :data:`REFERENCE_LOOKUP` if the documents
+        are selected by their IDs before any data is read, :data:`RESULT_CACHE` if
+        the result was taken from the query result cache, otherwise :data:`FULL_SCAN`.
+    :ivar lookup_ids: IDs (as str) of the documents to look up.
+    :ivar conditions: Conditions in the order of evaluation.
+    """
+
+    def __init__(self, input_rows: int):
+        self.access_path = FULL_SCAN
+        self.lookup_ids = None
+        self.conditions: List[Condition] = []
+        self.input_rows = input_rows
+        self.estimated_rows = input_rows
+        self.actual_rows = None
+
+    def explain(self) -> str:
+        """get a readable description of the plan"""
+        if self.access_path == RESULT_CACHE:
+            lines = ["access path: " + RESULT_CACHE + " for " +
+                     str(self.input_rows) + " documents"]
+        elif self.access_path != FULL_SCAN:
+            lines = ["access path: " + self.access_path + " of " + str(len(self.lookup_ids))
+                     + " ids in " + str(self.input_rows) + " documents"]
+        else:
+            lines = ["access path: " + FULL_SCAN + " of " +
+                     str(self.input_rows) + " documents"]
+
+        for index, condition in enumerate(self.conditions):
+            line = (
+                "condition " + str(index + 1) + ": " + condition.fingerprint
+                + ", estimated selectivity " + "%.2f" % condition.selectivity
+            )
+            if condition.evaluated is not None:
+                line += ", matched " + str(condition.matched) + \
+                    " of " + str(condition.evaluated)
+            lines.append(line)
+
+        lines.append(
+            "rows: estimated " + str(int(round(self.estimated_rows)))
+            + ", actual " + ("-" if self.actual_rows is None else str(self.actual_rows)))
+        return "\n".join(lines)
+
+
+def _cast_id(value):
+    """cast a value compared with a document ID to a UUID, if it is one"""
+    try:
+        return UUID.cast(value)
+    except (AttributeError, ValueError):
+        return value
+
+
+def _cast_id_values(expr: AbstractExpr, id_attributes: tuple) -> AbstractExpr:
+    """
+    casts the values compared with the document ID to UUIDs, so a condition
+    like ``eq("id", str(doc_id))`` matches in a full scan as in an ID lookup.
+    """
+    if isinstance(expr, (AndExpr, OrExpr)):
+        link = and_ if isinstance(expr, AndExpr) else or_
+        expr1, expr2 = expr.expressions
+        return link(
+            _cast_id_values(expr1, id_attributes), _cast_id_values(expr2, id_attributes))
+
+    if not isinstance(expr, Expr) or expr.attr_name not in id_attributes:
+        return expr
+
+    if expr.operator in (operator.eq, operator.ne) and isinstance(expr.value, str):
+        return Expr(expr.attr_name, _cast_id(expr.value), expr.operator)
+
+    if expr.operator == operator.contains and isinstance(
+            expr.value, (list, tuple, set, frozenset)):
+        values = type(expr.value)(_cast_id(value) for value in expr.value)
+        return Expr(expr.attr_name, values, expr.operator)
+
+    return expr
+
+
+def _get_value_ids(expr: AbstractExpr) -> set:
+    """get the IDs (as str) an eq or is_in expression compares with"""
+    if not isinstance(expr, Expr):
+        return None
+
+    if expr.operator == operator.eq:
+        values = [expr.value]
+    elif expr.operator == operator.contains:
+        try:
+            values = list(expr.value)
+        except TypeError:
+            return None
+    else:
+        return None
+
+    return {
+        str(value.__id__) if isinstance(value, Document) else str(value)
+        for value in values if value is not None
+    }
+
+
+def _is_document_value(expr: Expr) -> bool:
+    """wether an eq or is_in expression compares with documents only"""
+    if expr.operator == operator.eq:
+        return isinstance(expr.value, Document)
+
+    values = list(expr.value)
+    return len(values) > 0 and all(isinstance(value, Document) for value in values)
+
+
+def _get_lookup(expr: AbstractExpr, id_attributes: tuple, reference_lookup) -> tuple:
+    """get the access path and the IDs of the documents an expression selects, if any"""
+    ids = _get_value_ids(expr)
+    if ids is None:
+        return (None, None)
+
+    if expr.attr_name in id_attributes:
+        return (ID_LOOKUP, ids)
+
+    # the documents are compared by their IDs, other values never match a relationship
+    if reference_lookup is not None and _is_document_value(expr):
+        source_ids = reference_lookup(expr.attr_name, ids)
+        if source_ids is not None:
+            return (REFERENCE_LOOKUP, source_ids)
+
+    return (None, None)
+
+
+def _is_identity_check(expr: AbstractExpr) -> bool:
+    return isinstance(expr, Expr) and expr.operator in (operator.is_, operator.is_not)
+
+
+def _can_raise(expr: AbstractExpr) -> bool:
+    """
+    wether evaluating an expression may raise an error for some values,
+    e.g. ordering comparisons with None or substring tests of non strings.
+    """
+    if isinstance(expr, Expr):
+        if expr.operator in (operator.eq, operator.ne, operator.is_, operator.is_not):
+            return False
+        if expr.operator == operator.contains:
+            return not isinstance(expr.value, (list, tuple, set, frozenset, dict))
+        return True
+
+    if isinstance(expr, (AndExpr, OrExpr)):
+        return any(_can_raise(sub) for sub in expr.expressions)
+
+    return True
+
+
+def _sort_guarded(items: list, key, get_expr=lambda item: item) -> list:
+    """
+    sorts the operands of an and_/or_ expression, without moving operands that
+    may raise. The operands in front of them may be guards written on purpose,
+    e.g. ``and_(neq("age", None), gt("age", 5))``, so only the operands between
+    them are sorted.
+    """
+    ordered = []
+    run = []
+    for item in items:
+        if _can_raise(get_expr(item)):
+            ordered.extend(sorted(run, key=key))
+            ordered.append(item)
+            run = []
+        else:
+            run.append(item)
+
+    ordered.extend(sorted(run, key=key))
+    return ordered
+
+
+def optimize(expr: AbstractExpr, statistics: PlannerStatistics) -> AbstractExpr:
+    """
+    Rewrites an expression by flattening nested and_/or_ expressions and ordering
+    their operands, so the operands deciding the result most likely are evaluated first.
+    is_ and is_not operands are moved to the front, because they usually guard
+    comparisons against None values. Operands which may raise (e.g. gt or lt) are
+    never moved, so they are evaluated after the same operands as written.
+    """
+    if isinstance(expr, AndExpr):
+        operands = [optimize(sub, statistics) for sub in flatten(expr, AndExpr)]
+        operands = _sort_guarded(operands, lambda sub: (
+            not _is_identity_check(sub), statistics.estimate(sub)))
+        link = and_
+    elif isinstance(expr, OrExpr):
+        operands = [optimize(sub, statistics) for sub in flatten(expr, OrExpr)]
+        operands = _sort_guarded(operands, lambda sub: (
+            not _is_identity_check(sub), -statistics.estimate(sub)))
+        link = or_
+    else:
+        return expr
+
+    optimized = operands[0]
+    for operand in operands[1:]:
+        optimized = link(optimized, operand)
+    return optimized
+
+
+def plan(
+    expr: AbstractExpr,
+    input_rows: int,
+    statistics: PlannerStatistics,
+    id_attributes: tuple = ("id",),
+    reference_lookup=None
+) -> QueryPlan:
+    """
+    Plans the evaluation of a where expression.
+    The top level and_ operands are evaluated one after another, ordered by
+    their estimated selectivity as far as possible (see :func:`optimize`).
+    An equality or is_in condition on the document ID is used to select the
+    documents before any document data is read.
+    The same applies to conditions on ManyToOne relationships, if the reverse index
+    of the relationship can be used. Values compared with the document ID are
+    cast to UUIDs, so they match the same way in a lookup and in a full scan.
+
+    :param expr: Where expression.
+    :type expr: :class:`nofeardb.expr.AbstractExpr`
+    :param input_rows: Number of documents the expression is applied to.
+    :type input_rows: int
+    :param statistics: Statistics for the selectivity estimation.
+    :type statistics: :class:`PlannerStatistics`
+    :param id_attributes: Attribute names which contain the document ID.
+    :type id_attributes: tuple
+    :param reference_lookup: Function(attr_name, target_ids) returning the IDs of the
+        documents referencing the targets by the relationship, or None if the
+        relationship cannot be looked up.
+    :return: Query plan.
+    :rtype: :class:`QueryPlan`
+    """
+    query_plan = QueryPlan(input_rows)
+    expr = _cast_id_values(expr, id_attributes)
+    conjuncts = [optimize(sub, statistics) for sub in flatten(expr, AndExpr)]
+
+    lookup_index = None
+    for index, conjunct in enumerate(conjuncts):
+        access_path, ids = _get_lookup(conjunct, id_attributes, reference_lookup)
+        if ids is not None and (
+            query_plan.lookup_ids is None or len(ids) < len(query_plan.lookup_ids)
+        ):
+            query_plan.access_path = access_path
+            query_plan.lookup_ids = ids
+            lookup_index = index
+
+    rows = float(input_rows)
+    if lookup_index is not None:
+        rows = float(min(input_rows, len(query_plan.lookup_ids)))
+        del conjuncts[lookup_index]
+
+    conditions = [Condition(conjunct, statistics.estimate(conjunct))
+                  for conjunct in conjuncts]
+    conditions = _sort_guarded(
+        conditions,
+        lambda condition: (not _is_identity_check(condition.expr), condition.selectivity),
+        lambda condition: condition.expr)
+    for condition in conditions:
+        rows *= condition.selectivity
+
+    query_plan.conditions = conditions
+    query_plan.estimated_rows = rows
+    return query_plan
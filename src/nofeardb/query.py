@@ -1,41 +1,449 @@
+import os
+import heapq
+import uuid
+from collections import namedtuple
+from functools import lru_cache
 from abc import abstractmethod
 from typing import List
+from concurrent.futures import ThreadPoolExecutor
 
+from .aggregate import Aggregate
 from .exceptions import NoResultFoundException
 from .orm import Document
-from .expr import AbstractExpr
+from .expr import AbstractExpr, get_path_value
+from .instrumentation import DisabledInstrumentation
+from .planner import RESULT_CACHE, PlannerStatistics, QueryPlan, fingerprint, plan
+
+
+class DocumentSource:
+    """
+    Source of the items a query works on.
+    The default source works on already created document instances.
+    """
+
+    _statistics = None
+    _instrumentation = DisabledInstrumentation()
+
+    def span(self, name: str, info: dict):
+        """get a context manager measuring an operation on this source"""
+        return self._instrumentation.span(name, info)
+
+    def load(self, items: list) -> list:
+        """loads the data of the items and returns the items which still exist"""
+        return items
+
+    def existing(self, items: list) -> list:
+        """
+        get the items whose documents still exist, like :meth:`load` but without
+        reading the data of the items if the source can tell otherwise.
+        """
+        return self.load(items)
+
+    def hydrate(self, items: list) -> List[Document]:
+        """get the document instances of the items"""
+        return list(items)
+
+    def get_value(self, item, attr_name: str):
+        """get the value of an attribute of an item"""
+        if attr_name == "id" and not hasattr(item, "id"):
+            return item.__id__
+
+        return get_path_value(item, attr_name)
+
+    def get_id(self, item) -> uuid.UUID:
+        """get the document ID of an item"""
+        return item.__id__
+
+    def get_id_attributes(self) -> tuple:
+        """get the attribute names which contain the document ID"""
+        return ("id",)
+
+    def get_statistics(self) -> PlannerStatistics:
+        """get the statistics used to plan the queries on this source"""
+        if self._statistics is None:
+            self._statistics = PlannerStatistics()
+
+        return self._statistics
+
+    def get_cached_result(self, expr: AbstractExpr) -> list:
+        """
+        get the cached items matching a where expression applied to all items
+        of the source, or None if the result is not cached.
+        """
+        return None
+
+    def cache_result(self, expr: AbstractExpr, items: list):
+        """caches the items matching a where expression applied to all items of the source"""
+
+    def get_reference_lookup(self):
+        """
+        get a function(attr_name, target_ids) returning the IDs (as str) of the documents
+        whose relationship references one of the targets, or None if not available.
+        """
+        return None
+
+
+class _OrderKey:
+    """Sort key for multiple attributes with different directions"""
+
+    __slots__ = ("values", "directions")
+
+    def __init__(self, values: tuple, directions: tuple):
+        self.values = values
+        self.directions = directions
+
+    def __lt__(self, other: '_OrderKey') -> bool:
+        for value, other_value, desc in zip(self.values, other.values, self.directions):
+            if value == other_value:
+                continue
+
+            if value is None:
+                return not desc
+
+            if other_value is None:
+                return desc
+
+            return value > other_value if desc else value < other_value
+
+        return False
+
+
+@lru_cache(maxsize=128)
+def _get_row_type(attr_names: tuple) -> type:
+    return namedtuple("Row", attr_names, rename=True)
 
 
 class Query:
 
-    def __init__(self, original: List[Document], modified: List[Document] = None):
+    def __init__(
+        self,
+        original: List[Document],
+        modified: List[Document] = None,
+        source: DocumentSource = None
+    ):
         self.__original = original or []
         self.__modified = modified
         if self.__modified is None:
             self.__modified = self.__original
 
+        self.__source = source or DocumentSource()
+        self.__order = []
+        self.__limit = None
+        self.__offset = 0
+        self.__group_by = None
+        self.__plans: List[QueryPlan] = []
+
+    def __copy(self, modified: list) -> 'Query':
+        query = Query(self.__original, modified, self.__source)
+        query.__order = list(self.__order)
+        query.__limit = self.__limit
+        query.__offset = self.__offset
+        query.__group_by = self.__group_by
+        query.__plans = list(self.__plans)
+        return query
+
     def where(self, expr: AbstractExpr) -> 'Query':
-        """applies where condition and returns a new modified query object"""
-        result = []
-        for doc in self.__modified:
-            if expr.evaluate(doc):
-                result.append(doc)
-        return Query(self.__original, result)
+        """
+        applies where condition and returns a new modified query object.
+        The evaluation is planned by :func:`nofeardb.planner.plan`, see :meth:`explain`.
+        """
+        source = self.__source
+        info = {"fingerprint": fingerprint(expr), "documents": len(self.__modified)}
+        with source.span("where", info):
+            # results are only cached for expressions applied to all items
+            cacheable = self.__modified is self.__original and len(self.__plans) == 0
+            if cacheable:
+                items = source.get_cached_result(expr)
+                if items is not None:
+                    query_plan = QueryPlan(len(self.__modified))
+                    query_plan.access_path = RESULT_CACHE
+                    query_plan.estimated_rows = query_plan.actual_rows = len(items)
+                    info["access_path"] = RESULT_CACHE
+                    info["returned"] = len(items)
+                    query = self.__copy(items)
+                    query.__plans.append(query_plan)
+                    return query
+
+            statistics = source.get_statistics()
+            query_plan = plan(
+                expr, len(self.__modified), statistics, source.get_id_attributes(),
+                source.get_reference_lookup())
+            info["access_path"] = query_plan.access_path
+
+            items = self.__modified
+            if query_plan.lookup_ids is not None:
+                get_id = source.get_id
+                items = [item for item in items
+                         if str(get_id(item)) in query_plan.lookup_ids]
+
+            items = source.load(items)
+            info["scanned"] = len(items)
+            get_value = source.get_value
+            for condition in query_plan.conditions:
+                predicate = condition.expr.compile()
+                condition.evaluated = len(items)
+                items = [item for item in items if predicate(get_value, item)]
+                condition.matched = len(items)
+                statistics.record(
+                    condition.fingerprint, condition.evaluated, condition.matched)
+
+            query_plan.actual_rows = len(items)
+            info["returned"] = len(items)
+            if cacheable:
+                source.cache_result(expr, items)
+        query = self.__copy(items)
+        query.__plans.append(query_plan)
+        return query
+
+    def explain(self) -> str:
+        """
+        get a description of how the where conditions of the query were evaluated,
+        with the access path, the order of the conditions and estimated vs actual rows.
+        """
+        if len(self.__plans) == 0:
+            return "access path: full scan of " + str(len(self.__original)) + " documents"
+
+        return "\n".join(
+            "where " + str(index + 1) + ":\n  "
+            + query_plan.explain().replace("\n", "\n  ")
+            for index, query_plan in enumerate(self.__plans))
+
+    def order_by(self, attr_name: str, desc: bool = False) -> 'Query':
+        """
+        orders the results by an attribute and returns a new modified query object.
+        Further calls add attributes to order documents with equal values by.
+        None values are ordered like values smaller than all other values, so they
+        come first in ascending and last in descending order.
+
+        :param attr_name: Name of the document attribute to order by.
+        :type attr_name: str
+        :param desc: Order descending.
+        :type desc: bool
+        """
+        query = self.__copy(self.__modified)
+        query.__order.append((attr_name, desc))
+        return query
+
+    def limit(self, count: int) -> 'Query':
+        """limits the number of results and returns a new modified query object"""
+        if count < 0:
+            raise ValueError("The limit must not be negative")
+
+        query = self.__copy(self.__modified)
+        query.__limit = count
+        return query
+
+    def offset(self, count: int) -> 'Query':
+        """skips the first results and returns a new modified query object"""
+        if count < 0:
+            raise ValueError("The offset must not be negative")
+
+        query = self.__copy(self.__modified)
+        query.__offset = count
+        return query
+
+    def _get_order_key(self):
+        attributes = [attr_name for attr_name, _ in self.__order]
+        directions = tuple(desc for _, desc in self.__order)
+        get_value = self.__source.get_value
+
+        if all(desc == directions[0] for desc in directions):
+            def key(item):
+                values = []
+                for attr_name in attributes:
+                    value = get_value(item, attr_name)
+                    values.append((0,) if value is None else (1, value))
+                return tuple(values)
+
+            return key, directions[0]
+
+        def mixed_key(item):
+            return _OrderKey(
+                tuple(get_value(item, attr_name) for attr_name in attributes),
+                directions)
+
+        return mixed_key, False
+
+    def _select(self, count: int = None, read: bool = True) -> list:
+        """
+        get the result items after ordering, offset and limit.
+        If a count is given, only the first count items are selected.
+        Ordering with a limit only keeps the top items in a heap instead of
+        sorting all items. Items whose documents were deleted are skipped, without
+        ordering they are detected without reading the data if read is False.
+        """
+        start = self.__offset
+        end = None
+        if self.__limit is not None:
+            end = start + self.__limit
+        if count is not None:
+            end = start + count if end is None else min(end, start + count)
+
+        if len(self.__order) == 0:
+            return self._select_existing(start, end, read)
+
+        items = self.__source.load(self.__modified)
+        key, reverse = self._get_order_key()
+        if end is None:
+            return sorted(items, key=key, reverse=reverse)[start:]
+
+        if reverse:
+            return heapq.nlargest(end, items, key=key)[start:]
+
+        return heapq.nsmallest(end, items, key=key)[start:]
+
+    def _select_existing(self, start: int, end: int = None, read: bool = True) -> list:
+        """
+        get the existing items from start to end in the original order.
+        Only as many items are checked as needed to find them.
+        """
+        existing = self.__source.load if read else self.__source.existing
+        if end is None:
+            return existing(self.__modified)[start:]
+
+        items = []
+        position = 0
+        while len(items) < end and position < len(self.__modified):
+            batch = self.__modified[position:position + end - len(items)]
+            position += len(batch)
+            items.extend(existing(batch))
+
+        return items[start:end]
+
+    def group_by(self, *attr_names: str) -> 'Query':
+        """
+        groups the results by the values of the given attributes for :meth:`aggregate`
+        and returns a new modified query object.
+        """
+        query = self.__copy(self.__modified)
+        query.__group_by = list(attr_names)
+        return query
+
+    def _aggregate_chunk(self, items: list, aggregations: List[Aggregate]) -> dict:
+        get_value = self.__source.get_value
+        group_by = self.__group_by or []
+        groups = {}
+        for item in items:
+            key = tuple(get_value(item, attr_name) for attr_name in group_by)
+            states = groups.get(key)
+            if states is None:
+                states = [aggregation.create() for aggregation in aggregations]
+                groups[key] = states
+
+            for index, aggregation in enumerate(aggregations):
+                if aggregation.attr_name is None:
+                    value = item
+                else:
+                    value = get_value(item, aggregation.attr_name)
+                states[index] = aggregation.add(states[index], value)
+
+        return groups
+
+    def aggregate(self, parallel: bool = False, **aggregations: Aggregate):
+        """
+        computes aggregations over the results without creating document instances.
+
+        :param parallel: Compute the aggregations in chunks on a thread pool.
+        :type parallel: bool
+        :param aggregations: Aggregations by the name of their result
+            (see :mod:`nofeardb.aggregate`).
+        :return: A dict with the aggregation results. If the query is grouped, a list of
+            dicts with the group values and the aggregation results per group.
+        :rtype: dict, list
+        """
+        names = list(aggregations)
+        aggregates = [aggregations[name] for name in names]
+        items = self.__source.load(self._select())
+
+        if parallel and len(items) > 1:
+            chunk_count = min(os.cpu_count() or 1, len(items))
+            chunk_size = -(-len(items) // chunk_count)
+            chunks = [items[start:start + chunk_size]
+                      for start in range(0, len(items), chunk_size)]
+            with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+                chunk_groups = list(executor.map(
+                    lambda chunk: self._aggregate_chunk(chunk, aggregates), chunks))
+        else:
+            chunk_groups = [self._aggregate_chunk(items, aggregates)]
+
+        groups = {}
+        for chunk in chunk_groups:
+            for key, states in chunk.items():
+                if key not in groups:
+                    groups[key] = states
+                else:
+                    groups[key] = [
+                        aggregation.merge(state, other)
+                        for aggregation, state, other in zip(aggregates, groups[key], states)]
+
+        rows = []
+        for key, states in groups.items():
+            row = dict(zip(self.__group_by or [], key))
+            for name, aggregation, state in zip(names, aggregates, states):
+                row[name] = aggregation.result(state)
+            rows.append(row)
+
+        if self.__group_by is None:
+            if len(rows) == 0:
+                return {
+                    name: aggregation.result(aggregation.create())
+                    for name, aggregation in zip(names, aggregates)}
+            return rows[0]
+
+        return rows
+
+    def select(self, *attr_names: str) -> List[tuple]:
+        """
+        get the values of the given attributes of all results as named tuples,
+        without creating document instances. The name "id" selects the document ID.
+
+        :param attr_names: Names of the document attributes to select.
+        :type attr_names: str
+        :return: One row per result.
+        :rtype: list
+        """
+        row_type = _get_row_type(attr_names)
+        get_value = self.__source.get_value
+        get_id = self.__source.get_id
+        getters = [
+            get_id if attr_name == "id"
+            else (lambda item, attr_name=attr_name: get_value(item, attr_name))
+            for attr_name in attr_names
+        ]
+
+        return [
+            row_type._make([getter(item) for getter in getters])
+            for item in self.__source.load(self._select())
+        ]
+
+    def count(self) -> int:
+        """get the number of results without creating document instances"""
+        return len(self._select(read=False))
+
+    def exists(self) -> bool:
+        """get wether there is at least one result, without creating document instances"""
+        return len(self._select(1, read=False)) > 0
+
+    def ids(self) -> List[uuid.UUID]:
+        """get the IDs of all results without creating document instances"""
+        return [self.__source.get_id(item) for item in self._select(read=False)]
 
     def all(self):
         """get all results"""
-        return self.__modified
+        return self.__source.hydrate(self._select())
 
     def first(self):
         """get first result"""
-        if len(self.__modified) > 0:
-            return self.__modified[0]
+        documents = self.__source.hydrate(self._select(1))
+        if len(documents) > 0:
+            return documents[0]
 
         raise NoResultFoundException
 
     def last(self):
         """get last result"""
-        if len(self.__modified) > 0:
-            return self.__modified[-1]
+        documents = self.__source.hydrate(self._select()[-1:])
+        if len(documents) > 0:
+            return documents[0]
 
         raise NoResultFoundException
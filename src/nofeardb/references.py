@@ -0,0 +1,127 @@
+"""
+Persistent reverse index of the relationships between documents
+"""
+
+import os
+import shutil
+from typing import Iterable, List
+
+INDEX_DIRECTORY = ".refs"
+COMPLETE_MARKER = ".complete"
+
+
+def get_reference_ids(value) -> set:
+    """get the referenced IDs of a relationship value of the document data"""
+    if value is None:
+        return set()
+
+    if isinstance(value, str):
+        return {value}
+
+    return {ref_id for ref_id in value if ref_id is not None}
+
+
+class ReverseIndex:
+    """
+    Reverse index of the relationships, which maps the ID of a referenced
+    document to the IDs of the documents referencing it.
+
+    Each reference is stored as an empty marker file
+    ``<root>/.refs/<collection>/<relationship>/<target id>/<source id>``,
+    so the index can be updated by several processes without locking.
+
+    :param root: Path of the database root directory.
+    :type root: str
+    """
+
+    def __init__(self, root: str):
+        self._root = os.path.join(root, INDEX_DIRECTORY)
+
+    def get_relationship_path(self, collection: str, attr_name: str) -> str:
+        """get the directory of the index of a relationship"""
+        return os.path.join(self._root, collection, attr_name)
+
+    def add(self, collection: str, attr_name: str, target_id: str, source_id: str):
+        """adds a reference"""
+        target_path = os.path.join(
+            self.get_relationship_path(collection, attr_name), target_id)
+        while True:
+            os.makedirs(target_path, exist_ok=True)
+            try:
+                fd = os.open(os.path.join(target_path, source_id),
+                             os.O_CREAT | os.O_WRONLY)
+            except FileNotFoundError:
+                # the empty directory was removed by a concurrent remove
+                continue
+            os.close(fd)
+            return
+
+    def remove(self, collection: str, attr_name: str, target_id: str, source_id: str):
+        """
+        removes a reference, the directory of the target is removed if it is empty.
+        A concurrent :meth:`add` creates the directory again.
+        """
+        target_path = os.path.join(
+            self.get_relationship_path(collection, attr_name), target_id)
+        try:
+            os.remove(os.path.join(target_path, source_id))
+        except FileNotFoundError:
+            pass
+
+        try:
+            os.rmdir(target_path)
+        except OSError:
+            pass
+
+    def get(self, collection: str, attr_name: str, target_ids: Iterable[str]) -> List[str]:
+        """get the IDs of the documents referencing one of the targets"""
+        source_ids = []
+        for target_id in target_ids:
+            try:
+                source_ids.extend(os.listdir(os.path.join(
+                    self.get_relationship_path(collection, attr_name), target_id)))
+            except FileNotFoundError:
+                pass
+
+        return source_ids
+
+    def update(
+        self,
+        collection: str,
+        attr_names: List[str],
+        source_id: str,
+        previous_data: dict,
+        data: dict
+    ):
+        """
+        updates the references of a document from its previous to its new data.
+        previous_data is None for new documents, data is None for deleted documents.
+        """
+        for attr_name in attr_names:
+            previous = get_reference_ids(
+                previous_data.get(attr_name) if previous_data is not None else None)
+            current = get_reference_ids(
+                data.get(attr_name) if data is not None else None)
+
+            for target_id in current - previous:
+                self.add(collection, attr_name, target_id, source_id)
+
+            for target_id in previous - current:
+                self.remove(collection, attr_name, target_id, source_id)
+
+    def is_complete(self, collection: str, attr_name: str) -> bool:
+        """get wether the index of a relationship contains all references"""
+        return os.path.exists(os.path.join(
+            self.get_relationship_path(collection, attr_name), COMPLETE_MARKER))
+
+    def clear(self, collection: str, attr_name: str):
+        """removes the index of a relationship"""
+        shutil.rmtree(self.get_relationship_path(
+            collection, attr_name), ignore_errors=True)
+
+    def mark_complete(self, collection: str, attr_name: str):
+        """marks the index of a relationship as complete"""
+        relationship_path = self.get_relationship_path(collection, attr_name)
+        os.makedirs(relationship_path, exist_ok=True)
+        with open(os.path.join(relationship_path, COMPLETE_MARKER), "w", encoding="utf-8"):
+            pass
@@ -0,0 +1,654 @@
+"""
+Storage engine persisting documents in append-only segment files
+"""
+
+import os
+import time
+import zlib
+import struct
+import threading
+from typing import Dict, List
+
+from .compression import decompress
+from .engine import StorageEngine, remove_expired_lock
+from .enums import DocumentStatus
+from .exceptions import DocumentLockException
+from .formats import get_codec
+from .orm import Document
+
+RECORD_MAGIC = b"NFSR"
+# magic, flags, extension length, id length, hash length, data length
+RECORD_FIELDS = struct.Struct("<4sBBBBI")
+# the record fields followed by the crc32 of the fields and the body
+RECORD_HEADER = struct.Struct("<4sBBBBII")
+FLAG_PUT = 0
+FLAG_TOMBSTONE = 1
+SEGMENT_EXTENSION = ".seg"
+SEGMENT_LOCK_NAME = "segments.lock"
+
+
+def encode_record(flags: int, extension: str, doc_id: str, doc_hash: str, data: bytes) -> bytes:
+    """
+    Encodes a record which is appended to a segment file.
+
+    :param flags: :data:`FLAG_PUT` or :data:`FLAG_TOMBSTONE`.
+    :type flags: int
+    :param extension: File extension of the codec the data is encoded with.
+    :type extension: str
+    :param doc_id: ID of the document.
+    :type doc_id: str
+    :param doc_hash: Hash of the document.
+    :type doc_hash: str
+    :param data: Encoded (and possibly compressed) document data.
+    :type data: bytes
+    :return: Record bytes.
+    :rtype: bytes
+    """
+    body = extension.encode() + doc_id.encode() + doc_hash.encode() + data
+    fields = RECORD_FIELDS.pack(
+        RECORD_MAGIC,
+        flags,
+        len(extension.encode()),
+        len(doc_id.encode()),
+        len(doc_hash.encode()),
+        len(data)
+    )
+    return fields + struct.pack("<I", zlib.crc32(body, zlib.crc32(fields))) + body
+
+
+def segment_name(number: int) -> str:
+    """get the file name of the segment with the given number"""
+    return str(number).zfill(8) + SEGMENT_EXTENSION
+
+
+def segment_number(name: str) -> int:
+    """get the number of the segment with the given file name"""
+    return int(os.path.splitext(name)[0])
+
+
+class SegmentLock:
+    """
+    Lock for appending to the segments of a collection.
+    The lock file is created exclusively, so only one process can hold it.
+    The lock expires if its file was not modified for ``expiration`` seconds,
+    long operations keep it by calling :meth:`refresh`.
+    """
+
+    def __init__(self, lock_path: str, expiration: int = 10, timeout: int = 10):
+        self._lock_path = lock_path
+        self._expiration = expiration
+        self._timeout = timeout
+        self._refreshed = None
+
+    def _is_lock_expired(self) -> bool:
+        try:
+            return time.time() - os.path.getmtime(self._lock_path) > self._expiration
+        except FileNotFoundError:
+            return True
+
+    def lock(self):
+        """
+        locks the segments, waits until the lock is available.
+
+        :raise nofeardb.exceptions.DocumentLockException: If the timeout is reached.
+        """
+        deadline = time.monotonic() + self._timeout
+        while True:
+            try:
+                fd = os.open(self._lock_path, os.O_CREAT |
+                             os.O_EXCL | os.O_WRONLY)
+                os.close(fd)
+                self._refreshed = time.monotonic()
+                return
+            except FileExistsError:
+                if remove_expired_lock(self._lock_path, self._is_lock_expired):
+                    continue
+
+                if time.monotonic() > deadline:
+                    raise DocumentLockException(
+                        "Segments are locked by someone else.")
+
+                time.sleep(0.005)
+
+    def refresh(self):
+        """
+        renews the modification time of the held lock, so it does not expire.
+        The file is only touched if half of the expiration time has passed since
+        the last renewal, so it can be called for every processed record.
+        """
+        now = time.monotonic()
+        if self._refreshed is None or now - self._refreshed >= self._expiration / 2:
+            os.utime(self._lock_path)
+            self._refreshed = now
+
+    def release(self):
+        """releases the lock"""
+        self._refreshed = None
+        try:
+            os.remove(self._lock_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        self.lock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class SegmentEntry:
+    """Position of the latest version of a document in the segment files"""
+
+    __slots__ = ("segment", "offset", "length", "doc_hash", "extension")
+
+    def __init__(self, segment: str, offset: int, length: int, doc_hash: str, extension: str):
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+        self.doc_hash = doc_hash
+        self.extension = extension
+
+
+class SegmentIndex:
+    """
+    In memory index of the segment files of a collection.
+    Maps document IDs to the position of their latest record.
+    """
+
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+        self.entries: Dict[str, SegmentEntry] = {}
+        self.scanned: Dict[str, int] = {}
+
+    def segments(self) -> List[str]:
+        """get the names of all segment files, ordered by segment number"""
+        if not os.path.exists(self.base_path):
+            return []
+
+        return sorted(
+            name for name in os.listdir(self.base_path)
+            if os.path.splitext(name)[1] == SEGMENT_EXTENSION
+        )
+
+    def reset(self):
+        """clears the index, the segments are scanned again on the next refresh"""
+        self.entries = {}
+        self.scanned = {}
+
+    def refresh(self):
+        """scans all records which where appended since the last refresh"""
+        names = self.segments()
+        if any(name not in names for name in self.scanned):
+            # segments were removed by a compaction
+            self.reset()
+
+        for name in names:
+            try:
+                size = os.path.getsize(os.path.join(self.base_path, name))
+            except FileNotFoundError:
+                self.reset()
+                self.refresh()
+                return
+
+            offset = self.scanned.get(name, 0)
+            if size > offset:
+                self.scanned[name] = self.scan(name, offset)
+
+    def scan(self, name: str, offset: int) -> int:
+        """
+        scans the records of a segment starting at the given offset.
+        Scanning stops at the first incomplete or corrupt record.
+
+        :return: offset after the last valid record.
+        :rtype: int
+        """
+        with open(os.path.join(self.base_path, name), 'rb') as f:
+            f.seek(offset)
+            buffer = f.read()
+
+        position = 0
+        while position + RECORD_HEADER.size <= len(buffer):
+            magic, flags, ext_len, id_len, hash_len, data_len, crc = \
+                RECORD_HEADER.unpack_from(buffer, position)
+            body_start = position + RECORD_HEADER.size
+            end = body_start + ext_len + id_len + hash_len + data_len
+            if magic != RECORD_MAGIC or end > len(buffer):
+                break
+
+            fields = buffer[position:position + RECORD_FIELDS.size]
+            if zlib.crc32(buffer[body_start:end], zlib.crc32(fields)) != crc:
+                break
+
+            extension = buffer[body_start:body_start + ext_len].decode()
+            id_start = body_start + ext_len
+            doc_id = buffer[id_start:id_start + id_len].decode()
+            hash_start = id_start + id_len
+            doc_hash = buffer[hash_start:hash_start + hash_len].decode()
+
+            if flags == FLAG_TOMBSTONE:
+                self.entries.pop(doc_id, None)
+            else:
+                self.entries[doc_id] = SegmentEntry(
+                    name, offset + position, end - position, doc_hash, extension)
+
+            position = end
+
+        return offset + position
+
+    def append(self, record: bytes, segment_size: int):
+        """
+        appends a record to the active segment. A new segment is started
+        if the active segment would exceed the segment size.
+        Must be called while holding the segment lock.
+        """
+        self.refresh()
+        names = self.segments()
+        active = names[-1] if len(names) > 0 else segment_name(1)
+        path = os.path.join(self.base_path, active)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+
+        scanned = self.scanned.get(active, 0)
+        if size > scanned:
+            # remove an incomplete record left by a crashed writer
+            with open(path, 'r+b') as f:
+                f.truncate(scanned)
+            size = scanned
+
+        if size > 0 and size + len(record) > segment_size:
+            active = segment_name(segment_number(active) + 1)
+            path = os.path.join(self.base_path, active)
+            size = 0
+
+        with open(path, 'ab') as f:
+            f.write(record)
+
+        self.scanned[active] = self.scan(active, size)
+
+    def read_record(self, entry: SegmentEntry, segment_file=None) -> bytes:
+        """
+        reads the data part of the record of an entry.
+
+        :param segment_file: Already opened segment file to read from.
+        """
+        if segment_file is None:
+            with open(os.path.join(self.base_path, entry.segment), 'rb') as f:
+                return self.read_record(entry, f)
+
+        segment_file.seek(entry.offset)
+        record = segment_file.read(entry.length)
+        _, _, ext_len, id_len, hash_len, data_len, _ = \
+            RECORD_HEADER.unpack_from(record)
+        data_start = RECORD_HEADER.size + ext_len + id_len + hash_len
+        return record[data_start:data_start + data_len]
+
+    def size(self) -> int:
+        """get the size of all scanned segments in bytes"""
+        return sum(self.scanned.values())
+
+    def garbage_ratio(self) -> float:
+        """get the ratio of bytes in the segments not belonging to a live record"""
+        total = self.size()
+        if total == 0:
+            return 0.0
+
+        return 1.0 - sum(entry.length for entry in self.entries.values()) / total
+
+
+class SegmentStorageEngine(StorageEngine):
+    """
+    Storage engine which appends documents to segment files per collection
+    instead of writing one file per document.
+
+    An in memory index maps the document IDs to their latest record.
+    Deleted documents are marked by tombstone records. Outdated records are
+    removed by compacting the segments, which can be done in the background.
+    The engine offers the same API as :class:`nofeardb.engine.StorageEngine`.
+
+    :param root: Path of the database root directory.
+    :type root: str
+    :param segment_size: Size in bytes at which a new segment file is started.
+    :type segment_size: int
+    :param compaction_interval: Interval in seconds in which the background compaction
+        checks the collections. None disables the background compaction.
+    :type compaction_interval: float
+    :param compaction_threshold: Ratio of outdated bytes at which a collection is compacted.
+    :type compaction_threshold: float
+    :param kwargs: Further arguments of :class:`nofeardb.engine.StorageEngine`.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        segment_size: int = 64 * 1024 * 1024,
+        compaction_interval: float = None,
+        compaction_threshold: float = 0.5,
+        **kwargs
+    ):
+        super().__init__(root, **kwargs)
+        self._segment_size = segment_size
+        self._compaction_threshold = compaction_threshold
+        self._indexes: Dict[str, SegmentIndex] = {}
+        self._segments_lock = threading.RLock()
+        self._closed = threading.Event()
+        self._compaction_thread = None
+
+        if compaction_interval is not None:
+            self._compaction_thread = threading.Thread(
+                target=self._compaction_loop,
+                args=(compaction_interval,),
+                daemon=True
+            )
+            self._compaction_thread.start()
+
+    def close(self):
+        """stops the background compaction"""
+        self._closed.set()
+        if self._compaction_thread is not None:
+            self._compaction_thread.join()
+            self._compaction_thread = None
+        super().close()
+
+    def _get_index(self, doc) -> SegmentIndex:
+        """get the refreshed segment index for a document or document type"""
+        base_path = self.get_doc_basepath(doc)
+        with self._segments_lock:
+            if base_path not in self._indexes:
+                self._indexes[base_path] = SegmentIndex(base_path)
+
+            index = self._indexes[base_path]
+            index.refresh()
+            return index
+
+    def _segment_lock(self, index: SegmentIndex) -> SegmentLock:
+        return SegmentLock(os.path.join(index.base_path, SEGMENT_LOCK_NAME))
+
+    def _get_document_with_id_existing(self, doc: Document):
+        return str(doc.__id__) in self._get_index(doc).entries
+
+    def _get_existing_document_file_name(self, doc: Document):
+        """get the reference of the document if it is already persisted"""
+        index = self._get_index(doc)
+        if str(doc.__id__) in index.entries:
+            return os.path.join(index.base_path, str(doc.__id__))
+
+        return None
+
+    def _get_existing_refs(self, doc_type: type, doc_refs: List[str]) -> List[str]:
+        entries = self._get_index(doc_type).entries
+        return [doc_ref for doc_ref in doc_refs if os.path.basename(doc_ref) in entries]
+
+    def _decode_entry(self, entry: SegmentEntry, stored: bytes) -> dict:
+        start = time.perf_counter()
+        raw = decompress(stored)
+        decompressed = time.perf_counter()
+        data = self._get_codec_for_path(
+            entry.segment + entry.extension).decode(raw)
+        self._count(
+            documents_read=1,
+            bytes_read=len(stored),
+            bytes_decompressed=len(raw),
+            decompress_time=decompressed - start,
+            decode_time=time.perf_counter() - decompressed)
+        return data
+
+    def _cache_data(self, doc_id: str, doc_hash: str, data: dict):
+        cache_data = dict(data)
+        cache_data["__doc_hash__"] = doc_hash
+        self._data_cache[doc_id] = cache_data
+
+    def _get_cached_data(self, doc_id: str, entry: SegmentEntry) -> dict:
+        try:
+            cache_data = self._data_cache[doc_id]
+        except KeyError:
+            return None
+
+        if cache_data["__doc_hash__"] != entry.doc_hash:
+            return None
+
+        data = dict(cache_data)
+        del data["__doc_hash__"]
+        return data
+
+    def _get_entry_data(self, index: SegmentIndex, doc_id: str) -> dict:
+        entry = index.entries.get(doc_id)
+        if entry is None:
+            return None
+
+        data = self._get_cached_data(doc_id, entry)
+        if data is not None:
+            self._instrumentation.count("cache_hits")
+            return data
+
+        self._instrumentation.count("cache_misses")
+        with self._instrumentation.timer(
+                "file.read", path=os.path.join(index.base_path, entry.segment)):
+            try:
+                stored = index.read_record(entry)
+            except FileNotFoundError:
+                # the segment was removed by a compaction in the meantime
+                with self._segments_lock:
+                    index.refresh()
+                entry = index.entries.get(doc_id)
+                if entry is None:
+                    return None
+                stored = index.read_record(entry)
+
+        data = self._decode_entry(entry, stored)
+        self._cache_data(doc_id, entry.doc_hash, data)
+        return data
+
+    def _get_document_data(self, doc_path):
+        if doc_path is None:
+            return None
+
+        base_path, doc_id = os.path.split(doc_path)
+        with self._segments_lock:
+            if base_path not in self._indexes:
+                self._indexes[base_path] = SegmentIndex(base_path)
+                self._indexes[base_path].refresh()
+            index = self._indexes[base_path]
+
+        return self._get_entry_data(index, doc_id)
+
+    def _load_entries(self, index: SegmentIndex):
+        """reads all entries which are not cached, sequentially per segment"""
+        missing = [
+            (doc_id, entry) for doc_id, entry in index.entries.items()
+            if self._get_cached_data(doc_id, entry) is None
+        ]
+        missing.sort(key=lambda item: (item[1].segment, item[1].offset))
+
+        segment_file = None
+        try:
+            for doc_id, entry in missing:
+                if segment_file is None or segment_file.name != os.path.join(
+                        index.base_path, entry.segment):
+                    if segment_file is not None:
+                        segment_file.close()
+                    segment_file = open(os.path.join(
+                        index.base_path, entry.segment), 'rb')
+
+                data = self._decode_entry(
+                    entry, index.read_record(entry, segment_file))
+                self._cache_data(doc_id, entry.doc_hash, data)
+        finally:
+            if segment_file is not None:
+                segment_file.close()
+
+    def _list_documents(self, doc_type: type) -> List[str]:
+        """
+        lists the references of all persisted documents of the specified type.
+        All documents that are not cached yet are loaded by sequential reads.
+        """
+        with self._segments_lock:
+            index = self._get_index(doc_type)
+            try:
+                self._load_entries(index)
+            except FileNotFoundError:
+                index.reset()
+                index.refresh()
+                self._load_entries(index)
+
+            return [
+                os.path.join(index.base_path, doc_id)
+                for doc_id in index.entries
+            ]
+
+    def write_json(self, doc: Document):
+        """
+        appends the document data to the active segment.
+        The write is skipped if the latest record already has the same hash.
+        """
+        if doc.__status__ == DocumentStatus.SYNC or doc.__status__ == DocumentStatus.DEL:
+            return
+
+        doc_id = str(doc.__id__)
+        codec = self.get_document_codec(doc.__class__)
+        doc_hash = self._get_compiled_model(
+            doc.__class__).hash(doc, self._hash_function)
+
+        with self._segments_lock:
+            index = self._get_index(doc)
+            entry = index.entries.get(doc_id)
+            if (
+                entry is not None
+                and entry.doc_hash == doc_hash
+                and entry.extension == codec.extension
+            ):
+                self._count(writes_skipped=1)
+                return
+
+            previous_data = self._get_entry_data(index, doc_id)
+            if previous_data is not None:
+                data_to_write = self.update_json(
+                    self._copy_document_data(previous_data), doc)
+            else:
+                data_to_write = self.create_json(doc)
+
+            raw = codec.encode(data_to_write)
+            stored = self._compress_document_bytes(raw)
+            record = encode_record(
+                FLAG_PUT, codec.extension, doc_id, doc_hash, stored)
+
+            with self._instrumentation.timer("file.append", path=index.base_path):
+                with self._segment_lock(index):
+                    index.append(record, self._segment_size)
+
+            self._cache_data(doc_id, doc_hash, data_to_write)
+            self._mark_changed(doc.__class__)
+            self._update_reverse_index(doc, previous_data, data_to_write)
+            self._count(
+                documents_written=1,
+                bytes_encoded=len(raw),
+                bytes_written=len(stored))
+
+    def delete_json(self, doc: Document):
+        """appends a tombstone record for the document"""
+        if doc.__status__ != DocumentStatus.DEL:
+            with self._segments_lock:
+                index = self._get_index(doc)
+                if self._reverse_index is not None:
+                    self._update_reverse_index(
+                        doc, self._get_entry_data(index, str(doc.__id__)), None)
+                record = encode_record(
+                    FLAG_TOMBSTONE, "", str(doc.__id__), "", b"")
+                with self._segment_lock(index):
+                    index.append(record, self._segment_size)
+
+            self._data_cache.pop(str(doc.__id__), None)
+            self._mark_changed(doc.__class__)
+
+    def compact(self, doc_type: type, codec=None) -> int:
+        """
+        Rewrites the latest records of all documents of a type into a new segment
+        and removes all older segments.
+
+        :param doc_type: Document class to compact.
+        :type doc_type: type
+        :param codec: Codec name or instance to re-encode the documents with.
+            If None the records are copied unchanged.
+        :type codec: str, :class:`nofeardb.formats.DocumentCodec`
+        :return: Number of reclaimed bytes.
+        :rtype: int
+        :raise nofeardb.exceptions.DocumentLockException: If the segments cannot be locked.
+        """
+        target_codec = get_codec(codec) if codec is not None else None
+
+        with self._segments_lock:
+            index = self._get_index(doc_type)
+            with self._segment_lock(index) as lock:
+                index.refresh()
+                old_segments = index.segments()
+                if len(old_segments) == 0:
+                    return 0
+
+                size_before = index.size()
+                new_segment = segment_name(
+                    segment_number(old_segments[-1]) + 1)
+                new_path = os.path.join(index.base_path, new_segment)
+                new_temp_path = new_path + ".tmp"
+                entries = sorted(
+                    index.entries.items(),
+                    key=lambda item: (item[1].segment, item[1].offset))
+
+                with open(new_temp_path, 'wb') as new_file:
+                    for doc_id, entry in entries:
+                        # compacting large collections may take longer than the expiration
+                        lock.refresh()
+                        stored = index.read_record(entry)
+                        extension = entry.extension
+                        if (
+                            target_codec is not None
+                            and extension != target_codec.extension
+                        ):
+                            data = self._decode_entry(entry, stored)
+                            stored = self._compress_document_bytes(
+                                target_codec.encode(data))
+                            extension = target_codec.extension
+
+                        new_file.write(encode_record(
+                            FLAG_PUT, extension, doc_id, entry.doc_hash, stored))
+
+                lock.refresh()
+                os.rename(new_temp_path, new_path)
+                for name in old_segments:
+                    os.remove(os.path.join(index.base_path, name))
+
+                index.reset()
+                index.refresh()
+                return size_before - index.size()
+
+    def migrate(self, doc_type: type, codec=None) -> int:
+        """
+        Rewrites all persisted documents of a type in the format of the given codec
+        by compacting the segments of the type.
+
+        :param doc_type: Document class to migrate.
+        :type doc_type: type
+        :param codec: Target codec name or instance. Defaults to the codec of the document type.
+        :type codec: str, :class:`nofeardb.formats.DocumentCodec`
+        :return: Number of migrated documents.
+        :rtype: int
+        """
+        target_codec = self.get_document_codec(
+            doc_type) if codec is None else get_codec(codec)
+        index = self._get_index(doc_type)
+        migrated = len([
+            entry for entry in index.entries.values()
+            if entry.extension != target_codec.extension
+        ])
+        if migrated > 0:
+            self.compact(doc_type, target_codec)
+
+        return migrated
+
+    def _compaction_loop(self, interval: float):
+        while not self._closed.wait(interval):
+            for model in list(self._models):
+                try:
+                    index = self._get_index(model)
+                    if index.garbage_ratio() >= self._compaction_threshold:
+                        self.compact(model)
+                except (OSError, DocumentLockException):
+                    pass
@@ -0,0 +1,353 @@
+"""
+Watchers keeping the listings of the collection directories up to date
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+# inotify event masks (see inotify(7))
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+# directories modified this recently are listed again by the polling watcher,
+# because file systems with coarse timestamps may not change the mtime twice
+RACY_SECONDS = 2.0
+
+
+class DirectoryWatcher:
+    """
+    Keeps the listings of the watched directories in memory. A directory is
+    watched from its first listing on, further listings are answered from memory
+    and are updated when files are added to or removed from the directory.
+
+    :param listdir: Function listing a directory, used for the first listing
+        and whenever a listing is invalid.
+    :type listdir: callable
+    :param on_removed: Function called with the path of every removed file.
+    :type on_removed: callable
+    """
+
+    def __init__(self, listdir=os.listdir, on_removed=None):
+        self._listdir = listdir
+        self._on_removed = on_removed
+        self._lock = threading.Lock()
+        self._listings = {}
+        self._pending = {}
+        self._closed = threading.Event()
+
+    def listdir(self, directory: str) -> list:
+        """
+        get the names of the files in a directory.
+
+        :raise FileNotFoundError: If the directory does not exist.
+        """
+        with self._lock:
+            names = self._listings.get(directory)
+            if names is not None:
+                return list(names)
+
+            changes = []
+            self._pending.setdefault(directory, []).append(changes)
+
+        try:
+            watched = self._watch(directory)
+            names = set(self._listdir(directory))
+        except BaseException:
+            with self._lock:
+                self._remove_pending(directory, changes)
+            raise
+
+        # the changes made while the directory was listed are applied and the listing
+        # is stored at once, so no change can get lost in between
+        with self._lock:
+            self._remove_pending(directory, changes)
+            for added, name in changes:
+                if added:
+                    names.add(name)
+                else:
+                    names.discard(name)
+
+            if watched:
+                self._listings[directory] = set(names)
+
+        return list(names)
+
+    def file_added(self, path: str):
+        """applies a file added by this process to the listing of its directory"""
+        self._added(os.path.dirname(path), os.path.basename(path))
+
+    def file_removed(self, path: str):
+        """applies a file removed by this process to the listing of its directory"""
+        self._removed(os.path.dirname(path), os.path.basename(path), notify=False)
+
+    def invalidate(self, directory: str = None):
+        """
+        invalidates the listing of a directory (of all directories if None),
+        it is listed again on its next use.
+        """
+        with self._lock:
+            if directory is None:
+                self._listings.clear()
+            else:
+                self._listings.pop(directory, None)
+
+    def close(self):
+        """stops watching the directories"""
+        self._closed.set()
+
+    def _watch(self, directory: str) -> bool:
+        """starts watching a directory, returns wether the directory can be watched"""
+        return True
+
+    def _added(self, directory: str, name: str):
+        with self._lock:
+            names = self._listings.get(directory)
+            if names is not None:
+                names.add(name)
+            for changes in self._pending.get(directory, []):
+                changes.append((True, name))
+
+    def _remove_pending(self, directory: str, changes: list):
+        self._pending[directory].remove(changes)
+        if len(self._pending[directory]) == 0:
+            del self._pending[directory]
+
+    def _removed(self, directory: str, name: str, notify: bool = True):
+        with self._lock:
+            names = self._listings.get(directory)
+            if names is not None:
+                names.discard(name)
+            for changes in self._pending.get(directory, []):
+                changes.append((False, name))
+
+        if notify and self._on_removed is not None:
+            self._on_removed(os.path.join(directory, name))
+
+
+class InotifyWatcher(DirectoryWatcher):
+    """
+    Watcher receiving the changes of the directories from the Linux kernel (inotify).
+    The changes are applied by a background thread, usually within milliseconds.
+
+    :raise OSError: If inotify is not available.
+    """
+
+    def __init__(self, listdir=os.listdir, on_removed=None):
+        super().__init__(listdir, on_removed)
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "inotify_init1 failed: " + os.strerror(errno))
+
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self._directories = {}
+        self._watches = {}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        if not self._closed.is_set():
+            super().close()
+            os.write(self._wakeup_write, b"x")
+            self._thread.join()
+            for fd in (self._fd, self._wakeup_read, self._wakeup_write):
+                os.close(fd)
+
+    def _watch(self, directory: str) -> bool:
+        with self._lock:
+            if directory in self._watches:
+                return True
+
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                if errno == 2:
+                    raise FileNotFoundError(errno, os.strerror(errno), directory)
+                # e.g. the limit of watches is reached, the directory is listed every time
+                return False
+
+            self._watches[directory] = wd
+            self._directories[wd] = directory
+            return True
+
+    def _run(self):
+        while not self._closed.is_set():
+            readable, _, _ = select.select([self._fd, self._wakeup_read], [], [])
+            if self._fd not in readable:
+                continue
+
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+
+            self._handle_events(data)
+
+    def _handle_events(self, data: bytes):
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.invalidate()
+                continue
+
+            directory = self._directories.get(wd)
+            if directory is None:
+                continue
+
+            if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                if mask & IN_MOVE_SELF:
+                    # the moved directory would be watched further
+                    self._libc.inotify_rm_watch(self._fd, wd)
+                with self._lock:
+                    self._directories.pop(wd, None)
+                    self._watches.pop(directory, None)
+                self.invalidate(directory)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                self._added(directory, name)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._removed(directory, name)
+
+
+class PollingWatcher(DirectoryWatcher):
+    """
+    Watcher checking the modification times of the directories in an interval
+    and listing the changed directories again.
+
+    :param interval: Seconds between two checks.
+    :type interval: float
+    """
+
+    def __init__(self, listdir=os.listdir, on_removed=None, interval: float = 0.1):
+        super().__init__(listdir, on_removed)
+        self._interval = interval
+        self._mtimes = {}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        super().close()
+        self._thread.join()
+
+    def _watch(self, directory: str) -> bool:
+        # taken before the listing, so changes made while listing are detected
+        self._mtimes[directory] = os.stat(directory).st_mtime
+        return True
+
+    def _run(self):
+        while not self._closed.wait(self._interval):
+            with self._lock:
+                directories = list(self._listings)
+
+            for directory in directories:
+                try:
+                    mtime = os.stat(directory).st_mtime
+                except FileNotFoundError:
+                    self.invalidate(directory)
+                    continue
+
+                if mtime == self._mtimes.get(directory) and time.time() - mtime > RACY_SECONDS:
+                    continue
+
+                self._mtimes[directory] = mtime
+                changes = []
+                with self._lock:
+                    self._pending.setdefault(directory, []).append(changes)
+
+                try:
+                    names = set(self._listdir(directory))
+                except FileNotFoundError:
+                    with self._lock:
+                        self._remove_pending(directory, changes)
+                    self.invalidate(directory)
+                    continue
+                except BaseException:
+                    with self._lock:
+                        self._remove_pending(directory, changes)
+                    raise
+
+                # the changes made by this process while the directory was listed are
+                # applied first, so they are neither lost nor reported as removed
+                with self._lock:
+                    self._remove_pending(directory, changes)
+                    for added, name in changes:
+                        if added:
+                            names.add(name)
+                        else:
+                            names.discard(name)
+
+                    previous = self._listings.get(directory)
+                    if previous is None:
+                        continue
+                    removed = previous - names
+                    self._listings[directory] = names
+
+                if self._on_removed is not None:
+                    for name in removed:
+                        self._on_removed(os.path.join(directory, name))
+
+
+WATCHERS = {
+    "inotify": InotifyWatcher,
+    "poll": PollingWatcher,
+}
+
+
+def create_watcher(mode: str, listdir=os.listdir, on_removed=None,
+                   interval: float = 0.1) -> DirectoryWatcher:
+    """
+    Creates a directory watcher.
+
+    :param mode: "inotify", "poll" or "auto" for inotify if available and polling otherwise.
+    :type mode: str
+    :param listdir: Function listing a directory.
+    :type listdir: callable
+    :param on_removed: Function called with the path of every removed file.
+    :type on_removed: callable
+    :param interval: Seconds between two checks of the polling watcher.
+    :type interval: float
+    :return: Watcher.
+    :rtype: :class:`DirectoryWatcher`
+    """
+    if mode == "auto":
+        try:
+            return InotifyWatcher(listdir, on_removed)
+        except (OSError, AttributeError):
+            mode = "poll"
+
+    if mode == "inotify":
+        return InotifyWatcher(listdir, on_removed)
+
+    if mode == "poll":
+        return PollingWatcher(listdir, on_removed, interval)
+
+    raise ValueError("Unknown watch mode \'" + str(mode) + "\'")
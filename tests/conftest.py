@@ -0,0 +1,39 @@
+# pylint: skip-file
+
+import pytest
+
+from src.nofeardb.engine import StorageEngine
+
+
+@pytest.fixture
+def engine_factory(tmp_path):
+    """
+    creates engines on the temporary directory of the test with the given models
+    registered, the engines are closed after the test
+    """
+    engines = []
+
+    def create(models, engine_class=StorageEngine, **kwargs):
+        engine = engine_class(str(tmp_path), **kwargs)
+        engine.register_models(models)
+        engines.append(engine)
+        return engine
+
+    yield create
+
+    for engine in engines:
+        engine.close()
+
+
+@pytest.fixture
+def doc_factory():
+    """creates a document with the given field values in an engine"""
+
+    def create(engine, doc_type, **values):
+        doc = doc_type()
+        for name, value in values.items():
+            setattr(doc, name, value)
+        engine.create(doc)
+        return doc
+
+    return create
@@ -0,0 +1,151 @@
+# pylint: skip-file
+
+import pytest
+import uuid
+import datetime
+
+from src.nofeardb.codegen import CompiledModel
+from src.nofeardb.datatypes import UUID, Boolean, DateTime, Float, Integer, String
+from src.nofeardb.orm import Document, Field, ManyToMany, ManyToOne, OneToMany
+
+
+class CodegenDoc(Document):
+    __documentname__ = "codegen_doc"
+
+    int_field = Field(Integer)
+    rel_docs = OneToMany("CodegenRelDoc", back_populates="parent")
+    float_field = Field(Float)
+    str_field = Field(String)
+    bool_field = Field(Boolean)
+    date_field = Field(DateTime)
+    many_docs = ManyToMany("CodegenRelDoc", back_populates="many_docs")
+
+
+class CodegenRelDoc(Document):
+    __documentname__ = "codegen_rel_doc"
+
+    my_id = Field(UUID, primary_key=True)
+    parent = ManyToOne("CodegenDoc", back_populates="rel_docs")
+    many_docs = ManyToMany("CodegenDoc", back_populates="many_docs")
+
+
+def test_compile_non_document():
+    class NoDoc:
+        pass
+
+    with pytest.raises(ValueError):
+        CompiledModel(NoDoc)
+
+
+def test_compiled_metadata():
+    compiled = CompiledModel(CodegenDoc)
+
+    assert [name for name, _ in compiled.fields] == [
+        "int_field", "float_field", "str_field", "bool_field", "date_field"]
+    assert [name for name, _ in compiled.relationships] == [
+        "rel_docs", "many_docs"]
+    assert compiled.primary_key is None
+    assert CompiledModel(CodegenRelDoc).primary_key == "my_id"
+
+
+def test_compiled_to_json():
+    doc = CodegenDoc()
+    doc.int_field = 3
+    doc.float_field = 2.5
+    doc.str_field = "hello"
+    doc.date_field = datetime.datetime(2024, 1, 2, 3, 4, 5, 6)
+    rel = CodegenRelDoc()
+    doc.rel_docs = [rel]
+    doc.many_docs = [rel]
+
+    assert CompiledModel(CodegenDoc).to_json(doc) == {
+        "id": str(doc.__id__),
+        "int_field": 3,
+        "float_field": 2.5,
+        "str_field": "hello",
+        "bool_field": None,
+        "date_field": "2024-01-02T03:04:05.000006",
+        "rel_docs": [str(rel.__id__)],
+        "many_docs": [str(rel.__id__)],
+    }
+
+    assert CompiledModel(CodegenRelDoc).to_json(rel) == {
+        "id": str(rel.__id__),
+        "parent": [str(doc.__id__)],
+        "many_docs": [str(doc.__id__)],
+    }
+
+
+def test_compiled_hash_matches_document_hash():
+    doc = CodegenDoc()
+    rel = CodegenRelDoc()
+    compiled = CompiledModel(CodegenDoc)
+    compiled_rel = CompiledModel(CodegenRelDoc)
+
+    assert compiled.hash(doc) == doc.get_hash()
+    assert compiled_rel.hash(rel) == rel.get_hash()
+
+    doc.int_field = 38
+    doc.bool_field = True
+    doc.date_field = datetime.datetime.now()
+    doc.rel_docs = [rel]
+
+    assert compiled.hash(doc) == doc.get_hash()
+    assert compiled_rel.hash(rel) == rel.get_hash()
+
+
+def test_compiled_from_json():
+    rel_id = uuid.uuid4()
+    rel = CodegenRelDoc()
+    CompiledModel(CodegenRelDoc).from_json(
+        rel, {"my_id": str(rel_id), "unknown": "value"})
+
+    assert rel.__id__ == rel_id
+    assert rel.my_id == rel_id
+
+    doc = CodegenDoc()
+    doc.str_field = "keep"
+    CompiledModel(CodegenDoc).from_json(doc, {
+        "int_field": "12",
+        "float_field": 1,
+        "bool_field": "True",
+        "date_field": "2024-01-02T03:04:05.000006",
+    })
+
+    assert doc.int_field == 12
+    assert doc.float_field == 1.0
+    assert doc.bool_field is True
+    assert doc.str_field == "keep"
+    assert doc.date_field == datetime.datetime(2024, 1, 2, 3, 4, 5, 6)
+
+
+def test_compiled_from_json_invalid_primary_key():
+    class InvalidKeyDoc(Document):
+        my_id = Field(String, primary_key=True)
+
+    doc = InvalidKeyDoc()
+    with pytest.raises(ValueError):
+        CompiledModel(InvalidKeyDoc).from_json(doc, {"my_id": "no uuid"})
+
+
+def test_compiled_hash_function():
+    doc = CodegenDoc()
+    doc.int_field = 38
+    compiled = CompiledModel(CodegenDoc)
+
+    assert compiled.hash(doc, "blake2b") == doc.get_hash("blake2b")
+    assert compiled.hash(doc, "sha1") == doc.get_hash("sha1")
+    assert len(compiled.hash(doc, "blake2b")) == 16
+
+
+def test_compiled_from_json_invalidates_digests():
+    doc = CodegenDoc()
+    doc.int_field = 1
+    compiled = CompiledModel(CodegenDoc)
+    doc_hash = compiled.hash(doc)
+
+    compiled.from_json(doc, {"int_field": 2})
+
+    assert "int_field" not in doc.__field_digests__
+    assert compiled.hash(doc) != doc_hash
+    assert compiled.hash(doc) == doc.get_hash()
@@ -0,0 +1,80 @@
+# pylint: skip-file
+
+import os
+import json
+import pytest
+
+from src.nofeardb.compression import compress, decompress, get_compression
+from src.nofeardb.datatypes import String
+from src.nofeardb.engine import StorageEngine
+from src.nofeardb.formats import MarshalCodec
+from src.nofeardb.orm import Document, Field
+
+RAW = json.dumps({"id": "test_id", "text": "lorem ipsum " * 200}).encode()
+
+
+@pytest.mark.parametrize("compression", ["zlib", "lzma"])
+def test_compress_roundtrip(compression):
+    compressed = compress(RAW, compression)
+
+    assert len(compressed) < len(RAW)
+    assert get_compression(compressed) == compression
+    assert decompress(compressed) == RAW
+
+
+def test_compress_unknown():
+    with pytest.raises(ValueError):
+        compress(RAW, "unknown")
+
+    with pytest.raises(ValueError):
+        StorageEngine("test/path", compression="unknown")
+
+
+def test_plain_data_not_detected():
+    assert get_compression(RAW) is None
+    assert get_compression(b"") is None
+    assert get_compression(MarshalCodec().encode({"id": "test_id"})) is None
+    assert decompress(RAW) == RAW
+
+
+@pytest.mark.parametrize("compression", ["zlib", "lzma"])
+def test_engine_compression(tmp_path, compression):
+    class TestDoc(Document):
+        text = Field(String)
+
+    engine = StorageEngine(
+        str(tmp_path), compression=compression, compression_threshold=100)
+    engine.register_models([TestDoc])
+
+    small_doc = TestDoc()
+    small_doc.text = "short"
+    engine.create(small_doc)
+
+    large_doc = TestDoc()
+    large_doc.text = "lorem ipsum " * 200
+    engine.create(large_doc)
+
+    stats = engine.stats()
+    assert stats["documents_written"] == 2
+    assert stats["documents_compressed"] == 1
+    assert stats["compression_ratio_written"] > 1.0
+
+    doc_dir = os.path.join(str(tmp_path), "testdoc")
+    for name in os.listdir(doc_dir):
+        with open(os.path.join(doc_dir, name), "rb") as f:
+            content = f.read()
+        if name.startswith(str(large_doc.__id__)):
+            assert get_compression(content) == compression
+        else:
+            assert get_compression(content) is None
+
+    reader = StorageEngine(str(tmp_path))
+    reader.register_models([TestDoc])
+    texts = sorted(doc.text for doc in reader.read(TestDoc).all())
+    assert texts == sorted([small_doc.text, large_doc.text])
+
+    stats = reader.stats()
+    assert stats["documents_read"] == 2
+    assert stats["bytes_decompressed"] > stats["bytes_read"]
+    assert stats["compression_ratio_read"] > 1.0
+    assert stats["decode_time"] > 0.0
@@ -88,6 +88,9 @@ def test_DateTime():
     assert DateTime.serialize(now) == now.isoformat()
     assert DateTime.cast(now) == now
 
+    whole_second = datetime(2024, 1, 2, 3, 4, 5)
+    assert DateTime.deserialize(whole_second.isoformat()) == whole_second
+
     with pytest.raises(AttributeError):
         DateTime.serialize(2)
 
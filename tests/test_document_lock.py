@@ -5,6 +5,7 @@ import uuid
 import os
 from datetime import datetime, timedelta
 
+from src.nofeardb.enums import DocumentStatus
 from src.nofeardb.exceptions import DocumentLockException
 from src.nofeardb.orm import Document
 from src.nofeardb.engine import DocumentLock, StorageEngine
@@ -194,83 +195,69 @@ def test_is_not_owner_wrong_id(mocker):
     assert lock._is_owner() is False
 
 
-def test_try_to_lock_when_already_locked(mocker):
-    lock_creation_date = datetime.now()
-    lock_content = str(uuid.uuid4()) + "\n" + \
-        lock_creation_date.strftime(DATEFORMAT)
-    mocked_fileread_data = mocker.mock_open(read_data=lock_content)
-    mocker.patch('os.path.exists', return_value=True)
-    mocker.patch('builtins.open', mocked_fileread_data)
-
+def test_try_to_lock_when_already_locked(tmp_path):
     class TestDoc(Document):
         pass
 
-    engine = StorageEngine("test/path")
+    engine = StorageEngine(str(tmp_path))
     engine.register_models([TestDoc])
+    os.makedirs(engine.get_doc_basepath(TestDoc))
 
     doc = TestDoc()
+    lock_path = os.path.join(engine.get_doc_basepath(TestDoc), str(doc.__id__) + ".lock")
+    lock_content = str(uuid.uuid4()) + "\n" + datetime.now().strftime(DATEFORMAT)
+    with open(lock_path, "w", encoding="utf-8") as lock_file:
+        lock_file.write(lock_content)
 
     lock = DocumentLock(engine, doc)
     with pytest.raises(DocumentLockException):
         lock.lock()
 
+    with open(lock_path, "r", encoding="utf-8") as lock_file:
+        assert lock_file.read() == lock_content
 
-def test_lock_when_expired_lock_exists(mocker):
-    lock_creation_date = datetime.now()
-    lock_creation_date = lock_creation_date - timedelta(0, 60)
-    lock_content = str(uuid.uuid4()) + "\n" + \
-        lock_creation_date.strftime(DATEFORMAT)
-    mocked_open = mocker.mock_open(read_data=lock_content)
-    mocker.patch('os.path.exists', return_value=True)
-    mocker.patch('builtins.open', mocked_open)
-    mocked_remove = mocker.patch('os.remove')
 
+def test_lock_when_expired_lock_exists(tmp_path, mocker):
     class TestDoc(Document):
         pass
 
-    engine = StorageEngine("test/path")
+    engine = StorageEngine(str(tmp_path))
     engine.register_models([TestDoc])
+    os.makedirs(engine.get_doc_basepath(TestDoc))
 
     doc = TestDoc()
+    lock_path = os.path.join(engine.get_doc_basepath(TestDoc), str(doc.__id__) + ".lock")
+    lock_creation_date = datetime.now() - timedelta(0, 120)
+    with open(lock_path, "w", encoding="utf-8") as lock_file:
+        lock_file.write(str(uuid.uuid4()) + "\n" + lock_creation_date.strftime(DATEFORMAT))
 
     lock = DocumentLock(engine, doc)
     original_cleanup = lock._cleanup_old_lock
     mocked_cleanup_lock = mocker.patch.object(
         DocumentLock, '_cleanup_old_lock', side_effect=original_cleanup)
     lock.lock()
-    mocked_open.assert_called_with(os.path.normpath(
-        "test/path/testdoc/" + str(doc.__id__) + ".lock"), "a", encoding="utf-8")
+
     mocked_cleanup_lock.assert_called_once()
-    mocked_remove.assert_called_once()
+    assert lock._is_owner()
+    assert os.listdir(engine.get_doc_basepath(TestDoc)) == [str(doc.__id__) + ".lock"]
 
 
-def test_lock_no_lock_exists(mocker):
-    lock_creation_date = datetime.now()
-    lock_creation_date = lock_creation_date - timedelta(0, 60)
-    lock_content = str(uuid.uuid4()) + "\n" + \
-        lock_creation_date.strftime(DATEFORMAT)
-    mocked_open = mocker.mock_open(read_data=lock_content)
-    mocker.patch('os.path.exists', return_value=False)
-    mocker.patch('builtins.open', mocked_open)
-    mocked_remove = mocker.patch('os.remove')
-
+def test_lock_no_lock_exists(tmp_path, mocker):
     class TestDoc(Document):
         pass
 
-    engine = StorageEngine("test/path")
+    engine = StorageEngine(str(tmp_path))
     engine.register_models([TestDoc])
+    os.makedirs(engine.get_doc_basepath(TestDoc))
 
     doc = TestDoc()
-
     lock = DocumentLock(engine, doc)
-    original_cleanup = lock._cleanup_old_lock
-    mocked_cleanup_lock = mocker.patch.object(
-        DocumentLock, '_cleanup_old_lock', side_effect=original_cleanup)
+    mocked_cleanup_lock = mocker.patch.object(DocumentLock, '_cleanup_old_lock')
     lock.lock()
-    mocked_open.assert_called_with(
-        os.path.normpath("test/path/testdoc/" + str(doc.__id__) + ".lock"), "a", encoding="utf-8")
-    mocked_cleanup_lock.assert_called_once()
-    mocked_remove.assert_not_called()
+
+    mocked_cleanup_lock.assert_not_called()
+    assert lock._is_owner()
+    assert lock.is_locked()
 
 
 def test_release_owned_existing_lock(mocker):
@@ -378,3 +365,105 @@ def test_try_releasing_not_existing_lock(mocker):
 
     mocked_open.assert_not_called()
     mocked_remove.assert_not_called()
+
+
+def test_lock_blocks_other_lock(tmp_path):
+    class TestDoc(Document):
+        pass
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([TestDoc])
+    os.makedirs(engine.get_doc_basepath(TestDoc))
+
+    doc = TestDoc()
+    lock = DocumentLock(engine, doc)
+    lock.lock()
+
+    other_lock = DocumentLock(engine, doc)
+    assert other_lock.is_locked()
+    with pytest.raises(DocumentLockException):
+        other_lock.lock()
+
+    lock.release()
+    other_lock.lock()
+    other_lock.release()
+
+
+def test_lock_being_created_not_taken_over(tmp_path):
+    class TestDoc(Document):
+        pass
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([TestDoc])
+    os.makedirs(engine.get_doc_basepath(TestDoc))
+
+    doc = TestDoc()
+    # the lock file was created by another process, which did not write it yet
+    lock_path = os.path.join(engine.get_doc_basepath(TestDoc), str(doc.__id__) + ".lock")
+    open(lock_path, "w").close()
+
+    with pytest.raises(DocumentLockException):
+        DocumentLock(engine, doc).lock()
+    assert os.path.exists(lock_path)
+
+
+def test_expired_lock_taken_over_once(tmp_path, mocker):
+    class TestDoc(Document):
+        pass
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([TestDoc])
+    os.makedirs(engine.get_doc_basepath(TestDoc))
+
+    doc = TestDoc()
+    lock_path = os.path.join(engine.get_doc_basepath(TestDoc), str(doc.__id__) + ".lock")
+    lock_creation_date = datetime.now() - timedelta(0, 120)
+    with open(lock_path, "w", encoding="utf-8") as lock_file:
+        lock_file.write(str(uuid.uuid4()) + "\n" + lock_creation_date.strftime(DATEFORMAT))
+
+    lock = DocumentLock(engine, doc)
+    other_lock = DocumentLock(engine, doc)
+    original_is_expired = DocumentLock._is_lock_expired
+    taken_over = []
+
+    def take_over_meanwhile(checked_lock):
+        # another process takes the expired lock over and acquires it first
+        expired = original_is_expired(checked_lock)
+        if checked_lock is lock and len(taken_over) == 0:
+            taken_over.append(checked_lock)
+            other_lock.lock()
+        return expired
+
+    mocker.patch.object(DocumentLock, "_is_lock_expired", take_over_meanwhile)
+    with pytest.raises(DocumentLockException):
+        lock.lock()
+
+    assert other_lock._is_owner()
+    assert os.listdir(engine.get_doc_basepath(TestDoc)) == [str(doc.__id__) + ".lock"]
+
+
+def test_locks_released_on_write_error(tmp_path, mocker):
+    class TestDoc(Document):
+        pass
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([TestDoc])
+    doc = TestDoc()
+    engine.create(doc)
+
+    write_json = StorageEngine.write_json
+    mocker.patch.object(StorageEngine, "write_json", side_effect=OSError("disk full"))
+    doc.__status__ = DocumentStatus.MOD
+    with pytest.raises(OSError):
+        engine.update(doc)
+
+    mocker.patch.object(StorageEngine, "delete_json", side_effect=OSError("disk full"))
+    with pytest.raises(OSError):
+        engine.delete(doc)
+
+    base_path = engine.get_doc_basepath(TestDoc)
+    assert [name for name in os.listdir(base_path) if name.endswith(".lock")] == []
+    assert not DocumentLock(engine, doc).is_locked()
+
+    mocker.patch.object(StorageEngine, "write_json", write_json)
+    engine.update(doc)
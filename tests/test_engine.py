@@ -126,6 +126,11 @@ def test_updateJsonNotExistingId(mocker):
         engine._check_all_documents_can_be_written([doc1, doc2]) == False
 
 
+def test_unknown_hash_function():
+    with pytest.raises(ValueError):
+        StorageEngine("test/path", hash_function="unknown")
+
+
 def test_create_json_fields():
     class TestDoc(Document):
         uuid = Field(UUID, primary_key=True)
@@ -638,7 +643,7 @@ def test_read_data_from_file(mocker):
     mocker.patch('json.loads', return_value={"test": "hello", "test_int": 38})
     mocker.patch('os.open')
     mocker.patch('os.fstat')
-    mocker.patch('os.read', return_value={"test": "hello", "test_int": 38})
+    mocker.patch('os.read', return_value=lock_content.encode())
     mocker.patch('os.close')
     mocker.patch.object(
         StorageEngine, '_extract_id_and_hash_from_filename', return_value=("test_id", "test_hash"))
@@ -698,6 +703,43 @@ def test_write_json_previous_file_not_existing(mocker):
     mocked_rename.assert_called_once()
 
 
+def test_write_json_unchanged_document_skipped(tmp_path):
+    class TestDoc(Document):
+        field1 = Field(Integer)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([TestDoc])
+
+    doc = TestDoc()
+    doc.field1 = 38
+    engine.create(doc)
+
+    doc_dir = os.path.join(str(tmp_path), "testdoc")
+    files_before = os.listdir(doc_dir)
+    assert engine.stats()["documents_written"] == 1
+    assert engine.stats()["writes_skipped"] == 0
+
+    doc.field1 = 38
+    assert doc.__status__ == DocumentStatus.MOD
+    engine.update(doc)
+
+    assert os.listdir(doc_dir) == files_before
+    assert doc.__status__ == DocumentStatus.SYNC
+    assert engine.stats()["documents_written"] == 1
+    assert engine.stats()["writes_skipped"] == 1
+
+    doc.field1 = 39
+    engine.update(doc)
+
+    assert os.listdir(doc_dir) != files_before
+    assert engine.stats()["documents_written"] == 2
+    assert engine.stats()["writes_skipped"] == 1
+
+    engine.reset_stats()
+    assert engine.stats()["documents_written"] == 0
+    assert engine.stats()["writes_skipped"] == 0
+
+
 def test_create_and_update_doc(mocker):
     class TestDoc(Document):
         pass
@@ -1156,3 +1198,152 @@ def test_delete_document_wrong_status(mocker):
     with pytest.raises(RuntimeError):
         doc.__status__ = DocumentStatus.NEW
         engine.delete(doc)
+
+
+def test_sharded_layout(tmp_path):
+    class ShardedDoc(Document):
+        __documentshardlength__ = 2
+
+        field1 = Field(Integer)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([ShardedDoc])
+
+    docs = [ShardedDoc() for _ in range(10)]
+    for doc in docs:
+        doc.field1 = 38
+        engine.create(doc)
+
+    base_path = engine.get_doc_basepath(ShardedDoc)
+    for doc in docs:
+        doc_dir = os.path.join(base_path, str(doc.__id__)[:2])
+        assert engine.get_doc_dirpath(doc) == doc_dir
+        assert os.path.dirname(
+            engine._get_existing_document_file_name(doc)) == doc_dir
+
+    docs[0].field1 = 39
+    engine.update(docs[0])
+
+    read_docs = StorageEngine(str(tmp_path))
+    read_docs.register_models([ShardedDoc])
+    read_docs = read_docs.read(ShardedDoc).all()
+    assert sorted(doc.__id__ for doc in read_docs) == sorted(
+        doc.__id__ for doc in docs)
+    assert sorted(doc.field1 for doc in read_docs) == [38] * 9 + [39]
+
+
+def test_relayout(tmp_path):
+    class RelayoutDoc(Document):
+        field1 = Field(Integer)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([RelayoutDoc])
+    docs = [RelayoutDoc() for _ in range(5)]
+    for doc in docs:
+        engine.create(doc)
+
+    base_path = engine.get_doc_basepath(RelayoutDoc)
+    sharded_engine = StorageEngine(str(tmp_path), shard_length=1)
+    sharded_engine.register_models([RelayoutDoc])
+
+    assert sharded_engine.relayout(RelayoutDoc) == 5
+    assert sharded_engine.relayout(RelayoutDoc) == 0
+    assert all(os.path.isdir(os.path.join(base_path, name))
+               for name in os.listdir(base_path))
+    assert len(sharded_engine.read(RelayoutDoc).all()) == 5
+
+    assert engine.relayout(RelayoutDoc) == 5
+    assert all(os.path.isfile(os.path.join(base_path, name))
+               for name in os.listdir(base_path))
+    assert len(engine.read(RelayoutDoc).all()) == 5
+
+
+
+class ResolveProject(Document):
+    name = Field(String)
+    members = ManyToMany("ResolveMember", back_populates="projects")
+
+
+class ResolveMember(Document):
+    name = Field(String)
+    projects = ManyToMany("ResolveProject", back_populates="members")
+
+
+def test_update_read_document_with_many_to_many(tmp_path):
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([ResolveProject, ResolveMember])
+    project = ResolveProject()
+    for i in range(3):
+        member = ResolveMember()
+        member.name = "member_" + str(i)
+        member.projects.append(project)
+    engine.create(project)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([ResolveProject, ResolveMember])
+    members = engine.read(ResolveMember).order_by("name").all()
+    members[0].name = "renamed"
+    engine.update(members[0])
+    engine.delete(members[1])
+
+    names = [member.name for member in engine.read(ResolveMember).order_by("name").all()]
+    assert names == ["member_2", "renamed"]
+    assert len(engine.read(ResolveProject).first().members) == 2
+
+
+def test_update_loads_only_related_documents(tmp_path):
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([ResolveProject, ResolveMember])
+    projects = [ResolveProject() for _ in range(3)]
+    for i in range(6):
+        member = ResolveMember()
+        member.name = "member_" + str(i)
+        member.projects = list(projects)
+    engine.create(projects[0])
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([ResolveProject, ResolveMember])
+    member = [doc for doc in engine.read(ResolveMember).all() if doc.name == "member_0"][0]
+    member.name = "renamed"
+
+    read_before = engine.stats()["documents_read"]
+    engine.update(member)
+
+    # the projects of the member are loaded, their other members are not
+    assert engine.stats()["documents_read"] - read_before == 3
+    assert sorted(
+        doc.name for doc in engine.read(ResolveMember).all())[-1] == "renamed"
+
+
+class ResolveTeam(Document):
+    members = OneToMany("ResolveTeamMember", back_populates="team", cascade=["delete"])
+
+
+class ResolveTeamMember(Document):
+    team = ManyToOne("ResolveTeam", back_populates="members")
+    tags = ManyToMany("ResolveTag", back_populates="members")
+
+
+class ResolveTag(Document):
+    members = ManyToMany("ResolveTeamMember", back_populates="tags")
+
+
+def test_delete_cascade_unlinks_neighbours_of_cascaded_documents(tmp_path):
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([ResolveTeam, ResolveTeamMember, ResolveTag])
+    team = ResolveTeam()
+    tag = ResolveTag()
+    member = ResolveTeamMember()
+    member.team = team
+    member.tags = [tag]
+    engine.create(team)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([ResolveTeam, ResolveTeamMember, ResolveTag])
+    engine.delete(engine.read(ResolveTeam).first())
+
+    assert engine.read(ResolveTeamMember).all() == []
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([ResolveTeam, ResolveTeamMember, ResolveTag])
+    assert len(engine.read(ResolveTag).first().members) == 0
@@ -113,4 +113,84 @@ def test_or():
                 expr.eq("a", 1), expr.eq("b", 3)
             )
         ).evaluate(t)
-    ) is True
\ No newline at end of file
+    ) is True
+
+
+def test_evaluate_with():
+
+    data = {"a": 1, "b": 3}
+
+    def get_value(item, attr_name):
+        return item[attr_name]
+
+    assert expr.eq("a", 1).evaluate_with(get_value, data) is True
+    assert expr.and_(expr.eq("a", 1), expr.gt("b", 3)).evaluate_with(get_value, data) is False
+    assert expr.or_(expr.eq("a", 2), expr.is_in("b", [3])).evaluate_with(get_value, data) is True
+
+def test_compile():
+
+    data = {"a": 1, "b": 3, "c": None}
+
+    def get_value(item, attr_name):
+        return item[attr_name]
+
+    expressions = [
+        expr.eq("a", 1), expr.neq("a", 1), expr.lt("b", 4), expr.lte("b", 2),
+        expr.gt("b", 2), expr.gte("b", 4), expr.is_("c", None), expr.is_not("c", None),
+        expr.is_in("a", [1, 2]), expr.is_in("a", [[1], 2]),
+        expr.and_(expr.eq("a", 1), expr.or_(expr.gt("b", 5), expr.is_("c", None))),
+        expr.or_(expr.eq("a", 2), expr.and_(expr.lt("b", 5), expr.neq("a", 1))),
+    ]
+    for expression in expressions:
+        assert bool(expression.compile()(get_value, data)) == bool(
+            expression.evaluate_with(get_value, data))
+
+    assert expressions[0].compile() is expressions[0].compile()
+
+
+def test_compile_is_in_matches_evaluate():
+
+    def get_value(item, attr_name):
+        return item[attr_name]
+
+    cases = [
+        (expr.is_in("name", "Jane Doe"), {"name": "Jane"}),
+        (expr.is_in("name", "Jane Doe"), {"name": "Max"}),
+        (expr.is_in("name", b"Jane Doe"), {"name": b"Doe"}),
+        (expr.is_in("tags", [[1], 2]), {"tags": [1]}),
+        (expr.is_in("tags", [1, 2]), {"tags": [1]}),
+        (expr.is_in("tags", (1, 2)), {"tags": 2}),
+        (expr.is_in("tags", {"a": 1}), {"tags": "a"}),
+    ]
+    for expression, data in cases:
+        assert expression.compile()(get_value, data) == \
+            expression.evaluate_with(get_value, data)
+
+
+def test_compile_short_circuit():
+
+    calls = []
+
+    def get_value(item, attr_name):
+        calls.append(attr_name)
+        return item[attr_name]
+
+    predicate = expr.or_(expr.eq("a", 1), expr.eq("b", 1)).compile()
+    assert predicate(get_value, {"a": 1, "b": 2})
+    assert calls == ["a"]
+
+
+def test_compile_custom_expression():
+
+    class OddExpr(expr.AbstractExpr):
+
+        def evaluate_with(self, get_value, item):
+            return get_value(item, "a") % 2 == 1
+
+    def get_value(item, attr_name):
+        return item[attr_name]
+
+    predicate = expr.and_(OddExpr(), expr.gt("a", 2)).compile()
+    assert predicate(get_value, {"a": 3})
+    assert not predicate(get_value, {"a": 4})
+    assert not predicate(get_value, {"a": 1})
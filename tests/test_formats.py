@@ -0,0 +1,184 @@
+# pylint: skip-file
+
+import os
+import pytest
+
+import src.nofeardb.formats as formats
+from src.nofeardb.engine import StorageEngine
+from src.nofeardb.datatypes import Integer, String
+from src.nofeardb.formats import (
+    FastJsonCodec, JsonCodec, MarshalCodec, MsgpackCodec, get_codec, get_codec_for_extension
+)
+from src.nofeardb.orm import Document, Field
+
+TEST_DATA = {
+    "id": "test_id",
+    "name": "Jürgen",
+    "number": 38,
+    "value": 3.8,
+    "rels": ["first", "second"],
+    "nothing": None,
+}
+
+
+def test_json_codec_compact():
+    codec = JsonCodec()
+
+    raw = codec.encode(TEST_DATA)
+    assert isinstance(raw, bytes)
+    assert b", " not in raw
+    assert b": " not in raw
+    assert "Jürgen".encode("utf-8") in raw
+    assert codec.decode(raw) == TEST_DATA
+
+
+def test_fast_json_codec():
+    codec = FastJsonCodec()
+
+    raw = codec.encode(TEST_DATA)
+    assert isinstance(raw, bytes)
+    assert codec.decode(raw) == TEST_DATA
+    assert JsonCodec().decode(raw) == TEST_DATA
+
+
+def test_fast_json_codec_fallback(mocker):
+    mocker.patch.object(formats, "orjson", None)
+    mocker.patch.object(formats, "ujson", None)
+
+    codec = FastJsonCodec()
+
+    assert codec.library == "json"
+    assert codec.encode(TEST_DATA) == JsonCodec().encode(TEST_DATA)
+    assert codec.decode(codec.encode(TEST_DATA)) == TEST_DATA
+
+
+def test_marshal_codec():
+    codec = MarshalCodec()
+
+    raw = codec.encode(TEST_DATA)
+    assert isinstance(raw, bytes)
+    assert codec.decode(raw) == TEST_DATA
+
+
+def test_msgpack_codec_not_installed(mocker):
+    mocker.patch.object(formats, "msgpack", None)
+
+    with pytest.raises(RuntimeError):
+        MsgpackCodec()
+
+
+def test_get_codec_for_extension():
+    assert isinstance(get_codec_for_extension(".json"), JsonCodec)
+    assert isinstance(get_codec_for_extension(".marshal"), MarshalCodec)
+    assert get_codec_for_extension(".unknown") is None
+    assert get_codec_for_extension("") is None
+
+
+def test_get_codec():
+    assert isinstance(get_codec("json"), JsonCodec)
+    assert isinstance(get_codec("fastjson"), FastJsonCodec)
+
+    codec = JsonCodec()
+    assert get_codec(codec) is codec
+
+    with pytest.raises(ValueError):
+        get_codec("unknown")
+
+    with pytest.raises(ValueError):
+        StorageEngine("test/path", codec="unknown")
+
+
+@pytest.mark.parametrize("codec", ["json", "fastjson"])
+def test_engine_codec_roundtrip(tmp_path, codec):
+    class TestDoc(Document):
+        name = Field(String)
+        number = Field(Integer)
+
+    engine = StorageEngine(str(tmp_path), codec=codec)
+    engine.register_models([TestDoc])
+
+    doc = TestDoc()
+    doc.name = "Helga"
+    doc.number = 38
+    engine.create(doc)
+
+    doc_dir = os.path.join(str(tmp_path), "testdoc")
+    with open(os.path.join(doc_dir, os.listdir(doc_dir)[0]), "rb") as f:
+        assert b" " not in f.read()
+
+    reader = StorageEngine(str(tmp_path), codec=codec)
+    reader.register_models([TestDoc])
+    read_doc = reader.read(TestDoc).first()
+    assert read_doc.__id__ == doc.__id__
+    assert read_doc.name == "Helga"
+    assert read_doc.number == 38
+
+
+def test_engine_document_format(tmp_path):
+    class JsonDoc(Document):
+        name = Field(String)
+
+    class BinaryDoc(Document):
+        __documentformat__ = "marshal"
+
+        name = Field(String)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([JsonDoc, BinaryDoc])
+
+    assert isinstance(engine.get_document_codec(JsonDoc), JsonCodec)
+    assert isinstance(engine.get_document_codec(BinaryDoc), MarshalCodec)
+
+    json_doc = JsonDoc()
+    json_doc.name = "json"
+    engine.create(json_doc)
+    binary_doc = BinaryDoc()
+    binary_doc.name = "binary"
+    engine.create(binary_doc)
+
+    assert os.listdir(os.path.join(str(tmp_path), "jsondoc"))[0].endswith(".json")
+    assert os.listdir(os.path.join(str(tmp_path), "binarydoc"))[0].endswith(".marshal")
+
+    reader = StorageEngine(str(tmp_path))
+    reader.register_models([JsonDoc, BinaryDoc])
+    assert reader.read(JsonDoc).first().name == "json"
+    assert reader.read(BinaryDoc).first().name == "binary"
+
+
+def test_engine_migrate(tmp_path):
+    class TestDoc(Document):
+        name = Field(String)
+        number = Field(Integer)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([TestDoc])
+    doc_dir = os.path.join(str(tmp_path), "testdoc")
+
+    assert engine.migrate(TestDoc, "marshal") == 0
+
+    for i in range(3):
+        doc = TestDoc()
+        doc.name = "doc " + str(i)
+        doc.number = i
+        engine.create(doc)
+
+    names_before = sorted(os.listdir(doc_dir))
+    assert engine.migrate(TestDoc, "marshal") == 3
+    assert engine.migrate(TestDoc, "marshal") == 0
+
+    names_after = sorted(os.listdir(doc_dir))
+    assert [os.path.splitext(name)[0] for name in names_before] == \
+        [os.path.splitext(name)[0] for name in names_after]
+    assert all(name.endswith(".marshal") for name in names_after)
+
+    reader = StorageEngine(str(tmp_path))
+    reader.register_models([TestDoc])
+    assert sorted(doc.number for doc in reader.read(TestDoc).all()) == [0, 1, 2]
+
+    read_doc = reader.read(TestDoc).first()
+    read_doc.number = 38
+    reader.update(read_doc)
+    assert len([name for name in os.listdir(doc_dir) if name.endswith(".json")]) == 1
+
+    assert engine.migrate(TestDoc) == 2
+    assert len([name for name in os.listdir(doc_dir) if name.endswith(".json")]) == 3
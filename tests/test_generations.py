@@ -0,0 +1,61 @@
+# pylint: skip-file
+
+import os
+
+from src.nofeardb.datatypes import Integer
+from src.nofeardb.engine import GENERATION_DIRECTORY
+from src.nofeardb.orm import Document, Field
+from src.nofeardb.segments import SegmentStorageEngine
+
+
+class GenerationDoc(Document):
+    __documentname__ = "generation_doc"
+
+    value = Field(Integer)
+
+
+def test_generation_changes_on_write(tmp_path, engine_factory, doc_factory):
+    engine = engine_factory([GenerationDoc])
+    assert engine.get_generation(GenerationDoc) is None
+
+    doc = doc_factory(engine, GenerationDoc, value=1)
+    first = engine.get_generation(GenerationDoc)
+    assert first.startswith("1-")
+    assert os.listdir(os.path.join(str(tmp_path), GENERATION_DIRECTORY)) == ["generation_doc"]
+
+    engine.update(doc)
+    assert engine.get_generation(GenerationDoc) == first
+
+    doc.value = 2
+    engine.update(doc)
+    second = engine.get_generation(GenerationDoc)
+    assert second.startswith("2-")
+
+    engine.delete(doc)
+    assert engine.get_generation(GenerationDoc) not in [first, second]
+
+
+def test_generation_segment_engine(engine_factory, doc_factory):
+    engine = engine_factory([GenerationDoc], SegmentStorageEngine)
+    doc = doc_factory(engine, GenerationDoc, value=1)
+    first = engine.get_generation(GenerationDoc)
+    assert first is not None
+
+    doc.value = 2
+    engine.update(doc)
+    assert engine.get_generation(GenerationDoc) != first
+
+
+def test_cache_listings(engine_factory, doc_factory):
+    writer = engine_factory([GenerationDoc])
+    doc_factory(writer, GenerationDoc, value=1)
+    reader = engine_factory([GenerationDoc], cache_listings=True, instrumentation=True)
+
+    assert len(reader.read(GenerationDoc).all()) == 1
+    assert len(reader.read(GenerationDoc).all()) == 1
+    assert reader.stats()["listings_reused"] == 1
+
+    doc_factory(writer, GenerationDoc, value=2)
+    assert len(reader.read(GenerationDoc).all()) == 2
+    assert reader.stats()["listings_reused"] == 1
+    assert reader.stats()["directories_listed"] == 2
@@ -0,0 +1,214 @@
+# pylint: skip-file
+
+import json
+import pytest
+
+import src.nofeardb.expr as expr
+from src.nofeardb.datatypes import Integer
+from src.nofeardb.engine import StorageEngine
+from src.nofeardb.instrumentation import (
+    DisabledInstrumentation, EngineHook, Histogram, Instrumentation, SlowOperationLog
+)
+from src.nofeardb.orm import Document, Field
+
+
+class InstrumentedDoc(Document):
+    __documentname__ = "instrumented_doc"
+
+    value = Field(Integer)
+
+
+class RecordingHook(EngineHook):
+
+    def __init__(self):
+        self.calls = []
+
+    def before(self, name, info):
+        info["started"] = True
+        self.calls.append(("before", name))
+
+    def after(self, name, info, seconds, error):
+        assert info["started"]
+        assert seconds >= 0.0
+        self.calls.append(("after", name, error))
+
+
+def test_histogram():
+    histogram = Histogram()
+    histogram.add(0.00005)
+    histogram.add(0.5)
+    histogram.add(20.0)
+
+    data = histogram.to_dict()
+    assert data["count"] == 3
+    assert data["min"] == 0.00005
+    assert data["max"] == 20.0
+    assert data["mean"] == pytest.approx(20.50005 / 3)
+    assert data["buckets"]["<=0.0001"] == 1
+    assert data["buckets"]["<=1.0"] == 1
+    assert data["buckets"][">10.0"] == 1
+    assert sum(data["buckets"].values()) == 3
+
+
+def test_instrumentation():
+    instrumentation = Instrumentation()
+    instrumentation.count("files_listed", 3)
+    instrumentation.count("files_listed")
+    with instrumentation.timer("update"):
+        pass
+
+    snapshot = instrumentation.snapshot()
+    assert snapshot["counters"] == {"files_listed": 4}
+    assert snapshot["timings"]["update"]["count"] == 1
+
+    instrumentation.reset()
+    assert instrumentation.snapshot() == {"counters": {}, "timings": {}}
+
+
+def test_disabled_instrumentation():
+    instrumentation = DisabledInstrumentation()
+    instrumentation.count("files_listed", 3)
+    with instrumentation.timer("update"):
+        pass
+
+    assert instrumentation.snapshot() == {"counters": {}, "timings": {}}
+
+
+def test_engine_stats_without_instrumentation(tmp_path):
+    engine = StorageEngine(tmp_path)
+    engine.register_models([InstrumentedDoc])
+    doc = InstrumentedDoc()
+    doc.value = 1
+    engine.create(doc)
+
+    stats = engine.stats()
+    assert "timings" not in stats
+    assert "lock_attempts" not in stats
+
+
+def test_engine_stats_with_instrumentation(tmp_path):
+    engine = StorageEngine(tmp_path, instrumentation=True)
+    engine.register_models([InstrumentedDoc])
+    doc = InstrumentedDoc()
+    doc.value = 1
+    engine.create(doc)
+    doc.value = 2
+    engine.update(doc)
+
+    reader = StorageEngine(tmp_path, instrumentation=True)
+    reader.register_models([InstrumentedDoc])
+    assert reader.read(InstrumentedDoc).first().value == 2
+    assert reader.read(InstrumentedDoc).first().value == 2
+
+    stats = engine.stats()
+    assert stats["lock_attempts"] == 2
+    assert stats["documents_written"] == 2
+    for name in ["create", "create.lock", "create.write", "update",
+                 "update.resolve_dependencies", "write_json.serialize", "write_json.rename"]:
+        assert stats["timings"][name]["count"] >= 1
+
+    stats = reader.stats()
+    assert stats["directories_listed"] == 2
+    assert stats["files_listed"] == 2
+    assert stats["cache_misses"] == 1
+    assert stats["cache_hits"] == 1
+    assert stats["timings"]["read"]["count"] == 2
+    assert stats["timings"]["read.load"]["count"] == 2
+
+    reader.reset_stats()
+    stats = reader.stats()
+    assert stats["documents_read"] == 0
+    assert "cache_hits" not in stats
+    assert stats["timings"] == {}
+
+
+def test_engine_hooks(tmp_path):
+    hook = RecordingHook()
+    engine = StorageEngine(tmp_path)
+    engine.register_models([InstrumentedDoc])
+    engine.add_hook(hook)
+
+    doc = InstrumentedDoc()
+    doc.value = 1
+    engine.create(doc)
+
+    assert hook.calls[0] == ("before", "create")
+    assert hook.calls[-1] == ("after", "create", None)
+    names = [call[1] for call in hook.calls]
+    for name in ["lock.acquire", "lock.release", "file.write", "create.lock"]:
+        assert name in names
+
+    hook.calls = []
+    assert engine.read(InstrumentedDoc).first().value == 1
+    names = [call[1] for call in hook.calls if call[0] == "before"]
+    assert names == ["read", "read.load", "file.read"]
+
+    engine.delete(doc)
+    assert ("before", "file.remove") in hook.calls
+    assert engine.stats().get("timings") is None
+
+    engine.remove_hook(hook)
+    hook.calls = []
+    engine.read(InstrumentedDoc).all()
+    assert hook.calls == []
+
+
+def test_engine_hooks_error():
+    hook = RecordingHook()
+    instrumentation = DisabledInstrumentation()
+    instrumentation.add_hook(hook)
+
+    error = ValueError("failed")
+    with pytest.raises(ValueError):
+        with instrumentation.timer("update"):
+            raise error
+
+    assert hook.calls == [("before", "update"), ("after", "update", error)]
+
+
+def test_slow_operation_log(tmp_path):
+    log_path = tmp_path / "slow.jsonl"
+    writer = StorageEngine(tmp_path / "db")
+    writer.register_models([InstrumentedDoc])
+    for value in range(3):
+        doc = InstrumentedDoc()
+        doc.value = value
+        writer.create(doc)
+
+    engine = StorageEngine(tmp_path / "db", slow_log=str(log_path), slow_log_threshold=0.0)
+    engine.register_models([InstrumentedDoc])
+    engine.read(InstrumentedDoc).where(
+        expr.and_(expr.gt("value", 0), expr.lt("value", 5))).all()
+    engine.read(InstrumentedDoc).where(expr.gt("value", 1)).all()
+
+    entries = [json.loads(line) for line in log_path.read_text().splitlines()]
+    assert [entry["operation"] for entry in entries] == ["read", "where", "read", "where"]
+
+    where = entries[1]
+    assert where["document_type"] == "instrumented_doc"
+    assert where["fingerprint"] == "and_(gt(value, ?), lt(value, ?))"
+    assert where["scanned"] == 3
+    assert where["returned"] == 2
+    assert where["error"] is None
+    assert where["counters"]["cache_misses"] == 3
+    assert where["cache_hit_ratio"] == 0.0
+    assert where["phases"]["file.read"] > 0.0
+    assert "read.load" in where["phases"]
+
+    assert entries[3]["fingerprint"] == "gt(value, ?)"
+    assert entries[3]["returned"] == 1
+    assert entries[3]["cache_hit_ratio"] == 1.0
+
+
+def test_slow_operation_log_threshold(tmp_path):
+    log_path = tmp_path / "slow.jsonl"
+    engine = StorageEngine(tmp_path / "db")
+    engine.register_models([InstrumentedDoc])
+    engine.add_hook(SlowOperationLog(str(log_path), threshold=60.0))
+
+    doc = InstrumentedDoc()
+    doc.value = 1
+    engine.create(doc)
+    engine.read(InstrumentedDoc).where(expr.eq("value", 1)).all()
+
+    assert not log_path.exists()
@@ -271,3 +271,109 @@ def test_get_hash_value():
     assert reldoc2.get_hash() == relhash2
             
     
+
+
+def test_get_hash_caches_field_digests():
+    class TestDocDigest(Document):
+        field1 = Field(Integer)
+        field2 = Field(String)
+
+        test_rel_docs = OneToMany("TestRelDocDigest", back_populates="test_doc")
+
+    class TestRelDocDigest(Document):
+        test_doc = ManyToOne("TestDocDigest", back_populates="test_rel_docs")
+
+    doc = TestDocDigest()
+    doc.field1 = 1
+    doc.field2 = "hello"
+    doc_hash = doc.get_hash()
+    assert set(doc.__field_digests__.keys()) == set(
+        ["field1", "field2", "test_rel_docs"])
+
+    doc.field1 = 2
+    assert "field1" not in doc.__field_digests__
+    assert "field2" in doc.__field_digests__
+    assert doc.get_hash() != doc_hash
+
+    rel = TestRelDocDigest()
+    rel.get_hash()
+    assert "test_doc" in rel.__field_digests__
+    doc.test_rel_docs.append(rel)
+    assert "test_rel_docs" not in doc.__field_digests__
+    assert "test_doc" not in rel.__field_digests__
+
+
+def test_relationship_list_mutators_keep_hash_fresh():
+    class TestDocMutators(Document):
+        test_rel_docs = OneToMany("TestRelDocMutators", back_populates="test_doc")
+        many_docs = ManyToMany("TestRelDocMutators", back_populates="many_docs")
+
+    class TestRelDocMutators(Document):
+        test_doc = ManyToOne("TestDocMutators", back_populates="test_rel_docs")
+        many_docs = ManyToMany("TestDocMutators", back_populates="many_docs")
+
+    def fresh_hash(doc):
+        cached = doc.get_hash()
+        doc.__field_digests__.clear()
+        return cached, doc.get_hash()
+
+    doc = TestDocMutators()
+    rels = [TestRelDocMutators() for _ in range(3)]
+
+    for name in ["test_rel_docs", "many_docs"]:
+        relationship = getattr(doc, name)
+        for rel in rels:
+            relationship.append(rel)
+            cached, fresh = fresh_hash(doc)
+            assert cached == fresh
+
+        relationship[0] = TestRelDocMutators()
+        cached, fresh = fresh_hash(doc)
+        assert cached == fresh
+
+        relationship.remove(relationship[0])
+        cached, fresh = fresh_hash(doc)
+        assert cached == fresh
+
+        relationship.reverse()
+        cached, fresh = fresh_hash(doc)
+        assert cached == fresh
+
+        relationship.sort(key=lambda rel: str(rel.__id__))
+        cached, fresh = fresh_hash(doc)
+        assert cached == fresh
+
+        doc.get_hash()
+        with pytest.raises(RuntimeError):
+            relationship.pop()
+        with pytest.raises(RuntimeError):
+            relationship.insert(0, TestRelDocMutators())
+        with pytest.raises(RuntimeError):
+            relationship.clear()
+        with pytest.raises(RuntimeError):
+            relationship += [TestRelDocMutators()]
+        with pytest.raises(RuntimeError):
+            relationship *= 2
+        with pytest.raises(RuntimeError):
+            del relationship[0]
+        assert len(getattr(doc, name)) == 2
+        cached, fresh = fresh_hash(doc)
+        assert cached == fresh
+
+
+def test_get_hash_function():
+    class TestDocHashFunction(Document):
+        field1 = Field(Integer)
+
+    doc = TestDocHashFunction()
+    doc.field1 = 38
+
+    md5_hash = doc.get_hash()
+    blake_hash = doc.get_hash("blake2b")
+    assert len(md5_hash) == 32
+    assert len(blake_hash) == 16
+    assert doc.__digest_algorithm__ == "blake2b"
+    assert doc.get_hash() == md5_hash
+
+    with pytest.raises(KeyError):
+        doc.get_hash("unknown")
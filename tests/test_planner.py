@@ -0,0 +1,112 @@
+# pylint: skip-file
+
+import uuid
+
+import src.nofeardb.expr as expr
+from src.nofeardb.planner import (
+    FULL_SCAN, ID_LOOKUP, PlannerStatistics, cache_key, fingerprint, flatten, get_attr_names,
+    optimize, plan
+)
+
+
+def test_fingerprint():
+    assert fingerprint(expr.eq("name", "Helga")) == "eq(name, ?)"
+    assert fingerprint(expr.is_in("number", [1, 2])) == "is_in(number, ?)"
+
+    first = expr.and_(expr.eq("a", 1), expr.and_(expr.gt("b", 2), expr.lt("c", 3)))
+    second = expr.and_(expr.and_(expr.lt("c", 5), expr.eq("a", 7)), expr.gt("b", 1))
+    assert fingerprint(first) == "and_(eq(a, ?), gt(b, ?), lt(c, ?))"
+    assert fingerprint(first) == fingerprint(second)
+    assert fingerprint(expr.or_(expr.eq("a", 1), expr.eq("b", 1))) == \
+        "or_(eq(a, ?), eq(b, ?))"
+
+
+def test_cache_key():
+    assert cache_key(expr.eq("name", "Helga")) == "eq(name, 'Helga')"
+    assert cache_key(expr.is_in("number", [2, 1])) == cache_key(expr.is_in("number", [1, 2]))
+
+    first = expr.and_(expr.eq("a", 1), expr.and_(expr.gt("b", 2), expr.lt("c", 3)))
+    second = expr.and_(expr.and_(expr.lt("c", 3), expr.eq("a", 1)), expr.gt("b", 2))
+    assert cache_key(first) == "and_(eq(a, 1), gt(b, 2), lt(c, 3))"
+    assert cache_key(first) == cache_key(second)
+    assert cache_key(expr.and_(expr.eq("a", 1), expr.gt("b", 3))) != cache_key(
+        expr.and_(expr.eq("a", 1), expr.gt("b", 2)))
+
+    class CustomExpr(expr.AbstractExpr):
+        def evaluate_with(self, get_value, item):
+            return True
+
+    assert cache_key(expr.and_(expr.eq("a", 1), CustomExpr())) is None
+
+
+def test_get_attr_names():
+    assert get_attr_names(expr.and_(expr.eq("a", 1), expr.or_(
+        expr.eq("b.name", 1), expr.eq("a", 2)))) == {"a", "b.name"}
+
+
+def test_flatten():
+    a, b, c = expr.eq("a", 1), expr.eq("b", 1), expr.eq("c", 1)
+
+    assert flatten(expr.and_(a, expr.and_(b, c)), expr.AndExpr) == [a, b, c]
+    assert flatten(expr.and_(a, expr.or_(b, c)), expr.AndExpr)[0] is a
+    assert len(flatten(expr.and_(a, expr.or_(b, c)), expr.AndExpr)) == 2
+    assert flatten(a, expr.OrExpr) == [a]
+
+
+def test_optimize_orders_by_selectivity():
+    statistics = PlannerStatistics()
+    ne, eq, is_not = expr.neq("a", 1), expr.eq("b", 1), expr.is_not("c", None)
+
+    optimized = optimize(expr.and_(ne, expr.and_(eq, is_not)), statistics)
+    assert flatten(optimized, expr.AndExpr) == [is_not, eq, ne]
+
+    optimized = optimize(expr.or_(eq, ne), statistics)
+    assert flatten(optimized, expr.OrExpr) == [ne, eq]
+
+    statistics.record("eq(b, ?)", 100, 99)
+    statistics.record("neq(a, ?)", 100, 1)
+    optimized = optimize(expr.and_(eq, ne), statistics)
+    assert flatten(optimized, expr.AndExpr) == [ne, eq]
+
+
+def test_optimize_keeps_guards_in_front():
+    statistics = PlannerStatistics()
+    guard, gt, eq = expr.neq("a", None), expr.gt("a", 5), expr.eq("b", 1)
+
+    optimized = optimize(expr.and_(guard, expr.and_(gt, eq)), statistics)
+    assert flatten(optimized, expr.AndExpr) == [guard, gt, eq]
+
+    query_plan = plan(expr.and_(guard, expr.and_(gt, eq)), 1000, statistics)
+    assert [condition.expr for condition in query_plan.conditions] == [guard, gt, eq]
+
+    optimized = optimize(expr.and_(expr.and_(guard, eq), gt), statistics)
+    assert flatten(optimized, expr.AndExpr) == [eq, guard, gt]
+
+
+def test_plan_full_scan():
+    statistics = PlannerStatistics()
+    query_plan = plan(expr.and_(expr.neq("a", 1), expr.eq("b", 2)), 1000, statistics)
+
+    assert query_plan.access_path == FULL_SCAN
+    assert query_plan.lookup_ids is None
+    assert [condition.fingerprint for condition in query_plan.conditions] == [
+        "eq(b, ?)", "neq(a, ?)"]
+    assert round(query_plan.estimated_rows) == 90
+    assert "full scan of 1000 documents" in query_plan.explain()
+
+
+def test_plan_id_lookup():
+    statistics = PlannerStatistics()
+    ids = [uuid.uuid4() for _ in range(3)]
+
+    query_plan = plan(
+        expr.and_(expr.is_in("id", ids), expr.and_(expr.eq("my_id", ids[0]), expr.gt("a", 2))),
+        1000, statistics, ("id", "my_id"))
+
+    assert query_plan.access_path == ID_LOOKUP
+    assert query_plan.lookup_ids == {str(ids[0])}
+    assert [condition.fingerprint for condition in query_plan.conditions] == [
+        "is_in(id, ?)", "gt(a, ?)"]
+
+    query_plan = plan(expr.or_(expr.eq("id", ids[0]), expr.gt("a", 2)), 1000, statistics)
+    assert query_plan.access_path == FULL_SCAN
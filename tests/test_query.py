@@ -1,11 +1,13 @@
 
 
 import pytest
+import datetime
 from src.nofeardb.exceptions import NoResultFoundException
 from src.nofeardb.engine import StorageEngine
+from src.nofeardb.segments import SegmentStorageEngine
 from src.nofeardb.query import Query
-from src.nofeardb.datatypes import UUID, Integer
-from src.nofeardb.orm import Document, Field
+from src.nofeardb.datatypes import UUID, DateTime, Integer, String
+from src.nofeardb.orm import Document, Field, ManyToOne, OneToMany
 import src.nofeardb.expr as expr
 
 
@@ -101,3 +103,436 @@ def test_query_empty_result(mocker):
         engine.read(TestDoc).first()
 
     assert engine.read(TestDoc).all() == []
+
+
+def create_ordered_docs():
+    class TestDoc(Document):
+        uuid = Field(UUID, primary_key=True)
+        int_field = Field(Integer)
+        int_field2 = Field(Integer)
+
+    docs = []
+    for i in [3, 1, None, 4, 1, 5, 9, 2, 6]:
+        doc = TestDoc()
+        doc.int_field = i
+        doc.int_field2 = len(docs)
+        docs.append(doc)
+
+    return docs
+
+
+def test_query_order_by():
+    docs = create_ordered_docs()
+
+    result = Query(docs).order_by("int_field").all()
+    assert [doc.int_field for doc in result] == [None, 1, 1, 2, 3, 4, 5, 6, 9]
+
+    result = Query(docs).order_by("int_field", desc=True).all()
+    assert [doc.int_field for doc in result] == [9, 6, 5, 4, 3, 2, 1, 1, None]
+
+    assert Query(docs).order_by("int_field").first().int_field is None
+    assert Query(docs).order_by("int_field").last().int_field == 9
+
+
+def test_query_order_by_multiple_keys():
+    docs = create_ordered_docs()
+
+    result = Query(docs).order_by("int_field").order_by(
+        "int_field2", desc=True).all()
+    assert [(doc.int_field, doc.int_field2) for doc in result][:3] == [
+        (None, 2), (1, 4), (1, 1)]
+
+    result = Query(docs).order_by("int_field", desc=True).order_by(
+        "int_field2", desc=True).all()
+    assert [(doc.int_field, doc.int_field2) for doc in result][-3:] == [
+        (1, 4), (1, 1), (None, 2)]
+
+
+def test_query_limit_offset():
+    docs = create_ordered_docs()
+
+    assert Query(docs).limit(2).all() == docs[:2]
+    assert Query(docs).offset(7).all() == docs[7:]
+    assert Query(docs).offset(2).limit(3).all() == docs[2:5]
+    assert Query(docs).limit(0).all() == []
+
+    result = Query(docs).order_by("int_field", desc=True).offset(1).limit(3)
+    assert [doc.int_field for doc in result.all()] == [6, 5, 4]
+    assert result.first().int_field == 6
+    assert result.last().int_field == 4
+
+    result = Query(docs).order_by("int_field").limit(3).where(
+        expr.and_(expr.is_not("int_field", None), expr.gt("int_field", 1)))
+    assert [doc.int_field for doc in result.all()] == [2, 3, 4]
+
+    with pytest.raises(NoResultFoundException):
+        Query(docs).offset(20).first()
+
+    with pytest.raises(ValueError):
+        Query(docs).limit(-1)
+
+    with pytest.raises(ValueError):
+        Query(docs).offset(-1)
+
+
+def test_query_top_k_creates_only_selected_documents(tmp_path, mocker):
+    class TopDoc(Document):
+        int_field = Field(Integer)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([TopDoc])
+    for i in range(20):
+        doc = TopDoc()
+        doc.int_field = i
+        engine.create(doc)
+
+    create_spy = mocker.spy(engine, "_create_document")
+    query = engine.read(TopDoc)
+    assert create_spy.call_count == 0
+
+    result = query.order_by("int_field", desc=True).limit(3).all()
+    assert [doc.int_field for doc in result] == [19, 18, 17]
+    assert create_spy.call_count == 3
+
+    assert query.order_by("int_field", desc=True).first() is result[0]
+    assert create_spy.call_count == 3
+
+
+def test_query_count_exists_ids():
+    docs = create_ordered_docs()
+
+    assert Query(docs).count() == 9
+    assert Query(docs).where(expr.eq("int_field", 1)).count() == 2
+    assert Query(docs).limit(4).count() == 4
+    assert Query(docs).exists()
+    assert not Query(docs).where(expr.eq("int_field", 7)).exists()
+    assert Query(docs).order_by("int_field").ids()[0] == docs[2].__id__
+    assert Query([]).ids() == []
+
+
+def test_query_count_from_listing(tmp_path, mocker):
+    class CountDoc(Document):
+        int_field = Field(Integer)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([CountDoc])
+    docs = []
+    for i in range(10):
+        doc = CountDoc()
+        doc.int_field = i
+        engine.create(doc)
+        docs.append(doc)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([CountDoc])
+    read_spy = mocker.spy(engine, "_get_document_data")
+    create_spy = mocker.spy(engine, "_create_document")
+
+    assert engine.read(CountDoc).count() == 10
+    assert engine.read(CountDoc).exists()
+    assert sorted(engine.read(CountDoc).ids()) == sorted(
+        doc.__id__ for doc in docs)
+    assert read_spy.call_count == 0
+
+    query = engine.read(CountDoc).where(expr.gte("int_field", 7))
+    assert query.count() == 3
+    assert sorted(query.ids()) == sorted(doc.__id__ for doc in docs[7:])
+    assert read_spy.call_count == 10
+    assert create_spy.call_count == 0
+
+
+@pytest.mark.parametrize("engine_class", [StorageEngine, SegmentStorageEngine])
+def test_query_skips_documents_deleted_after_listing(engine_factory, doc_factory, engine_class):
+    class DeletedDoc(Document):
+        int_field = Field(Integer)
+
+    engine = engine_factory([DeletedDoc], engine_class)
+    docs = [doc_factory(engine, DeletedDoc, int_field=i) for i in range(3)]
+    query = engine.read(DeletedDoc)
+
+    first_id = engine.read(DeletedDoc).ids()[0]
+    engine.delete(next(doc for doc in docs if doc.__id__ == first_id))
+
+    assert query.count() == 2
+    assert query.exists()
+    assert len(query.ids()) == 2
+    assert first_id not in query.ids()
+    assert query.first().__id__ != first_id
+    assert len(query.limit(2).all()) == 2
+    assert len(query.all()) == 2
+
+
+def test_query_replaced_document_reloaded(tmp_path):
+    class ReloadDoc(Document):
+        int_field = Field(Integer)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([ReloadDoc])
+    doc = ReloadDoc()
+    doc.int_field = 1
+    engine.create(doc)
+    deleted = ReloadDoc()
+    engine.create(deleted)
+
+    query = engine.read(ReloadDoc)
+    doc.int_field = 2
+    engine.update(doc)
+    engine.delete(deleted)
+
+    result = query.all()
+    assert len(result) == 1
+    assert result[0].int_field == 2
+
+
+def test_query_aggregate():
+    import src.nofeardb.aggregate as agg
+
+    docs = create_ordered_docs()
+
+    result = Query(docs).aggregate(
+        count=agg.count(),
+        values=agg.count("int_field"),
+        total=agg.sum_("int_field"),
+        average=agg.avg("int_field2"),
+        minimum=agg.min_("int_field"),
+        maximum=agg.max_("int_field"),
+    )
+    assert result == {
+        "count": 9, "values": 8, "total": 31, "average": 4.0,
+        "minimum": 1, "maximum": 9}
+
+    assert Query(docs).aggregate(parallel=True, total=agg.sum_("int_field"),
+                                 average=agg.avg("int_field")) == {"total": 31, "average": 31 / 8}
+
+    assert Query([]).aggregate(count=agg.count(), total=agg.sum_("int_field")) == {
+        "count": 0, "total": None}
+
+
+def test_query_group_by():
+    import src.nofeardb.aggregate as agg
+
+    docs = create_ordered_docs()
+    query = Query(docs).where(expr.is_in("int_field", [1, 4, 9])).group_by("int_field")
+
+    rows = query.aggregate(count=agg.count(), total=agg.sum_("int_field2"))
+    assert rows == [
+        {"int_field": 1, "count": 2, "total": 5},
+        {"int_field": 4, "count": 1, "total": 3},
+        {"int_field": 9, "count": 1, "total": 6},
+    ]
+    assert query.aggregate(parallel=True, count=agg.count(),
+                           total=agg.sum_("int_field2")) == rows
+    assert Query([]).group_by("int_field").aggregate(count=agg.count()) == []
+
+
+def test_query_aggregate_on_document_data(tmp_path, mocker):
+    import src.nofeardb.aggregate as agg
+
+    class AggDoc(Document):
+        int_field = Field(Integer)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([AggDoc])
+    for i in range(6):
+        doc = AggDoc()
+        doc.int_field = i % 3
+        engine.create(doc)
+
+    create_spy = mocker.spy(engine, "_create_document")
+    rows = engine.read(AggDoc).order_by("int_field").group_by(
+        "int_field").aggregate(count=agg.count(), total=agg.sum_("int_field"))
+
+    assert rows == [
+        {"int_field": 0, "count": 2, "total": 0},
+        {"int_field": 1, "count": 2, "total": 2},
+        {"int_field": 2, "count": 2, "total": 4},
+    ]
+    assert create_spy.call_count == 0
+
+
+def test_query_select():
+    docs = create_ordered_docs()
+
+    rows = Query(docs).order_by("int_field2", desc=True).limit(2).select(
+        "int_field", "id")
+    assert rows == [(6, docs[8].__id__), (2, docs[7].__id__)]
+    assert rows[0].int_field == 6
+    assert rows[0].id == docs[8].__id__
+    assert Query([]).select("int_field") == []
+
+
+def test_query_select_on_document_data(tmp_path, mocker):
+    class SelectDoc(Document):
+        int_field = Field(Integer)
+        date_field = Field(DateTime)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([SelectDoc])
+    doc = SelectDoc()
+    doc.int_field = 3
+    doc.date_field = datetime.datetime(2024, 1, 2, 3, 4, 5)
+    engine.create(doc)
+
+    create_spy = mocker.spy(engine, "_create_document")
+    rows = engine.read(SelectDoc).select("date_field", "int_field")
+
+    assert rows == [(datetime.datetime(2024, 1, 2, 3, 4, 5), 3)]
+    assert create_spy.call_count == 0
+
+
+def test_query_explain():
+    docs = create_ordered_docs()
+
+    query = Query(docs)
+    assert query.explain() == "access path: full scan of 9 documents"
+
+    query = query.where(expr.and_(expr.is_not("int_field", None), expr.gt("int_field", 3)))
+    explanation = query.explain()
+    assert "where 1:" in explanation
+    assert "condition 1: is_not(int_field, ?)" in explanation
+    assert "matched 8 of 9" in explanation
+    assert "condition 2: gt(int_field, ?)" in explanation
+    assert "matched 4 of 8" in explanation
+    assert "actual 4" in explanation
+
+    query = query.where(expr.eq("id", docs[3].__id__))
+    assert query.all() == [docs[3]]
+    assert "where 2:\n  access path: id lookup of 1 ids in 4 documents" in query.explain()
+
+
+def test_query_where_keeps_none_guard():
+    docs = create_ordered_docs()
+
+    # gt is estimated more selective than neq, but the guard must stay in front
+    result = Query(docs).where(expr.and_(
+        expr.neq("int_field", None), expr.gt("int_field", 5))).all()
+    assert sorted(doc.int_field for doc in result) == [6, 9]
+
+    result = Query(docs).where(expr.or_(
+        expr.is_("int_field", None), expr.lt("int_field", 2))).all()
+    assert sorted(doc.int_field or 0 for doc in result) == [0, 1, 1]
+
+
+def test_query_id_lookup_reads_only_selected_documents(tmp_path, mocker):
+    class LookupDoc(Document):
+        my_id = Field(UUID, primary_key=True)
+        int_field = Field(Integer)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([LookupDoc])
+    docs = []
+    for i in range(10):
+        doc = LookupDoc()
+        doc.int_field = i
+        engine.create(doc)
+        docs.append(doc)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([LookupDoc])
+    read_spy = mocker.spy(engine, "_get_document_data")
+
+    result = engine.read(LookupDoc).where(expr.and_(
+        expr.is_in("my_id", [docs[2].__id__, str(docs[5].__id__)]),
+        expr.gt("int_field", 3)
+    )).all()
+
+    assert [doc.__id__ for doc in result] == [docs[5].__id__]
+    assert read_spy.call_count == 2
+    assert engine.read(LookupDoc).where(
+        expr.eq("id", docs[7].__id__)).first().int_field == 7
+
+
+@pytest.mark.parametrize("make_expr", [
+    lambda doc: expr.eq("id", str(doc.__id__)),
+    lambda doc: expr.eq("id", doc.__id__),
+    lambda doc: expr.is_in("id", [str(doc.__id__)]),
+    lambda doc: expr.eq("my_id", str(doc.__id__)),
+])
+def test_query_id_condition_matches_in_lookup_and_scan(engine_factory, doc_factory, make_expr):
+    class IdMatchDoc(Document):
+        my_id = Field(UUID, primary_key=True)
+        int_field = Field(Integer)
+
+    engine = engine_factory([IdMatchDoc])
+    docs = [doc_factory(engine, IdMatchDoc, int_field=i) for i in range(3)]
+
+    lookup = engine.read(IdMatchDoc).where(make_expr(docs[1]))
+    scan = engine.read(IdMatchDoc).where(
+        expr.or_(make_expr(docs[1]), expr.gt("int_field", 5)))
+
+    assert "id lookup" in lookup.explain()
+    assert "full scan" in scan.explain()
+    assert [doc.__id__ for doc in lookup.all()] == [docs[1].__id__]
+    assert [doc.__id__ for doc in scan.all()] == [docs[1].__id__]
+
+
+class JoinCompany(Document):
+    name = Field(String)
+    departments = OneToMany("JoinDepartment", back_populates="company")
+
+
+class JoinDepartment(Document):
+    name = Field(String)
+    company = ManyToOne("JoinCompany", back_populates="departments")
+    employees = OneToMany("JoinEmployee", back_populates="department")
+
+
+class JoinEmployee(Document):
+    name = Field(String)
+    department = ManyToOne("JoinDepartment", back_populates="employees")
+
+
+def create_join_docs(engine):
+    company = JoinCompany()
+    company.name = "ACME"
+    research = JoinDepartment()
+    research.name = "R&D"
+    research.company = company
+    sales = JoinDepartment()
+    sales.name = "Sales"
+    engine.create(research)
+    engine.create(sales)
+
+    for i in range(6):
+        employee = JoinEmployee()
+        employee.name = "employee_" + str(i)
+        if i < 5:
+            employee.department = research if i % 2 == 0 else sales
+        engine.create(employee)
+
+
+def test_query_where_joined_attribute(tmp_path, mocker):
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([JoinCompany, JoinDepartment, JoinEmployee])
+    create_join_docs(engine)
+
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([JoinCompany, JoinDepartment, JoinEmployee])
+    read_spy = mocker.spy(engine, "_get_document_data")
+
+    result = engine.read(JoinEmployee).where(
+        expr.eq("department.name", "R&D")).order_by("name").select("name")
+
+    assert [row.name for row in result] == [
+        "employee_0", "employee_2", "employee_4"]
+    # every employee and department is read once
+    assert read_spy.call_count == 6 + 2
+
+    assert engine.read(JoinEmployee).where(
+        expr.eq("department.company.name", "ACME")).count() == 3
+    assert engine.read(JoinEmployee).where(
+        expr.is_("department.name", None)).count() == 1
+
+    with pytest.raises(ValueError):
+        engine.read(JoinDepartment).where(expr.eq("employees.name", "a")).all()
+
+
+def test_query_where_joined_attribute_on_documents(tmp_path):
+    engine = StorageEngine(str(tmp_path))
+    engine.register_models([JoinCompany, JoinDepartment, JoinEmployee])
+    create_join_docs(engine)
+    employees = engine.read(JoinEmployee).all()
+
+    result = Query(employees).where(expr.eq("department.name", "Sales")).all()
+
+    assert sorted(doc.name for doc in result) == ["employee_1", "employee_3"]
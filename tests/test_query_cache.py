@@ -0,0 +1,98 @@
+# pylint: skip-file
+
+import src.nofeardb.expr as expr
+from src.nofeardb.datatypes import Integer, String
+from src.nofeardb.orm import Document, Field, ManyToOne, OneToMany
+
+
+class CacheTeam(Document):
+    __documentname__ = "cache_team"
+
+    name = Field(String)
+    players = OneToMany("CachePlayer", back_populates="team")
+
+
+class CachePlayer(Document):
+    __documentname__ = "cache_player"
+
+    score = Field(Integer)
+    team = ManyToOne("CacheTeam", back_populates="players")
+
+
+MODELS = [CacheTeam, CachePlayer]
+
+
+def _scores(query):
+    return sorted(player.score for player in query.all())
+
+
+def test_query_cache(engine_factory, doc_factory):
+    writer = engine_factory(MODELS)
+    for score in range(5):
+        doc_factory(writer, CachePlayer, score=score)
+
+    engine = engine_factory(MODELS, query_cache_size=10, instrumentation=True)
+    assert _scores(engine.read(CachePlayer).where(expr.gte("score", 3))) == [3, 4]
+    assert engine.stats()["query_cache_misses"] == 1
+
+    query = engine.read(CachePlayer).where(expr.gte("score", 3))
+    assert _scores(query) == [3, 4]
+    assert engine.stats()["query_cache_hits"] == 1
+    assert "result cache" in query.explain()
+    assert engine.read(CachePlayer).where(expr.gte("score", 3)).count() == 2
+
+    # other values are another result
+    assert _scores(engine.read(CachePlayer).where(expr.gte("score", 4))) == [4]
+    # chained where conditions are evaluated on the cached result
+    assert _scores(engine.read(CachePlayer).where(
+        expr.gte("score", 3)).where(expr.lt("score", 4))) == [3]
+
+    documents_read = engine.stats()["documents_read"]
+    doc_factory(writer, CachePlayer, score=10)
+    assert _scores(engine.read(CachePlayer).where(expr.gte("score", 3))) == [3, 4, 10]
+    # the unchanged documents are taken from the data cache
+    assert engine.stats()["documents_read"] == documents_read + 1
+
+
+def test_query_cache_own_writes(engine_factory, doc_factory):
+    engine = engine_factory(MODELS, query_cache_size=10)
+    player = doc_factory(engine, CachePlayer, score=1)
+    assert _scores(engine.read(CachePlayer).where(expr.eq("score", 1))) == [1]
+
+    player.score = 2
+    engine.update(player)
+    assert _scores(engine.read(CachePlayer).where(expr.eq("score", 1))) == []
+    assert _scores(engine.read(CachePlayer).where(expr.eq("score", 2))) == [2]
+
+    engine.delete(player)
+    assert _scores(engine.read(CachePlayer).where(expr.eq("score", 2))) == []
+
+
+def test_query_cache_related_documents(engine_factory, doc_factory):
+    engine = engine_factory(MODELS, query_cache_size=10)
+    team = doc_factory(engine, CacheTeam, name="red")
+    doc_factory(engine, CachePlayer, score=1, team=team)
+
+    assert _scores(engine.read(CachePlayer).where(expr.eq("team.name", "red"))) == [1]
+
+    writer = engine_factory(MODELS)
+    team = writer.read(CacheTeam).first()
+    team.name = "blue"
+    writer.update(team)
+
+    assert _scores(engine.read(CachePlayer).where(expr.eq("team.name", "red"))) == []
+
+
+def test_query_cache_eviction(engine_factory, doc_factory):
+    engine = engine_factory(MODELS, query_cache_size=2, instrumentation=True)
+    for score in range(3):
+        doc_factory(engine, CachePlayer, score=score)
+
+    for score in range(3):
+        engine.read(CachePlayer).where(expr.eq("score", score)).all()
+    engine.read(CachePlayer).where(expr.eq("score", 2)).all()
+    engine.read(CachePlayer).where(expr.eq("score", 0)).all()
+
+    stats = engine.stats()
+    assert stats["query_cache_hits"] == 1
+    assert stats["query_cache_misses"] == 4
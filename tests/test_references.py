@@ -0,0 +1,175 @@
+# pylint: skip-file
+
+import os
+import pytest
+
+import src.nofeardb.expr as expr
+from src.nofeardb.datatypes import String
+from src.nofeardb.engine import StorageEngine
+from src.nofeardb.orm import Document, Field, ManyToMany, ManyToOne, OneToMany
+from src.nofeardb.references import ReverseIndex, get_reference_ids
+from src.nofeardb.segments import SegmentStorageEngine
+
+
+class RefDepartment(Document):
+    __documentname__ = "ref_department"
+
+    name = Field(String)
+    employees = OneToMany("RefEmployee", back_populates="department")
+
+
+class RefEmployee(Document):
+    __documentname__ = "ref_employee"
+
+    name = Field(String)
+    department = ManyToOne("RefDepartment", back_populates="employees")
+    projects = ManyToMany("RefProject", back_populates="employees")
+
+
+class RefProject(Document):
+    __documentname__ = "ref_project"
+
+    employees = ManyToMany("RefEmployee", back_populates="projects")
+
+
+MODELS = [RefDepartment, RefEmployee, RefProject]
+
+
+def test_get_reference_ids():
+    assert get_reference_ids(None) == set()
+    assert get_reference_ids("a") == {"a"}
+    assert get_reference_ids([None]) == set()
+    assert get_reference_ids(["a", "b"]) == {"a", "b"}
+
+
+def test_reverse_index_update(tmp_path):
+    index = ReverseIndex(str(tmp_path))
+
+    index.update("coll", ["rel"], "s1", None, {"rel": ["t1", "t2"]})
+    index.update("coll", ["rel"], "s2", None, {"rel": ["t1"]})
+    assert sorted(index.get("coll", "rel", ["t1"])) == ["s1", "s2"]
+    assert index.get("coll", "rel", ["t2"]) == ["s1"]
+
+    index.update("coll", ["rel"], "s1", {"rel": ["t1", "t2"]}, {"rel": ["t1"]})
+    assert index.get("coll", "rel", ["t2"]) == []
+    assert not os.path.exists(os.path.join(
+        index.get_relationship_path("coll", "rel"), "t2"))
+
+    index.update("coll", ["rel"], "s2", {"rel": ["t1"]}, None)
+    assert index.get("coll", "rel", ["t1"]) == ["s1"]
+
+    assert not index.is_complete("coll", "rel")
+    index.mark_complete("coll", "rel")
+    assert index.is_complete("coll", "rel")
+    index.clear("coll", "rel")
+    assert not index.is_complete("coll", "rel")
+
+
+def test_reverse_index_add_concurrent_remove(tmp_path, mocker):
+    index = ReverseIndex(str(tmp_path))
+    target_path = os.path.join(index.get_relationship_path("coll", "rel"), "t1")
+    open_file = os.open
+    calls = []
+
+    def open_after_remove(path, flags):
+        # a concurrent remove deletes the empty directory after makedirs
+        if len(calls) == 0:
+            os.rmdir(target_path)
+        calls.append(path)
+        return open_file(path, flags)
+
+    mocker.patch("os.open", side_effect=open_after_remove)
+    index.add("coll", "rel", "t1", "s1")
+
+    assert len(calls) == 2
+    assert index.get("coll", "rel", ["t1"]) == ["s1"]
+
+
+@pytest.mark.parametrize("engine_type", [StorageEngine, SegmentStorageEngine])
+def test_referencing_ids_maintained_on_writes(engine_factory, engine_type):
+    engine = engine_factory(MODELS, engine_type, reverse_index=True)
+    rnd = RefDepartment()
+    sales = RefDepartment()
+    employees = [RefEmployee() for _ in range(3)]
+    for employee in employees:
+        employee.department = rnd
+    engine.create(rnd)
+    engine.create(sales)
+
+    assert engine.build_reverse_index(RefEmployee) == 3
+    assert sorted(engine.get_referencing_ids(RefEmployee, "department", rnd)) == sorted(
+        employee.__id__ for employee in employees)
+
+    employees[0].department = sales
+    engine.update(employees[0])
+    engine.delete(employees[1])
+
+    assert engine.get_referencing_ids(
+        RefEmployee, "department", rnd) == [employees[2].__id__]
+    assert engine.get_referencing_ids(
+        RefEmployee, "department", str(sales.__id__)) == [employees[0].__id__]
+
+
+def test_referencing_ids_without_index(engine_factory):
+    engine = engine_factory(MODELS, reverse_index=False)
+    rnd = RefDepartment()
+    employee = RefEmployee()
+    project = RefProject()
+    employee.department = rnd
+    employee.projects = [project]
+    engine.create(employee)
+
+    assert engine.get_referencing_ids(
+        RefEmployee, "department", rnd) == [employee.__id__]
+    assert engine.get_referencing_ids(
+        RefEmployee, "projects", project.__id__) == [employee.__id__]
+
+    with pytest.raises(ValueError):
+        engine.get_referencing_ids(RefEmployee, "name", rnd)
+
+    with pytest.raises(RuntimeError):
+        engine.build_reverse_index(RefEmployee)
+
+
+def test_where_uses_reverse_index(engine_factory, doc_factory, mocker):
+    engine = engine_factory(MODELS, reverse_index=True)
+    rnd = RefDepartment()
+    sales = RefDepartment()
+    for index in range(10):
+        doc_factory(engine, RefEmployee, name="employee " + str(index),
+                    department=rnd if index < 2 else sales)
+    engine.build_reverse_index(RefEmployee)
+
+    read_spy = mocker.spy(engine, "_get_document_data")
+    query = engine.read(RefEmployee).where(expr.eq("department", rnd))
+
+    assert sorted(query.select("name")) == [("employee 0",), ("employee 1",)]
+    assert read_spy.call_count == 2
+    assert "reference index lookup of 2 ids in 10 documents" in query.explain()
+
+
+@pytest.mark.parametrize("reverse_index", [True, False])
+def test_where_reference_same_result_with_and_without_index(
+        engine_factory, doc_factory, reverse_index):
+    engine = engine_factory(MODELS, reverse_index=reverse_index)
+    rnd = RefDepartment()
+    sales = RefDepartment()
+    for index in range(4):
+        doc_factory(engine, RefEmployee, name="employee " + str(index),
+                    department=rnd if index == 0 else sales)
+    if reverse_index:
+        engine.build_reverse_index(RefEmployee)
+
+    query = engine.read(RefEmployee).where(expr.eq("department", rnd))
+    assert query.select("name") == [("employee 0",)]
+    assert ("reference index lookup" in query.explain()) == reverse_index
+
+    query = engine.read(RefEmployee).where(expr.is_in("department", [rnd, sales]))
+    assert len(query.all()) == 4
+
+    query = engine.read(RefEmployee).where(expr.neq("department", rnd))
+    assert len(query.all()) == 3
+
+    query = engine.read(RefEmployee).where(expr.eq("department", str(rnd.__id__)))
+    assert query.all() == []
+    assert "reference index lookup" not in query.explain()
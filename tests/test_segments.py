@@ -0,0 +1,286 @@
+# pylint: skip-file
+
+import os
+import time
+import pytest
+
+from src.nofeardb.datatypes import Integer, String
+from src.nofeardb.enums import DocumentStatus
+from src.nofeardb.exceptions import DocumentLockException
+from src.nofeardb.orm import Document, Field, ManyToOne, OneToMany
+from src.nofeardb.segments import (
+    FLAG_PUT, FLAG_TOMBSTONE, SegmentIndex, SegmentLock, SegmentStorageEngine, encode_record,
+    segment_name
+)
+
+
+class SegmentParent(Document):
+    __documentname__ = "segment_parent"
+
+    name = Field(String)
+    number = Field(Integer)
+    children = OneToMany("SegmentChild", back_populates="parent")
+
+
+class SegmentChild(Document):
+    __documentname__ = "segment_child"
+
+    name = Field(String)
+    parent = ManyToOne("SegmentParent", back_populates="children")
+
+
+MODELS = [SegmentParent, SegmentChild]
+
+
+def segment_files(engine, doc_type):
+    base_path = engine.get_doc_basepath(doc_type)
+    return sorted(name for name in os.listdir(base_path) if name.endswith(".seg"))
+
+
+def test_create_and_read(engine_factory):
+    engine = engine_factory(MODELS, SegmentStorageEngine)
+    parent = SegmentParent()
+    parent.name = "parent"
+    parent.number = 3
+    child = SegmentChild()
+    child.name = "child"
+    child.parent = parent
+    engine.create(parent)
+
+    assert segment_files(engine, SegmentParent) == [segment_name(1)]
+    assert segment_files(engine, SegmentChild) == [segment_name(1)]
+
+    engine = engine_factory(MODELS, SegmentStorageEngine)
+    parents = engine.read(SegmentParent).all()
+    assert len(parents) == 1
+    assert parents[0].__id__ == parent.__id__
+    assert parents[0].name == "parent"
+    assert parents[0].number == 3
+    assert parents[0].children[0].__id__ == child.__id__
+    assert parents[0].children[0].name == "child"
+
+
+def test_update_appends_record(engine_factory, doc_factory):
+    engine = engine_factory(MODELS, SegmentStorageEngine)
+    parent = doc_factory(engine, SegmentParent, name="first")
+    size = os.path.getsize(os.path.join(
+        engine.get_doc_basepath(SegmentParent), segment_name(1)))
+
+    parent.name = "second"
+    engine.update(parent)
+
+    assert os.path.getsize(os.path.join(
+        engine.get_doc_basepath(SegmentParent), segment_name(1))) > size
+
+    parents = engine_factory(MODELS, SegmentStorageEngine).read(SegmentParent).all()
+    assert len(parents) == 1
+    assert parents[0].name == "second"
+
+
+def test_unchanged_write_skipped(engine_factory, doc_factory):
+    engine = engine_factory(MODELS, SegmentStorageEngine)
+    parent = doc_factory(engine, SegmentParent)
+
+    parent.__status__ = DocumentStatus.MOD
+    engine.update(parent)
+
+    assert engine.stats()["documents_written"] == 1
+    assert engine.stats()["writes_skipped"] == 1
+
+
+def test_delete_writes_tombstone(engine_factory, doc_factory):
+    engine = engine_factory(MODELS, SegmentStorageEngine)
+    parent = doc_factory(engine, SegmentParent)
+    other = doc_factory(engine, SegmentParent)
+
+    engine.delete(parent)
+
+    parents = engine_factory(MODELS, SegmentStorageEngine).read(SegmentParent).all()
+    assert [doc.__id__ for doc in parents] == [other.__id__]
+
+
+def test_new_segment_started(engine_factory, doc_factory):
+    engine = engine_factory(MODELS, SegmentStorageEngine, segment_size=100)
+    for _ in range(3):
+        doc_factory(engine, SegmentParent)
+
+    assert len(segment_files(engine, SegmentParent)) == 3
+    assert len(engine_factory(MODELS, SegmentStorageEngine).read(SegmentParent).all()) == 3
+
+
+def test_torn_record_ignored_and_truncated(engine_factory, doc_factory):
+    engine = engine_factory(MODELS, SegmentStorageEngine)
+    parent = doc_factory(engine, SegmentParent)
+    path = os.path.join(engine.get_doc_basepath(
+        SegmentParent), segment_name(1))
+    size = os.path.getsize(path)
+
+    record = encode_record(FLAG_PUT, ".json", "torn", "hash", b"{}")
+    with open(path, "ab") as f:
+        f.write(record[:-3])
+
+    other_engine = engine_factory(MODELS, SegmentStorageEngine)
+    assert len(other_engine.read(SegmentParent).all()) == 1
+
+    doc_factory(other_engine, SegmentParent)
+    index = SegmentIndex(engine.get_doc_basepath(SegmentParent))
+    index.refresh()
+    assert len(index.entries) == 2
+    assert index.scanned[segment_name(1)] == os.path.getsize(path)
+    assert os.path.getsize(path) > size
+
+
+def test_corrupt_record_header_ignored(engine_factory, doc_factory):
+    engine = engine_factory(MODELS, SegmentStorageEngine)
+    parent = doc_factory(engine, SegmentParent)
+    path = os.path.join(engine.get_doc_basepath(
+        SegmentParent), segment_name(1))
+
+    # a record whose flags were corrupted to a tombstone
+    record = bytearray(encode_record(FLAG_PUT, ".json", str(parent.__id__), "hash", b"{}"))
+    record[4] = FLAG_TOMBSTONE
+    with open(path, "ab") as f:
+        f.write(bytes(record))
+
+    assert len(engine_factory(MODELS, SegmentStorageEngine).read(SegmentParent).all()) == 1
+
+
+def test_compact(engine_factory, doc_factory):
+    engine = engine_factory(MODELS, SegmentStorageEngine, segment_size=100)
+    parent = doc_factory(engine, SegmentParent)
+    for number in range(5):
+        parent.number = number
+        engine.update(parent)
+    other = doc_factory(engine, SegmentParent)
+    engine.delete(other)
+
+    assert len(segment_files(engine, SegmentParent)) > 1
+
+    reclaimed = engine.compact(SegmentParent)
+
+    assert reclaimed > 0
+    assert len(segment_files(engine, SegmentParent)) == 1
+    parents = engine_factory(MODELS, SegmentStorageEngine).read(SegmentParent).all()
+    assert len(parents) == 1
+    assert parents[0].number == 4
+
+
+def test_reader_follows_compaction(engine_factory, doc_factory):
+    engine = engine_factory(MODELS, SegmentStorageEngine)
+    parent = doc_factory(engine, SegmentParent, name="parent")
+    parent.name = "renamed"
+    engine.update(parent)
+
+    reader = engine_factory(MODELS, SegmentStorageEngine)
+    assert reader.read(SegmentParent).all()[0].name == "renamed"
+
+    engine.compact(SegmentParent)
+    reader._data_cache = {}
+
+    assert reader.read(SegmentParent).all()[0].name == "renamed"
+
+
+def test_migrate(engine_factory, doc_factory):
+    engine = engine_factory(MODELS, SegmentStorageEngine)
+    parent = doc_factory(engine, SegmentParent, name="parent")
+
+    assert engine.migrate(SegmentParent, "marshal") == 1
+    assert engine.migrate(SegmentParent, "marshal") == 0
+
+    index = SegmentIndex(engine.get_doc_basepath(SegmentParent))
+    index.refresh()
+    assert index.entries[str(parent.__id__)].extension == ".marshal"
+    assert engine_factory(MODELS, SegmentStorageEngine).read(
+        SegmentParent).all()[0].name == "parent"
+
+
+def test_background_compaction(engine_factory, doc_factory):
+    engine = engine_factory(
+        MODELS, SegmentStorageEngine, compaction_interval=0.01, compaction_threshold=0.5)
+    parent = doc_factory(engine, SegmentParent)
+    for number in range(5):
+        parent.number = number
+        engine.update(parent)
+
+    deadline = time.monotonic() + 5
+    index = SegmentIndex(engine.get_doc_basepath(SegmentParent))
+    while time.monotonic() < deadline:
+        index.reset()
+        index.refresh()
+        if index.garbage_ratio() == 0.0:
+            break
+        time.sleep(0.01)
+
+    engine.close()
+    assert index.garbage_ratio() == 0.0
+    assert engine_factory(MODELS, SegmentStorageEngine).read(SegmentParent).all()[0].number == 4
+
+
+def test_segment_lock(tmp_path):
+    lock_path = str(tmp_path / "segments.lock")
+    with SegmentLock(lock_path):
+        assert os.path.exists(lock_path)
+        with pytest.raises(DocumentLockException):
+            SegmentLock(lock_path, timeout=0).lock()
+
+    assert not os.path.exists(lock_path)
+
+
+def test_segment_lock_expired(tmp_path):
+    lock_path = str(tmp_path / "segments.lock")
+    with open(lock_path, "w") as f:
+        f.write("")
+    os.utime(lock_path, (time.time() - 100, time.time() - 100))
+
+    with SegmentLock(lock_path, timeout=0):
+        assert os.path.exists(lock_path)
+
+
+def test_segment_lock_expired_taken_over_once(tmp_path, mocker):
+    lock_path = str(tmp_path / "segments.lock")
+    with open(lock_path, "w") as f:
+        f.write("")
+    os.utime(lock_path, (time.time() - 100, time.time() - 100))
+
+    other_lock = SegmentLock(lock_path)
+    original_is_expired = SegmentLock._is_lock_expired
+    taken_over = []
+
+    def take_over_meanwhile(lock):
+        # another process takes the expired lock over and acquires it first
+        expired = original_is_expired(lock)
+        if lock is not other_lock and len(taken_over) == 0:
+            taken_over.append(lock)
+            other_lock.lock()
+        return expired
+
+    mocker.patch.object(SegmentLock, "_is_lock_expired", take_over_meanwhile)
+    with pytest.raises(DocumentLockException):
+        SegmentLock(lock_path, timeout=0).lock()
+
+    assert os.listdir(str(tmp_path)) == ["segments.lock"]
+    assert time.time() - os.path.getmtime(lock_path) < 10
+
+
+def test_segment_lock_refresh(tmp_path):
+    lock_path = str(tmp_path / "segments.lock")
+    lock = SegmentLock(lock_path, expiration=1)
+    with lock:
+        os.utime(lock_path, (time.time() - 100, time.time() - 100))
+        lock._refreshed = time.monotonic() - 100
+        lock.refresh()
+
+        with pytest.raises(DocumentLockException):
+            SegmentLock(lock_path, expiration=1, timeout=0).lock()
+
+
+def test_compact_refreshes_lock(engine_factory, doc_factory, mocker):
+    engine = engine_factory(MODELS, SegmentStorageEngine)
+    for number in range(3):
+        doc_factory(engine, SegmentParent, number=number)
+
+    refresh_spy = mocker.spy(SegmentLock, "refresh")
+    engine.compact(SegmentParent)
+
+    assert refresh_spy.call_count == 4
+
@@ -0,0 +1,79 @@
+# pylint: skip-file
+
+import time
+
+import pytest
+
+import src.nofeardb.expr as expr
+from src.nofeardb.datatypes import Integer
+from src.nofeardb.orm import Document, Field
+
+
+class WarmupDoc(Document):
+    __documentname__ = "warmup_doc"
+
+    value = Field(Integer)
+
+
+class OtherWarmupDoc(Document):
+    __documentname__ = "other_warmup_doc"
+
+    value = Field(Integer)
+
+
+MODELS = [WarmupDoc, OtherWarmupDoc]
+
+
+@pytest.fixture
+def database(engine_factory, doc_factory):
+    writer = engine_factory(MODELS)
+    for value in range(5):
+        doc_factory(writer, WarmupDoc, value=value)
+
+
+def test_warmup(engine_factory, database):
+    engine = engine_factory(MODELS)
+    calls = []
+
+    warmup = engine.warmup(
+        background=False, batch_size=2, progress=lambda read, total: calls.append((read, total)))
+
+    assert warmup.done()
+    assert warmup.result() == 5
+    assert warmup.progress == 1.0
+    assert calls == [(2, 5), (4, 5), (5, 5)]
+    assert engine.stats()["documents_read"] == 5
+
+    assert len(engine.read(WarmupDoc).where(expr.gte("value", 0)).all()) == 5
+    assert engine.stats()["documents_read"] == 5
+
+
+def test_warmup_background(engine_factory, database):
+    engine = engine_factory(MODELS)
+    warmup = engine.warmup([WarmupDoc], pause=0.01)
+
+    assert warmup.result(timeout=10) == 5
+    assert engine.stats()["documents_read"] == 5
+
+
+def test_warmup_waits_for_foreground_operations(engine_factory, database):
+    engine = engine_factory(MODELS)
+    with engine._foreground():
+        warmup = engine.warmup()
+        time.sleep(0.2)
+        assert not warmup.done()
+        assert warmup.documents_read == 0
+        assert warmup.documents_total == 5
+
+    assert warmup.result(timeout=10) == 5
+
+
+def test_warmup_stop(engine_factory, database):
+    engine = engine_factory(MODELS)
+    with engine._foreground():
+        warmup = engine.warmup()
+        warmup.stop()
+        assert warmup.result(timeout=10) == 0
+
+    assert warmup.stopped
+    assert engine.stats()["documents_read"] == 0
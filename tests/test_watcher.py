@@ -0,0 +1,157 @@
+# pylint: skip-file
+
+import os
+import sys
+import time
+
+import pytest
+
+from src.nofeardb.datatypes import Integer
+from src.nofeardb.orm import Document, Field
+from src.nofeardb.watcher import DirectoryWatcher, PollingWatcher, create_watcher
+
+MODES = [
+    pytest.param("inotify", marks=pytest.mark.skipif(
+        not sys.platform.startswith("linux"), reason="inotify is only available on Linux")),
+    "poll",
+]
+
+
+class WatchedDoc(Document):
+    __documentname__ = "watched_doc"
+
+    value = Field(Integer)
+
+
+class ShardedWatchedDoc(Document):
+    __documentname__ = "sharded_watched_doc"
+    __documentshardlength__ = 1
+
+    value = Field(Integer)
+
+
+MODELS = [WatchedDoc, ShardedWatchedDoc]
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_watch_other_writers(engine_factory, doc_factory, mode):
+    writer = engine_factory(MODELS)
+    doc = doc_factory(writer, WatchedDoc, value=1)
+    reader = engine_factory(MODELS, watch=mode, watch_interval=0.01, instrumentation=True)
+    assert [d.value for d in reader.read(WatchedDoc).all()] == [1]
+    assert str(doc.__id__) in reader._data_cache
+
+    doc_factory(writer, WatchedDoc, value=2)
+    assert _wait_for(lambda: len(reader.read(WatchedDoc).all()) == 2)
+
+    writer.delete(doc)
+    assert _wait_for(lambda: len(reader.read(WatchedDoc).all()) == 1)
+    assert _wait_for(lambda: str(doc.__id__) not in reader._data_cache)
+
+    if mode == "inotify":
+        assert reader.stats()["directories_listed"] == 1
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_watch_own_writes(engine_factory, doc_factory, mode):
+    engine = engine_factory(MODELS, watch=mode, watch_interval=60, instrumentation=True)
+
+    def read_values():
+        # own writes update the listing instead of listing the directory again
+        listed = engine.stats()["directories_listed"]
+        values = sorted(d.value for d in engine.read(WatchedDoc).all())
+        assert engine.stats()["directories_listed"] == listed
+        return values
+
+    doc = doc_factory(engine, WatchedDoc, value=1)
+    assert len(engine.read(WatchedDoc).all()) == 1
+    listed = engine.stats()["directories_listed"]
+
+    doc_factory(engine, WatchedDoc, value=2)
+    assert read_values() == [1, 2]
+
+    doc.value = 3
+    engine.update(doc)
+    assert read_values() == [2, 3]
+
+    engine.delete(doc)
+    assert read_values() == [2]
+
+    # writes look up the existing document files in the watched listing as well
+    assert engine.stats()["directories_listed"] == listed
+
+    doc_factory(engine, ShardedWatchedDoc, value=4)
+    assert len(engine.read(ShardedWatchedDoc).all()) == 1
+    doc_factory(engine, ShardedWatchedDoc, value=5)
+    assert len(engine.read(ShardedWatchedDoc).all()) == 2
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_watch_shards(engine_factory, doc_factory, mode):
+    writer = engine_factory(MODELS)
+    doc_factory(writer, ShardedWatchedDoc, value=1)
+    reader = engine_factory(MODELS, watch=mode, watch_interval=0.01)
+    assert len(reader.read(ShardedWatchedDoc).all()) == 1
+
+    for value in range(2, 12):
+        doc_factory(writer, ShardedWatchedDoc, value=value)
+    assert _wait_for(lambda: len(reader.read(ShardedWatchedDoc).all()) == 11)
+
+
+def test_watcher_changes_while_listing(tmp_path):
+    directory = str(tmp_path)
+
+    def listdir(path):
+        watcher._added(path, "c")
+        watcher._removed(path, "a")
+        return ["a", "b"]
+
+    removed = []
+    watcher = DirectoryWatcher(listdir, removed.append)
+
+    assert sorted(watcher.listdir(directory)) == ["b", "c"]
+    watcher._removed(directory, "b")
+    assert watcher.listdir(directory) == ["c"]
+    assert len(removed) == 2
+
+    watcher.invalidate()
+    assert sorted(watcher.listdir(directory)) == ["b", "c"]
+
+
+def test_polling_watcher_changes_while_polling(tmp_path):
+    directory = str(tmp_path)
+    calls = []
+
+    def listdir(path):
+        calls.append(path)
+        if len(calls) == 1:
+            return ["a"]
+        if len(calls) == 2:
+            # this process adds a file after the poll listed the directory
+            watcher.file_added(os.path.join(path, "c"))
+            return ["a"]
+        return ["a", "c"]
+
+    removed = []
+    watcher = PollingWatcher(listdir, removed.append, interval=0.01)
+    try:
+        assert watcher.listdir(directory) == ["a"]
+        assert _wait_for(lambda: len(calls) >= 3)
+        assert sorted(watcher.listdir(directory)) == ["a", "c"]
+        assert removed == []
+    finally:
+        watcher.close()
+
+
+def test_create_watcher_unknown_mode():
+    with pytest.raises(ValueError):
+        create_watcher("unknown")